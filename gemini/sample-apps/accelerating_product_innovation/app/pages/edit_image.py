@@ -71,11 +71,18 @@ if st.session_state.start_editing is None or st.session_state.start_editing is T
     if canvas_result.image_data is not None and canvas_result.image_data.any():
         # Convert canvas data to a PIL Image object
         foreground = Image.fromarray(canvas_result.image_data)
+        # Reuse the merged mask image across reruns.
+        if (
+            st.session_state.merged_mask_image is None
+            or st.session_state.merged_mask_image.size != background.size
+        ):
+            st.session_state.merged_mask_image = background.copy()
         # Call image processing function, using canvas drawing as foreground
         processed_image_bytes = process_foreground_image(
             foreground_image=foreground,
             background_image=background,
             bg_editing=st.session_state.bg_editing,
+            merged_image=st.session_state.merged_mask_image,
         )
         # Store the processed image data for further use
         st.session_state.mask_image = processed_image_bytes
@@ -180,12 +180,16 @@ if st.session_state.rag_answers_gen:
         # Generate RAG answers and references
         with st.spinner("Loading answer..."):
             st.session_state.rag_search_term = search_term
+            # Render the answer as it streams in.
+            answer_placeholder = st.empty()
             (
                 st.session_state.rag_answer,
                 st.session_state.rag_answer_references,
             ) = insights.generate_insights_search_result(
-                st.session_state.rag_search_term
+                st.session_state.rag_search_term, on_text=answer_placeholder.write
             )
+            # The complete answer is displayed with its references below.
+            answer_placeholder.empty()
 
             # Get new suggestions
             with st.spinner("Getting new Suggestions"):
@@ -12,12 +12,11 @@ functionalities include:
     * Provides download and delete options for stored files.
 """
 
-import json
 import os
 
 from app.pages_utils import project, resources_store_embeddings, setup
-from app.pages_utils.pages_config import GLOBAL_CFG, PAGES_CFG
-from google.cloud import storage
+from app.pages_utils.gcs_cache import save_project_list
+from app.pages_utils.pages_config import PAGES_CFG
 import streamlit as st
 
 # Get the page configuration from the config file
@@ -28,10 +27,6 @@ setup.page_setup(page_cfg)
 PROJECT_ID = os.getenv("PROJECT_ID")
 LOCATION = os.getenv("LOCATION")
 
-# Define storage bucket
-storage_client = storage.Client(project=PROJECT_ID)
-bucket = storage_client.bucket(GLOBAL_CFG["bucket_name"])
-
 
 # Initialize project form submission state if not already initialized
 if "project_form_submitted" not in st.session_state:
@@ -95,10 +90,7 @@ if submitted:
         ] + st.session_state.product_categories
 
         # Update the projects in GCS
-        project_list_blob = bucket.blob("project_list.txt")
-        project_list_blob.upload_from_string(
-            json.dumps(st.session_state.product_categories)
-        )
+        save_project_list(st.session_state.product_categories)
 
         # Reset the new project category field
         st.session_state.new_product_category_added = None
@@ -114,6 +106,8 @@ if submitted:
         # Convert the uploaded files to data packets and upload them to GCS
         for uploaded_file in st.session_state.uploaded_files:
             resources_store_embeddings.create_and_store_embeddings(uploaded_file)
+        # Show the uploaded files in the cached file list.
+        project.invalidate_project_files()
 
 
 # Check if the project form was submitted and the file upload is complete
@@ -170,11 +164,8 @@ if st.session_state.project_form_submitted is True:
                     unsafe_allow_html=True,
                 )
 
-            # Add a download button for the file
-            file_content_blob = bucket.blob(
-                f"{st.session_state.product_category}/{file[0][len_prod_cat:]}"
-            )
-            file_contents = file_content_blob.download_as_string()
+            # Add a download button for the file, downloaded once and cached
+            file_contents = project.download_project_file(file[0])
             with list_files_columns[1]:
                 st.download_button(
                     label=":arrow_down:",
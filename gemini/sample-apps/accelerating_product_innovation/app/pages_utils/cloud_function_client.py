@@ -0,0 +1,305 @@
+"""
+This module provides a shared client for the cloud functions of the app
+(text-embedding, gemini-call and imagen-call).
+
+This module:
+    * Keeps one aiohttp session with connection pooling for all calls, on a
+      dedicated event loop so it survives Streamlit reruns.
+    * Bounds the number of in-flight requests with a global semaphore.
+    * Applies per-endpoint rate limits.
+    * Retries 429 and 5xx responses with jittered exponential backoff.
+    * Records per-endpoint latency histograms.
+    * Streams server-sent events to the caller event loop, retrying streams
+      that fail before their first event and raising IncompleteStreamError
+      in the caller for streams that fail after it.
+"""
+
+import asyncio
+import bisect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import aiohttp as cloud_function_call
+from dotenv import load_dotenv
+import streamlit as st
+
+load_dotenv()
+
+logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.DEBUG)
+
+PROJECT_ID = os.getenv("PROJECT_ID")
+LOCATION = os.getenv("LOCATION")
+
+# Maximum number of requests in flight across all endpoints.
+MAX_CONCURRENT_REQUESTS = 32
+# Requests per second allowed for every endpoint.
+RATE_LIMITS = {
+    "text-embedding": 20.0,
+    "gemini-call": 10.0,
+    "imagen-call": 5.0,
+}
+# Retries of a request answered with 429 or 5xx.
+MAX_RETRIES = 5
+# Base and cap in seconds of the exponential backoff between retries.
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+# Upper bounds in milliseconds of the latency histogram buckets.
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1_000, 2_500, 5_000, 10_000, 30_000, 60_000]
+
+
+class IncompleteStreamError(cloud_function_call.ClientPayloadError):
+    """Raised when an event stream reports an error or ends before
+    `data: [DONE]`."""
+
+
+class RateLimiter:
+    """Token bucket limiting the request rate of one endpoint."""
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Waits until a request may be sent."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.rate, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CloudFunctionClient:
+    """Connection-pooled, rate-limited client for the app cloud functions.
+
+    All requests run on a background event loop owned by the client, so
+    callers on any event loop (each asyncio.run of a Streamlit rerun) share
+    the same session, semaphore and rate limiters.
+    """
+
+    def __init__(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=self._loop.run_forever, name="cloud-functions", daemon=True
+        ).start()
+        self._session: Optional[cloud_function_call.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._rate_limiters: dict[str, RateLimiter] = {}
+        self._latencies: dict[str, list[int]] = {}
+
+    async def post(
+        self,
+        endpoint: str,
+        data: str,
+        headers: dict,
+        response_type: str = "json",
+    ) -> tuple[int, Any]:
+        """Posts a request to a cloud function.
+
+        Args:
+            endpoint (str): The name of the cloud function.
+            data (str): The request body.
+            headers (dict): The request headers.
+            response_type (str): How to read the response body, one of
+                "json", "text" or "bytes".
+
+        Returns:
+            tuple: The status of the last attempt and its body, or None if
+            the status is not 200.
+        """
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(
+                self._post(endpoint, data, headers, response_type), self._loop
+            )
+        )
+
+    async def stream(
+        self, endpoint: str, data: str, headers: dict
+    ) -> AsyncIterator[Any]:
+        """Posts a request to a cloud function streaming server-sent events.
+
+        Args:
+            endpoint (str): The name of the cloud function.
+            data (str): The request body.
+            headers (dict): The request headers.
+
+        Yields:
+            The JSON payload of every `data:` event, until `data: [DONE]`.
+            Nothing is yielded if the request fails. A stream reporting an
+            error or ending before `data: [DONE]` is a failure, retried if
+            none of its events were yielded yet.
+
+        Raises:
+            IncompleteStreamError: If the stream fails after some of its
+                events were yielded.
+        """
+        caller_loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def put(event: Any) -> None:
+            # The caller may have stopped iterating and closed its loop.
+            if not caller_loop.is_closed():
+                caller_loop.call_soon_threadsafe(events.put_nowait, event)
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._stream(endpoint, data, headers, put), self._loop
+        )
+        future.add_done_callback(lambda _: put(done))
+        try:
+            while (event := await events.get()) is not done:
+                if isinstance(event, IncompleteStreamError):
+                    raise event
+                yield event
+        finally:
+            # Stops the request if the caller stops iterating.
+            future.cancel()
+
+    async def _post(
+        self, endpoint: str, data: str, headers: dict, response_type: str
+    ) -> tuple[int, Any]:
+        """Sends the request on the client event loop and reads the body."""
+
+        async def read(response: cloud_function_call.ClientResponse) -> Any:
+            if response_type == "json":
+                return await response.json()
+            if response_type == "text":
+                return await response.text()
+            return await response.read()
+
+        return await self._request(endpoint, data, headers, read)
+
+    async def _stream(
+        self, endpoint: str, data: str, headers: dict, put: Callable[[Any], None]
+    ) -> tuple[int, Any]:
+        """Sends the request on the client event loop and forwards events."""
+
+        async def read(response: cloud_function_call.ClientResponse) -> None:
+            delivered = False
+            try:
+                async for line in response.content:
+                    line = line.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line.removeprefix("data:").strip()
+                    if payload == "[DONE]":
+                        return
+                    event = json.loads(payload)
+                    if "error" in event:
+                        raise IncompleteStreamError(
+                            f"Stream from {endpoint} failed: {event['error']}"
+                        )
+                    put(event)
+                    delivered = True
+                raise IncompleteStreamError(
+                    f"Stream from {endpoint} ended before [DONE]"
+                )
+            except (cloud_function_call.ClientError, asyncio.TimeoutError) as e:
+                # Events already delivered cannot be retried here, the
+                # failure is raised in the caller instead.
+                if not delivered:
+                    raise
+                logging.error(f"Stream from {endpoint} interrupted: {e}")
+                put(
+                    e
+                    if isinstance(e, IncompleteStreamError)
+                    else IncompleteStreamError(
+                        f"Stream from {endpoint} interrupted: {e}"
+                    )
+                )
+
+        return await self._request(endpoint, data, headers, read)
+
+    async def _request(
+        self,
+        endpoint: str,
+        data: str,
+        headers: dict,
+        read: Callable[[cloud_function_call.ClientResponse], Awaitable[Any]],
+    ) -> tuple[int, Any]:
+        """Sends the request on the client event loop, with retries."""
+        if self._session is None:
+            self._session = cloud_function_call.ClientSession(
+                connector=cloud_function_call.TCPConnector(
+                    limit=MAX_CONCURRENT_REQUESTS, ssl=False
+                )
+            )
+            self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        if endpoint not in self._rate_limiters:
+            self._rate_limiters[endpoint] = RateLimiter(RATE_LIMITS.get(endpoint, 10))
+
+        url = f"https://us-central1-{PROJECT_ID}.cloudfunctions.net/{endpoint}"
+        status = 0
+        for attempt in range(MAX_RETRIES + 1):
+            retry_after = None
+            await self._rate_limiters[endpoint].acquire()
+            async with self._semaphore:
+                start = time.perf_counter()
+                try:
+                    async with self._session.post(
+                        url, data=data, headers=headers
+                    ) as response:
+                        status = response.status
+                        if status == 200:
+                            return status, await read(response)
+                        retry_after = response.headers.get("Retry-After")
+                except (cloud_function_call.ClientError, asyncio.TimeoutError) as e:
+                    logging.warning(f"Request to {endpoint} failed: {e}")
+                    status = 0
+                finally:
+                    self._record_latency(endpoint, time.perf_counter() - start)
+
+            if status not in (0, 429) and status < 500:
+                break
+            if attempt < MAX_RETRIES:
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+                if retry_after is not None and retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+                logging.debug(f"{endpoint} answered {status}, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+        logging.error(f"Request to {endpoint} failed with status {status}")
+        return status, None
+
+    def _record_latency(self, endpoint: str, seconds: float) -> None:
+        """Adds a request latency to the endpoint histogram."""
+        histogram = self._latencies.setdefault(
+            endpoint, [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        )
+        histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+
+    def latency_histogram(self, endpoint: str) -> dict[str, int]:
+        """Gets the latency histogram of an endpoint.
+
+        Args:
+            endpoint (str): The name of the cloud function.
+
+        Returns:
+            dict: The number of requests per latency bucket, keyed by the
+            bucket upper bound in milliseconds.
+        """
+        histogram = self._latencies.get(endpoint, [0] * (len(LATENCY_BUCKETS_MS) + 1))
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [
+            f">{LATENCY_BUCKETS_MS[-1]}ms"
+        ]
+        return dict(zip(labels, histogram))
+
+
+@st.cache_resource
+def get_cloud_function_client() -> CloudFunctionClient:
+    """
+    Creates the cloud function client shared by all sessions (to be cached).
+    """
+    return CloudFunctionClient()
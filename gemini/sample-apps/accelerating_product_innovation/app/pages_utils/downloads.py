@@ -2,17 +2,29 @@
 This module provides functions for downloading generated content (emails,
 product content)
 as zip archives.
+
+The PDFs are rendered by a process pool shared by all sessions, while the
+emails are generated concurrently, and written straight into an in-memory
+zip archive.
 """
 
+import asyncio
 import base64
+from concurrent.futures import Executor, ProcessPoolExecutor
 import io
 import logging
-from typing import Any
+import multiprocessing
+import os
+from typing import Any, Iterable, Optional
 import zipfile
 
 from app.pages_utils.export_content_pdf import create_content_pdf, create_email_pdf
-from app.pages_utils.get_llm_response import generate_gemini
-from app.pages_utils.imagen import image_generation
+from app.pages_utils.get_llm_response import (
+    IncompleteGenerationError,
+    parallel_generate_search_results,
+)
+from app.pages_utils.image_store import get_image_bytes, has_image
+from app.pages_utils.imagen import fetch_generated_image
 from dotenv import load_dotenv
 import streamlit as st
 import streamlit.components.v1 as components
@@ -22,13 +34,34 @@ load_dotenv()
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.DEBUG)
 st.session_state.image_file_prefix = "email_image"
 
+# Maximum number of PDF rendering processes.
+MAX_RENDER_WORKERS = min(8, os.cpu_count() or 1)
+
+
+@st.cache_resource
+def get_render_pool() -> ProcessPoolExecutor:
+    """
+    Creates the PDF rendering process pool (to be cached).
+
+    The workers are spawned rather than forked, as forking the threads of
+    the Streamlit server could deadlock the workers.
+    """
+    return ProcessPoolExecutor(
+        max_workers=MAX_RENDER_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
 
-def generate_email(prompt: str, title: str) -> None:
-    """Generates an email PDF with the given prompt and title.
+async def generate_email(prompt: str) -> tuple[str, Optional[bytes]]:
+    """Generates the text and image of an email concurrently.
 
     Args:
         prompt (str): The prompt for the email text.
-        title (str): The title of the email.
+
+    Returns:
+        tuple: The email text, empty if its generation failed or was
+        interrupted, and the encoded email image, None if its generation
+        failed.
     """
     # Create prompt for email generation for given product idea.
     email_prompt = f"""Write an email introducing the concept for a new
@@ -38,28 +71,65 @@ def generate_email(prompt: str, title: str) -> None:
     The email should strictly not announce launch, only the concept.
     Keep the email brief."""
 
-    # Generate Email content.
-    email_text = generate_gemini(email_prompt)
-    st.session_state.email_text = email_text  # update state.
-
-    # Generate corresponding image for email copy.
-    image_generation(
-        f"""Generate a beautiful image of a {st.session_state.product_category}
+    async def generate_email_text() -> str:
+        try:
+            return await parallel_generate_search_results(email_prompt)
+        except IncompleteGenerationError as e:
+            # A truncated email is not sent to the innovation team.
+            logging.error(f"Email generation was interrupted: {e}")
+            return ""
+
+    # Generate Email content and the corresponding image for email copy.
+    email_text, image = await asyncio.gather(
+        generate_email_text(),
+        fetch_generated_image(
+            f"""Generate a beautiful image of a {st.session_state.product_category}
         in an aesthetic background. Image should be suitable for advertising.
-        Content should be written on packaging in English.""",
-        1,
-        "1:1",
-        "email_image",
+        Content should be written on packaging in English."""
+        ),
     )
+    return email_text, image
 
-    # Generate pdf containing the email content and image.
-    create_email_pdf(
-        title,
-        email_text.replace("**", ""),
-        f"email_copy_0_{title}",
-        "email_image.png",
-    )
-    st.session_state.email_files.append(f"email_copy_0_{title}.pdf")
+
+async def write_email_pdfs(
+    zip_file: zipfile.ZipFile,
+    prod_content: list[Any],
+    titles: list[str],
+    executor: Executor,
+) -> None:
+    """Generates the email of every title and writes its PDF to a zip file.
+
+    Every email PDF is rendered by the executor as soon as its email is
+    generated, and written to the zip file as soon as it is rendered.
+
+    Args:
+        zip_file (ZipFile): The zip file to write the PDFs to.
+        prod_content (list): The drafts of the products.
+        titles (list): The titles of the products.
+        executor (Executor): The executor rendering the PDFs.
+    """
+    loop = asyncio.get_running_loop()
+    product_category = st.session_state.product_category
+
+    async def render_email_pdf(index: int, title: str) -> tuple[str, bytes]:
+        email_text, image = await generate_email(prod_content[index][0]["text"])
+        if not email_text or image is None:
+            logging.warning(f"Email generation for {title} failed")
+        # Generate pdf containing the email content and image.
+        pdf_bytes = await loop.run_in_executor(
+            executor,
+            create_email_pdf,
+            title,
+            email_text.replace("**", ""),
+            image,
+            product_category,
+        )
+        return f"email_copy_0_{title}.pdf", pdf_bytes
+
+    for email_pdf in asyncio.as_completed(
+        [render_email_pdf(i, title) for i, title in enumerate(titles)]
+    ):
+        zip_file.writestr(*await email_pdf)
 
 
 def download_button(object_to_download: bytes, download_filename: str) -> str:
@@ -100,21 +170,23 @@ def download_button(object_to_download: bytes, download_filename: str) -> str:
     return html_link
 
 
-def create_zip_buffer(filenames: list[str]) -> io.BytesIO:
+def create_zip_buffer(files: Iterable[tuple[str, bytes]]) -> io.BytesIO:
     """Creates a BytesIO object containing a zip file of the specified files.
 
+    Every file is written to the zip file as soon as it is produced.
+
     Args:
-        filenames: A list of filenames to include in the zip archive.
+        files: The names and contents of the files to include in the zip
+        archive.
 
     Returns:
         An io.BytesIO object representing the zip file in memory.
     """
     zip_buffer = io.BytesIO()
 
-    with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED) as zip_file:
-        for filename in filenames:
-            with open(f"./{filename}", "rb") as pdf_file:
-                zip_file.writestr(filename, pdf_file.read())
+    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for filename, content in files:
+            zip_file.writestr(filename, content)
     return zip_buffer
 
 
@@ -141,29 +213,25 @@ def load_product_lists() -> tuple[list[list[dict[str, Any]]], list[str]]:
 def download_file() -> None:
     """Downloads the generated email files as a zip archive."""
 
+    if not st.session_state.draft_elements:
+        st.error("No drafts to download")
+        return
+
     with st.spinner("Downloading Email files ..."):
         st.session_state.email_gen = True
 
-        if st.session_state.draft_elements is not None:
-            prod_content, titles = load_product_lists()
-            # Prepare file list for the zip file
-            filenames = []
-
-            # Variable to store the name of email_file
-            email_file_title = st.session_state.assorted_prod_title
-
-            # Logic to generate content for email files.
-            for i, title in enumerate(titles):
-                st.session_state.email_files = []
-                if st.session_state.email_gen:
-                    generate_email(prod_content[i][0]["text"], title)
+        prod_content, titles = load_product_lists()
 
-                # Generate a single file for each title
-                filename = f"{st.session_state.email_files[0]}"
-                filenames.append(filename)
+        # Variable to store the name of email_file
+        email_file_title = st.session_state.assorted_prod_title
 
-            # Create the zip file in memory.
-            zip_buffer = create_zip_buffer(filenames)
+        # Generate the emails and write their PDFs into the zip file in
+        # memory.
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            asyncio.run(
+                write_email_pdfs(zip_file, prod_content, titles, get_render_pool())
+            )
 
     # Provide download button with appropriate filename
     components.html(
@@ -176,24 +244,38 @@ def download_file() -> None:
 def download_content() -> None:
     """Downloads the generated content as a zip archive."""
 
+    if not st.session_state.draft_elements:
+        st.error("No drafts to download")
+        return
+
     with st.spinner("Creating Content pdf"):
         prod_content, titles = load_product_lists()
-
-        # Call the function to generate content PDFs
-        create_content_pdf(prod_content, titles)
-
-        # Create the zip archive
-        filenames = []
-
-        # Generate filenames
-        for i in range(len(titles)):
-            filenames.append(f"content_{i}.pdf")
-
-    zip_buffer = create_zip_buffer(filenames)
+        num_products = len(prod_content) - 1
+
+        # Collect the content of every product, the pool workers can not
+        # read the session state.
+        texts = [prod_content[i][0]["text"] for i in range(num_products)]
+        image_names = [
+            f"gen_image{st.session_state.num_drafts * i + 1}"
+            for i in range(num_products)
+        ]
+        images = [
+            get_image_bytes(name) if has_image(name) else None for name in image_names
+        ]
+        categories = [st.session_state.product_category] * num_products
+
+        # Render the content PDFs in parallel and write them into the zip
+        # archive in order, as they are rendered.
+        pdfs = get_render_pool().map(
+            create_content_pdf, titles[:num_products], texts, images, categories
+        )
+        zip_buffer = create_zip_buffer(
+            (f"content_{i}.pdf", pdf_bytes) for i, pdf_bytes in enumerate(pdfs)
+        )
 
     # Prepare download button with a dynamic filename
     components.html(
-        download_button(zip_buffer.getvalue(), f"content_{titles[i]}.zip"),
+        download_button(zip_buffer.getvalue(), f"content_{titles[-1]}.zip"),
         height=0,
     )
     st.success("Downloaded Content Zip.")
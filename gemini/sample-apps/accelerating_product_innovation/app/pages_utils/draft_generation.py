@@ -3,6 +3,8 @@ This module defines the 'ProductDrafts' class, responsible
 for managing and displaying product content drafts.
 """
 
+from typing import Any
+
 from app.pages_utils.get_llm_response import generate_gemini
 import streamlit as st
 
@@ -15,6 +17,7 @@ class ProductDrafts:
       titles.
     * Display: Renders drafts in an expandable format, including both image
       and text components.
+    * Preview: Renders each draft as soon as it is generated.
     * Edit Integration: Provides buttons to trigger image editing and text
       regeneration for each draft.
     """
@@ -45,6 +48,32 @@ class ProductDrafts:
                     # Call the helper function to display drafts for this title
                     self.display_draft_row(i)
 
+    @staticmethod
+    def display_draft_preview(
+        title: str, text: str, image: Any, image_pending: bool = False
+    ) -> None:
+        """
+        Displays a draft while the drafts are still being generated.
+
+        Args:
+            title (str): The product title of the draft.
+            text (str): The text of the draft generated so far.
+            image: The generated image of the draft, None if it timed out.
+            image_pending (bool): Whether the image is still being
+                generated.
+        """
+        with st.expander(title.strip(), expanded=True):
+            img_col, text_col = st.columns(2)
+            with img_col:
+                if image_pending:
+                    st.info("Generating image...")
+                elif image is not None:
+                    st.image(image)
+                else:
+                    st.warning("Image generation timed out.")
+            with text_col:
+                st.write(text)
+
     def display_draft_row(self, title_index: int) -> None:
         """
         Displays a single row of drafts for a given product title.
@@ -59,10 +88,14 @@ class ProductDrafts:
 
             with img_col:
                 # Display the image for the current draft
-                st.image(st.session_state.draft_elements[title_index][j]["img"])
-
-                # Call the function to handle image editing interactions
-                self._handle_image_edit(title_index, j)
+                image = st.session_state.draft_elements[title_index][j]["img"]
+                if image is None:
+                    st.warning("Image generation timed out.")
+                else:
+                    st.image(image)
+
+                    # Call the function to handle image editing interactions
+                    self._handle_image_edit(title_index, j)
 
             with text_col:
                 # Display the text for the current draft
@@ -25,10 +25,13 @@ generation page.
 
 import io
 import logging
+from typing import Optional
 
 import PIL
 from PIL import Image
+from app.pages_utils.image_store import put_image
 from app.pages_utils.imagen import predict_edit_image
+import numpy as np
 import streamlit as st
 from vertexai.preview.vision_models import Image as vertex_image
 
@@ -39,6 +42,7 @@ def process_foreground_image(
     foreground_image: Image.Image,
     background_image: Image.Image,
     bg_editing: bool = False,
+    merged_image: Optional[Image.Image] = None,
 ) -> bytes:
     """
     Processes a foreground image, optionally removing white regions,
@@ -51,6 +55,9 @@ def process_foreground_image(
         background.
         bg_editing (bool, optional): If True, removes white regions from the
         foreground. Defaults to False.
+        merged_image (Image.Image, optional): An image of the size and mode
+        of the background to merge into, reused across calls instead of
+        copying the background.
 
     Returns:
         bytes: The processed and merged image data as bytes.
@@ -58,21 +65,23 @@ def process_foreground_image(
 
     # Logic to edit background (invert mask)
     if bg_editing:
-        # Get image foreground
-        foreground_data = foreground_image.getdata()
-        new_bytes = []
-        # Invert pixels.
-        for item in foreground_data:
-            if item[0] == 255 and item[1] == 255 and item[2] == 255:
-                new_bytes.append((255, 255, 255, 0))
-            else:
-                new_bytes.append((255, 255, 255, 1))
-
-        foreground_image.putdata(new_bytes)
+        # White pixels become transparent, all others almost transparent.
+        pixels = np.asarray(foreground_image)
+        white = (pixels[..., :3] == 255).all(axis=-1)
+        inverted = np.full(white.shape + (4,), 255, dtype=np.uint8)
+        inverted[..., 3] = ~white
+        foreground_image = Image.fromarray(inverted, "RGBA")
 
     # Resize and merge foreground with background
     resized_foreground = foreground_image.resize(background_image.size)
-    merged_image = background_image.copy()
+    if (
+        merged_image is not None
+        and merged_image.size == background_image.size
+        and merged_image.mode == background_image.mode
+    ):
+        merged_image.paste(background_image)
+    else:
+        merged_image = background_image.copy()
     merged_image.paste(resized_foreground, (0, 0), resized_foreground)
 
     # Convert to bytes for storage
@@ -118,8 +127,7 @@ def handle_image_upload() -> None:
     if uploaded_file is not None:
         try:
             image = Image.open(uploaded_file)
-            filename = "uploaded_image0.png"
-            image.save(filename)
+            put_image("uploaded_image0", image)
             st.session_state.start_editing = True
         except (IOError, PIL.UnidentifiedImageError) as e:
             st.error(f"Error opening image: {e}")
@@ -142,9 +150,9 @@ def save_draft_image(
         "img"
     ] = image  # Update the drafts to display updated image.
 
-    # Calculate unique image filename and save image.
+    # Calculate unique image name and store image.
     image_num = st.session_state.num_drafts * row + col + 1
-    image.save(f"gen_image{image_num}.png")
+    put_image(f"gen_image{image_num}", image)
 
     # Display the edited image on product generation image
     st.switch_page("pages/product_generation.py")
@@ -196,11 +204,8 @@ def _handle_edit_suggestion(image_index: int) -> None:
     Args:
         image_index (int): corresponding draft number of image being edited.
     """
-    # Get Byte data of the image.
-    image_data = io.BytesIO(st.session_state.suggested_images[image_index])
-    # Save image.
-    with open("suggestion1.png", "wb") as f:
-        f.write(image_data.getvalue())
+    # Store the image data.
+    put_image("suggestion1", st.session_state.suggested_images[image_index])
 
     # Update state.
     st.session_state.edit_suggestion = (
@@ -214,22 +219,20 @@ def _handle_edit_suggestion(image_index: int) -> None:
     st.rerun()
 
 
-def save_image_for_editing(image_bytes: bytes, filename: str) -> None:
+def load_image_for_editing(image_bytes: bytes) -> vertex_image:
     """
-    Saves image for image editing by Imagen
+    Prepares image for image editing by Imagen, in memory.
 
     Args:
-        image_bytes (bytes): Image bytes for the image to saved.
-        filename (str): Name of the saved file.
-    """
-    # Create a BytesIO object from the image bytes
-    image_stream = io.BytesIO(image_bytes)
-
-    # Open the image using Pillow
-    image = Image.open(image_stream)
+        image_bytes (bytes): Image bytes for the image to edit.
 
-    # Save the image as a PNG
-    image.save(f"{filename}.png", "PNG")
+    Returns:
+        The image converted to PNG, as an Imagen image.
+    """
+    # Open the image using Pillow and convert it to PNG
+    with io.BytesIO(image_bytes) as image_stream, io.BytesIO() as png_stream:
+        Image.open(image_stream).save(png_stream, "PNG")
+        return vertex_image(image_bytes=png_stream.getvalue())
 
 
 def generate_suggested_images(
@@ -248,20 +251,17 @@ def generate_suggested_images(
         mask_image (bytes): Mask defining the region to
         edit (optional).
     """
-    save_image_for_editing(image_bytes.getvalue(), "image_to_edit")
-    save_image_for_editing(mask_image, "mask")
-
     st.session_state.suggested_images = []  # Clear previous suggestions
 
     # Generated edit image results
     with st.spinner("Generating suggested images"):
         input_dict = {
             "prompt": image_prompt,
-            "image": vertex_image.load_from_file("image_to_edit.png"),
+            "image": load_image_for_editing(image_bytes.getvalue()),
         }
 
         if mask_image:
-            input_dict["mask"] = vertex_image.load_from_file("mask.png")
+            input_dict["mask"] = load_image_for_editing(mask_image)
 
         st.session_state["generated_image"] = predict_edit_image(
             instance_dict=input_dict,
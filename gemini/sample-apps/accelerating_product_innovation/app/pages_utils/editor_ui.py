@@ -6,6 +6,7 @@ editing interface.
 import io
 
 from PIL import Image
+from app.pages_utils.image_store import get_image_bytes
 import streamlit as st
 from streamlit_drawable_canvas import st_canvas
 
@@ -27,23 +28,21 @@ class ImageEditor:
         self.drawing_mode = "rect"  # Default drawing mode
         self.realtime_update = True
 
-    def load_image(self, image_file: str) -> io.BytesIO:
-        """Load an image from a local file as BytesIO.
+    def load_image(self, image_name: str) -> io.BytesIO:
+        """Load an image from the session image store as BytesIO.
         Args:
-            image_file: path to image file to be loaded.
+            image_name: name of the image to be loaded.
 
         Returns:
             Image bytes object.
         """
-        with open(image_file, "rb") as f:
-            image_data = f.read()
-        return io.BytesIO(image_data)
+        return io.BytesIO(get_image_bytes(image_name))
 
     def display_ui(self) -> tuple[st_canvas, Image.Image, io.BytesIO]:
         """Renders the main UI components of the image editor."""
         # - Load the image for editing
         image_bytes = self.load_image(
-            f"""{st.session_state.image_file_prefix}{st.session_state.image_to_edit + 1}.png"""
+            f"{st.session_state.image_file_prefix}{st.session_state.image_to_edit + 1}"
         )
         bg_image = Image.open(image_bytes)
 
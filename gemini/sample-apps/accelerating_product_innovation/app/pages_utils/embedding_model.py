@@ -3,22 +3,60 @@ Defines functions for generating text embeddings using a Vertex AI
 TextEmbeddingModel.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import os
+from typing import Iterator, Optional
+
 import backoff
+from dotenv import load_dotenv
 from google.api_core.exceptions import ResourceExhausted
 import numpy as np
 import streamlit as st
 from vertexai.preview.language_models import TextEmbeddingModel
 
+load_dotenv()
+
+# Same model version as the text-embedding cloud function.
+EMBEDDING_MODEL_NAME = "textembedding-gecko@003"
+# Request limits of the embedding model. gecko@003 accepts 250 instances per
+# request in us-central1, other regions accept as few as 5.
+MAX_BATCH_INSTANCES = int(os.getenv("EMBEDDING_MAX_BATCH_INSTANCES", "250"))
+MAX_BATCH_TOKENS = 20_000
+# Conservative estimate of characters per token, used to size batches.
+CHARS_PER_TOKEN = 3
+# Maximum number of batches embedded concurrently.
+MAX_CONCURRENT_BATCHES = 8
+
 
 @st.cache_resource
 def get_embedding_model() -> TextEmbeddingModel:
     """
     Loads embedding model (to be cached).
     """
-    embedding_model = TextEmbeddingModel.from_pretrained("textembedding-gecko")
+    embedding_model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL_NAME)
     return embedding_model
 
 
+@backoff.on_exception(backoff.expo, ResourceExhausted, max_time=60)
+def embed_batch_with_backoff(
+    text: list[str], embedding_model: Optional[TextEmbeddingModel] = None
+) -> list[list[float]]:
+    """
+    Embeds one batch of texts, retrying when the quota is exhausted.
+
+    Args:
+        text: A list of text strings within the model request limits.
+        embedding_model: The model to use, loaded if not provided. Worker
+            threads receive it from the caller.
+
+    Returns:
+        The embedding values of every text, in order.
+    """
+    embedding_model = embedding_model or get_embedding_model()
+    embeddings = embedding_model.get_embeddings(text)
+    return [each.values for each in embeddings]
+
+
 @backoff.on_exception(backoff.expo, ResourceExhausted, max_time=10)
 def embedding_model_with_backoff(text: list[str]) -> np.ndarray:
     """
@@ -27,7 +65,69 @@ def embedding_model_with_backoff(text: list[str]) -> np.ndarray:
         text: A list of text strings to process.
 
     Returns:
-        A NumPy array containing the processed embeddings.
+        A NumPy array containing the embedding of the first text.
     """
     embeddings = get_embedding_model().get_embeddings(text)
     return np.array([each.values for each in embeddings][0])
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of a text.
+
+    Args:
+        text: Text to estimate the tokens of.
+
+    Returns:
+        Estimated number of tokens, rounded up.
+    """
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def token_batches(texts: list[str]) -> Iterator[list[str]]:
+    """
+    Packs texts into batches within the model request limits.
+
+    Args:
+        texts: Texts to embed, in order.
+
+    Yields:
+        Consecutive batches of texts.
+    """
+    batch: list[str] = []
+    batch_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if batch and (
+            len(batch) == MAX_BATCH_INSTANCES
+            or batch_tokens + tokens > MAX_BATCH_TOKENS
+        ):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def embed_texts(texts: list[str]) -> np.ndarray:
+    """
+    Embeds texts in token-sized batches with bounded concurrency.
+
+    Args:
+        texts: A list of text strings to process.
+
+    Returns:
+        A (number of texts, embedding dimensions) float32 array.
+    """
+    embedding_model = get_embedding_model()
+    values: list[list[float]] = []
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_BATCHES) as executor:
+        # map preserves the order of the batches.
+        for embeddings in executor.map(
+            lambda batch: embed_batch_with_backoff(batch, embedding_model),
+            token_batches(texts),
+        ):
+            values.extend(embeddings)
+    return np.asarray(values, dtype=np.float32)
@@ -0,0 +1,537 @@
+"""
+This module stores the embeddings of a project in the GCS bucket as
+append-only binary segments instead of a single embeddings.json file.
+
+This module:
+    * Writes every upload as a new segment: a Parquet file with the chunk
+      metadata and a .npy file with the float32 embedding matrix.
+    * Keeps the list of segments in a small manifest.json.
+    * Caches downloaded segments locally and memory-maps their matrices.
+    * Deletes the embeddings of a file by dropping its segments, or by
+      tombstoning it in segments shared with other files, which are
+      compacted in the background.
+    * Migrates projects still using the legacy embeddings.json, once, and
+      records in the manifest that there is nothing left to migrate.
+    * Records the embedding model of every segment, and re-embeds segments
+      of another model so that they can be queried with the current one.
+"""
+
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Callable, Optional
+import uuid
+
+from app.pages_utils.embedding_model import EMBEDDING_MODEL_NAME, embed_texts
+from app.pages_utils.gcs_cache import get_bucket
+from dotenv import load_dotenv
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from google.cloud import storage
+import numpy as np
+import pandas as pd
+
+load_dotenv()
+
+logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.DEBUG)
+
+PROJECT_ID = os.getenv("PROJECT_ID")
+LOCATION = os.getenv("LOCATION")
+
+# Columns stored in the Parquet metadata of every segment.
+METADATA_COLUMNS = ["file_name", "chunk_number", "content"]
+# Local directory where downloaded segments are cached.
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "product_innovation_embeddings")
+# Attempts to update the manifest when it is concurrently modified.
+MANIFEST_RETRIES = 5
+# Fraction of tombstoned rows above which a segment is compacted.
+COMPACTION_THRESHOLD = 0.25
+
+
+def _store_prefix(category: str) -> str:
+    """Returns the GCS prefix of a project's embedding store."""
+    return f"{category}/embeddings"
+
+
+def _legacy_blob(category: str) -> storage.Blob:
+    """Returns the legacy embeddings.json blob of a project."""
+    return get_bucket().blob(f"{category}/embeddings.json")
+
+
+def read_manifest(category: str) -> tuple[Optional[dict], int]:
+    """Reads the manifest of a project's embedding store.
+
+    Args:
+        category (str): The project to read the manifest of.
+
+    Returns:
+        tuple: The manifest (None if the store does not exist) and its
+        generation, to be passed to write_manifest.
+    """
+    manifest_blob = get_bucket().blob(f"{_store_prefix(category)}/manifest.json")
+    try:
+        manifest = json.loads(manifest_blob.download_as_bytes())
+    except NotFound:
+        return None, 0
+    return manifest, manifest_blob.generation
+
+
+def write_manifest(category: str, manifest: dict, generation: int) -> None:
+    """Writes the manifest if it was not modified since it was read.
+
+    Args:
+        category (str): The project to write the manifest of.
+        manifest (dict): The manifest to write.
+        generation (int): The generation returned by read_manifest.
+
+    Raises:
+        PreconditionFailed: If the manifest was modified concurrently.
+    """
+    get_bucket().blob(f"{_store_prefix(category)}/manifest.json").upload_from_string(
+        json.dumps(manifest),
+        "application/json",
+        if_generation_match=generation,
+    )
+
+
+def update_manifest(category: str, update: Callable[[dict], dict]) -> dict:
+    """Applies an update to the manifest with optimistic concurrency.
+
+    Args:
+        category (str): The project to update the manifest of.
+        update: Function taking the current manifest and returning the new
+            one.
+
+    Returns:
+        dict: The manifest that was written.
+    """
+    for _ in range(MANIFEST_RETRIES):
+        manifest, generation = read_manifest(category)
+        manifest = update(manifest or {"segments": []})
+        try:
+            write_manifest(category, manifest, generation)
+            return manifest
+        except PreconditionFailed:
+            logging.debug(f"Manifest of {category} modified concurrently, retrying")
+    raise RuntimeError(f"Could not update the embedding manifest of {category}")
+
+
+def _file_rows(metadata: pd.DataFrame) -> dict[str, int]:
+    """Returns the number of rows of every file in chunk metadata."""
+    return {
+        file_name: int(rows)
+        for file_name, rows in metadata["file_name"].value_counts().items()
+    }
+
+
+def write_segment(
+    category: str, data: pd.DataFrame, model: Optional[str] = EMBEDDING_MODEL_NAME
+) -> dict:
+    """Uploads chunks and their embeddings as a new immutable segment.
+
+    Args:
+        category (str): The project the chunks belong to.
+        data (pd.DataFrame): Chunks with the metadata columns and an
+            'embedding' column.
+        model (str, optional): The embedding model of the chunks, None if
+            it is not known.
+
+    Returns:
+        dict: The manifest entry of the segment.
+    """
+    name = uuid.uuid4().hex
+    prefix = _store_prefix(category)
+    embeddings = data["embedding"].tolist()
+    dimensions = next((len(e) for e in embeddings if np.ndim(e) == 1), 0)
+    matrix = np.zeros((len(embeddings), dimensions), dtype=np.float32)
+    for row, embedding in enumerate(embeddings):
+        if np.ndim(embedding) == 1:
+            matrix[row] = embedding
+
+    # Built from plain columns so DataFrame.attrs are not serialized.
+    metadata = pd.DataFrame(
+        {column: data[column].astype(str).to_numpy() for column in METADATA_COLUMNS}
+    )
+    parquet_buffer = io.BytesIO()
+    metadata.to_parquet(parquet_buffer, index=False)
+    matrix_buffer = io.BytesIO()
+    np.save(matrix_buffer, matrix)
+
+    get_bucket().blob(f"{prefix}/{name}.parquet").upload_from_string(
+        parquet_buffer.getvalue(), "application/octet-stream"
+    )
+    get_bucket().blob(f"{prefix}/{name}.npy").upload_from_string(
+        matrix_buffer.getvalue(), "application/octet-stream"
+    )
+    return {
+        "name": name,
+        "rows": len(metadata),
+        "dimensions": dimensions,
+        "files": _file_rows(metadata),
+        "model": model,
+    }
+
+
+def append_embeddings(category: str, data: pd.DataFrame) -> None:
+    """Appends newly embedded chunks to a project.
+
+    Only the new segment and the manifest are written, the existing
+    segments are left untouched.
+
+    Args:
+        category (str): The project to append to.
+        data (pd.DataFrame): Chunks with the metadata columns and an
+            'embedding' column.
+    """
+    if data is None or data.empty:
+        return
+    manifest, _ = read_manifest(category)
+    migrate_legacy_embeddings(category, manifest)
+    segment = write_segment(category, data)
+    # Legacy files are no longer written, so a new store has none to migrate.
+    update_manifest(
+        category,
+        lambda manifest: {
+            **manifest,
+            "segments": manifest["segments"] + [segment],
+            "legacy_migrated": True,
+        },
+    )
+
+
+def _segment_files(category: str, segment: dict) -> dict[str, int]:
+    """Returns the number of rows of every file in a segment.
+
+    Segments written before the counts were kept in the manifest are read
+    once to compute them.
+    """
+    if "files" in segment:
+        return segment["files"]
+    metadata, _ = read_segment(category, segment)
+    return _file_rows(metadata)
+
+
+def _tombstoned_rows(segment: dict) -> int:
+    """Returns the number of rows of the deleted files of a segment."""
+    files = segment.get("files", {})
+    return sum(files.get(file_name, 0) for file_name in segment.get("deleted", []))
+
+
+def delete_file_embeddings(category: str, file_name: str) -> None:
+    """Deletes the embeddings of a file from a project.
+
+    Segments holding only the file are dropped from the manifest. The file
+    is tombstoned in segments shared with other files, and those segments
+    are compacted in the background once enough of their rows are
+    tombstoned. No segment is rewritten by the delete itself.
+
+    Args:
+        category (str): The project the file belongs to.
+        file_name (str): The name of the deleted file.
+    """
+    manifest, _ = read_manifest(category)
+    if manifest is None:
+        return
+    segment_files = {
+        segment["name"]: _segment_files(category, segment)
+        for segment in manifest["segments"]
+    }
+    dropped: list[dict] = []
+
+    def delete(manifest: dict) -> dict:
+        dropped.clear()
+        segments = []
+        for segment in manifest["segments"]:
+            files = segment_files.get(segment["name"]) or _segment_files(
+                category, segment
+            )
+            deleted = segment.get("deleted", [])
+            live_files = set(files) - set(deleted)
+            if file_name not in live_files:
+                segments.append(segment)
+            elif live_files == {file_name}:
+                dropped.append(segment)
+            else:
+                segments.append(
+                    {**segment, "files": files, "deleted": deleted + [file_name]}
+                )
+        return {**manifest, "segments": segments}
+
+    manifest = update_manifest(category, delete)
+    delete_segments(category, dropped)
+
+    if any(
+        _tombstoned_rows(segment) > COMPACTION_THRESHOLD * segment["rows"]
+        for segment in manifest["segments"]
+    ):
+        threading.Thread(
+            target=compact_embeddings, args=(category,), daemon=True
+        ).start()
+
+
+def compact_embeddings(category: str) -> None:
+    """Rewrites the segments with many tombstoned rows without them.
+
+    A compacted segment only replaces the original if no other file was
+    deleted from it in the meantime, otherwise it is discarded and left
+    for the next compaction.
+
+    Args:
+        category (str): The project to compact.
+    """
+    manifest, _ = read_manifest(category)
+    if manifest is None:
+        return
+
+    for segment in manifest["segments"]:
+        if _tombstoned_rows(segment) <= COMPACTION_THRESHOLD * segment["rows"]:
+            continue
+        logging.info(f"Compacting segment {segment['name']} of {category}")
+        metadata, matrix = read_segment(category, segment)
+        keep = ~metadata["file_name"].isin(segment["deleted"]).to_numpy()
+        compacted = metadata[keep].reset_index(drop=True)
+        compacted["embedding"] = list(matrix[keep])
+        new_segments = (
+            [write_segment(category, compacted, segment.get("model"))]
+            if keep.any()
+            else []
+        )
+        replace_segment(category, segment, new_segments)
+
+
+def reembed_segments(category: str, manifest: dict) -> bool:
+    """Re-embeds the segments of another embedding model than the current one.
+
+    Segments written before their model was recorded, including migrated
+    legacy files, are re-embedded as well. Tombstoned rows are dropped
+    along the way.
+
+    Args:
+        category (str): The project to re-embed.
+        manifest (dict): The current manifest of the project.
+
+    Returns:
+        bool: Whether any segment was replaced.
+    """
+    replaced = False
+    for segment in manifest["segments"]:
+        if segment.get("model") == EMBEDDING_MODEL_NAME:
+            continue
+        logging.info(
+            f"Re-embedding segment {segment['name']} of {category} "
+            f"from {segment.get('model')} to {EMBEDDING_MODEL_NAME}"
+        )
+        metadata, _ = read_segment(category, segment)
+        keep = ~metadata["file_name"].isin(segment.get("deleted", [])).to_numpy()
+        reembedded = metadata[keep].reset_index(drop=True)
+        reembedded["embedding"] = list(embed_texts(reembedded["content"].tolist()))
+        new_segments = [write_segment(category, reembedded)] if keep.any() else []
+        replaced = replace_segment(category, segment, new_segments) or replaced
+    return replaced
+
+
+def replace_segment(category: str, segment: dict, new_segments: list[dict]) -> bool:
+    """Replaces a segment in the manifest by segments rewritten from it.
+
+    The replacement only happens if the segment was not modified in the
+    meantime, otherwise the new segments are discarded and the segment is
+    left for the next rewrite.
+
+    Args:
+        category (str): The project the segment belongs to.
+        segment (dict): The manifest entry the new segments were read from.
+        new_segments (list[dict]): The manifest entries of the new segments.
+
+    Returns:
+        bool: Whether the segment was replaced.
+    """
+    replaced: list[bool] = []
+
+    def replace(manifest: dict) -> dict:
+        replaced.clear()
+        segments = []
+        for current in manifest["segments"]:
+            if current == segment:
+                replaced.append(True)
+                segments.extend(new_segments)
+            else:
+                segments.append(current)
+        return {**manifest, "segments": segments}
+
+    update_manifest(category, replace)
+    delete_segments(category, [segment] if replaced else new_segments)
+    return bool(replaced)
+
+
+def delete_segments(category: str, segments: list[dict]) -> None:
+    """Deletes the files of segments no longer listed in the manifest.
+
+    Args:
+        category (str): The project the segments belong to.
+        segments (list[dict]): The manifest entries of the segments.
+    """
+    prefix = _store_prefix(category)
+    for segment in segments:
+        for extension in (".parquet", ".npy"):
+            try:
+                get_bucket().blob(f"{prefix}/{segment['name']}{extension}").delete()
+            except NotFound:
+                pass
+
+
+def _cached_segment_file(category: str, file_name: str) -> str:
+    """Downloads a segment file unless it is already cached locally.
+
+    Segments are immutable, so a cached file never goes stale.
+    """
+    local_path = os.path.join(CACHE_DIR, category, file_name)
+    if not os.path.exists(local_path):
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        tmp_path = f"{local_path}.{uuid.uuid4().hex}.tmp"
+        get_bucket().blob(
+            f"{_store_prefix(category)}/{file_name}"
+        ).download_to_filename(tmp_path)
+        os.replace(tmp_path, local_path)
+    return local_path
+
+
+def read_segment(category: str, segment: dict) -> tuple[pd.DataFrame, np.ndarray]:
+    """Reads the metadata and the memory-mapped matrix of a segment.
+
+    Args:
+        category (str): The project the segment belongs to.
+        segment (dict): The manifest entry of the segment.
+
+    Returns:
+        tuple: The chunk metadata and the (rows, dimensions) float32 matrix.
+    """
+    metadata = pd.read_parquet(
+        _cached_segment_file(category, f"{segment['name']}.parquet")
+    )
+    matrix = np.load(
+        _cached_segment_file(category, f"{segment['name']}.npy"), mmap_mode="r"
+    )
+    return metadata, matrix
+
+
+def migrate_legacy_embeddings(category: str, manifest: Optional[dict]) -> bool:
+    """Converts a project's embeddings.json into a segment.
+
+    The legacy file is only looked up until the manifest records that it
+    was migrated. The segment is committed to the manifest before the
+    legacy file is deleted, so a failure at any step leaves the embeddings
+    readable. The manifest generation acts as the migration lock: when
+    several sessions migrate concurrently, only the first one to commit
+    appends its segment, the others discard theirs.
+
+    Args:
+        category (str): The project to migrate.
+        manifest (dict): The current manifest of the project, if any.
+
+    Returns:
+        bool: Whether a legacy file was migrated.
+    """
+    if manifest is not None and manifest.get("legacy_migrated"):
+        return False
+
+    legacy_blob = _legacy_blob(category)
+    try:
+        legacy_blob.reload()
+        generation = legacy_blob.generation
+        legacy_bytes = legacy_blob.download_as_bytes(if_generation_match=generation)
+    except (NotFound, PreconditionFailed):
+        # No legacy file, or another session migrated it first.
+        if manifest is not None:
+            update_manifest(
+                category, lambda manifest: {**manifest, "legacy_migrated": True}
+            )
+        return False
+
+    logging.info(f"Migrating {legacy_blob.name} to the segmented embedding store")
+    legacy_df = pd.DataFrame.from_dict(json.loads(legacy_bytes))
+    # The legacy file does not record the model of its embeddings.
+    segments = (
+        [write_segment(category, legacy_df, model=None)] if not legacy_df.empty else []
+    )
+    committed: list[bool] = []
+
+    def commit(manifest: dict) -> dict:
+        committed.clear()
+        if manifest.get("legacy_migrated"):
+            return manifest
+        committed.append(True)
+        return {
+            **manifest,
+            "segments": segments + manifest["segments"],
+            "legacy_migrated": True,
+        }
+
+    update_manifest(category, commit)
+    if not committed:
+        delete_segments(category, segments)
+        return False
+
+    try:
+        legacy_blob.delete(if_generation_match=generation)
+    except (NotFound, PreconditionFailed):
+        # The manifest already records the migration, the file is unused.
+        pass
+    return True
+
+
+def has_embeddings(category: str) -> bool:
+    """Checks whether a project has stored embeddings.
+
+    Args:
+        category (str): The project to check.
+
+    Returns:
+        bool: Whether the project has a store or a legacy embeddings.json.
+    """
+    manifest, _ = read_manifest(category)
+    if manifest is not None:
+        return True
+    return _legacy_blob(category).exists()
+
+
+def load_embeddings(category: str) -> Optional[pd.DataFrame]:
+    """Loads all chunks and embeddings of a project.
+
+    The embedding column holds row views of the memory-mapped segment
+    matrices, which are also available, in row order, as
+    `df.attrs["embedding_segments"]`. Segments of another embedding model
+    are re-embedded first, so all rows can be queried with the current one.
+
+    Args:
+        category (str): The project to load.
+
+    Returns:
+        A Pandas DataFrame with the chunks and their embeddings, or None if
+        the project has no stored embeddings.
+    """
+    manifest, _ = read_manifest(category)
+    if migrate_legacy_embeddings(category, manifest):
+        manifest, _ = read_manifest(category)
+    if manifest is None or not manifest["segments"]:
+        return None
+    if reembed_segments(category, manifest):
+        manifest, _ = read_manifest(category)
+
+    frames = []
+    matrices = []
+    for segment in manifest["segments"]:
+        metadata, matrix = read_segment(category, segment)
+        if segment.get("deleted"):
+            # Skip the rows of tombstoned files.
+            keep = ~metadata["file_name"].isin(segment["deleted"]).to_numpy()
+            metadata = metadata[keep].reset_index(drop=True)
+            matrix = matrix[keep]
+        frames.append(metadata)
+        matrices.append(matrix)
+
+    embedding_df = pd.concat(frames, ignore_index=True)
+    embedding_df["embedding"] = [row for matrix in matrices for row in matrix]
+    embedding_df.attrs["embedding_segments"] = matrices
+    return embedding_df
@@ -1,17 +1,25 @@
 """
 This module provides functions for creating content PDFs with specific
 layouts and formatting.
+
+The PDFs are rendered from plain text and image bytes and returned as bytes,
+without reading the session state, so that they can be rendered by pool
+workers.
 """
 
-from typing import Any
+import io
+from typing import Optional
 
 from app.pages_utils.pdf_generation import PDFRounded as pdf_generator
-from app.pages_utils.pdf_generation import add_formatted_page, check_add_page
-import streamlit as st
+from app.pages_utils.pdf_generation import add_formatted_page, add_text_pages
 
 
 def create_pdf_layout(
-    pdf: pdf_generator, content: list[str], title: str, images: list[str]
+    pdf: pdf_generator,
+    content: list[str],
+    title: str,
+    images: list[Optional[bytes]],
+    product_category: str,
 ) -> None:
     """
     Creates a PDF layout with the given content, title, and images.
@@ -20,7 +28,9 @@ def create_pdf_layout(
         pdf: The PDF object where the layout will be created.
         content: A list of strings representing the textual content of the PDF.
         title: The title of the PDF.
-        images: A list of image file names to include in the PDF.
+        images: A list of encoded images to include in the PDF, None for
+        a draft without image.
+        product_category: The product category shown in the header.
     """
 
     for j, text in enumerate(content):
@@ -33,7 +43,7 @@ def create_pdf_layout(
         pdf.multi_cell(
             180,
             5,
-            f"{title} {st.session_state.product_category}",
+            f"{title} {product_category}",
             0,
             align="C",
         )
@@ -44,49 +54,33 @@ def create_pdf_layout(
         # Add image
         pdf.set_font("Arial", "B", 11)
         pdf.set_xy(17, 25)
-        image_path = f"gen_image{images[j]}.png"
-        pdf.image(image_path, x=60, y=40, w=90, h=70)
+        if images[j] is not None:
+            pdf.image(io.BytesIO(images[j]), x=60, y=40, w=90, h=70)
 
         # Add text content, handling potential page breaks
-        pages = check_add_page(pdf, text)
-        pdf.set_font("Arial", "", 11)
-
-        for i, page in enumerate(pages):
-            if page.strip() == "":
-                continue
-
-            if i == 0:  # First page of text
-                pdf.set_xy(17, 120)
-            else:  # Subsequent pages
-                add_formatted_page(pdf)
-                pdf.set_xy(17, 15)
-                pdf.set_font("Arial", "", 11)
-
-            pdf.multi_cell(170, 5, page)  # Output the text
+        add_text_pages(pdf, text)
 
 
 def create_content_pdf(
-    product_content: list[list[dict[str, Any]]], selected_titles: list[str]
-) -> None:
-    """Creates a PDF for each product content and selected title.
+    title: str, text: str, image: Optional[bytes], product_category: str
+) -> bytes:
+    """Creates the content PDF of a product.
 
     Args:
-        product_content: A list of strings representing the
-        product content.
-        selected_titles: A list of selected titles for each product content.
-    """
-    for product_index in range(len(product_content) - 1):
-        pdf = pdf_generator()  # Create a PDF for the current product
+        title: The title of the product.
+        text: The generated content of the product.
+        image: The encoded image of the product, if any.
+        product_category: The product category shown in the header.
 
-        # Build content and image lists for the current product
-        content = [product_content[(int)(product_index)][0]["text"].replace("**", "")]
-        images = [st.session_state.num_drafts * product_index + 1]
+    Returns:
+        The PDF document as bytes.
+    """
+    pdf = pdf_generator()  # Create a PDF for the current product
 
-        # Generate the PDF layout
-        create_pdf_layout(pdf, content, selected_titles[product_index], images)
+    # Generate the PDF layout
+    create_pdf_layout(pdf, [text.replace("**", "")], title, [image], product_category)
 
-        # Save the PDF with an appropriate filename
-        pdf.output(f"content_{product_index}.pdf")
+    return bytes(pdf.output())
 
 
 def cut_string(string: str, num_characters: int) -> str:
@@ -105,8 +99,8 @@ def cut_string(string: str, num_characters: int) -> str:
 
 
 def create_email_pdf(
-    title: str, email_text: str, filename: str, image_name: str
-) -> None:
+    title: str, email_text: str, image: Optional[bytes], product_category: str
+) -> bytes:
     """Creates a PDF document from an email.
 
     The PDF document contains the email subject, body, and an image.
@@ -115,16 +109,17 @@ def create_email_pdf(
     Args:
         title: The title of the email.
         email_text: The body of the email.
-        filename: The name of the PDF file to be created.
-        image_name: The name of the image file to be included in the PDF
-        document.
+        image: The encoded image to be included in the PDF document, if
+        any.
+        product_category: The product category shown in the header.
+
+    Returns:
+        The PDF document as bytes.
     """
     pdf = pdf_generator()
 
     # Extract subject and text from email text.
-    parts = email_text.split("\n", 1)
-    subject = parts[0]
-    text = parts[1]
+    subject, _, text = email_text.partition("\n")
 
     # Add first page of pdf.
     add_formatted_page(pdf)
@@ -138,7 +133,7 @@ def create_email_pdf(
     pdf.multi_cell(
         180,
         5,
-        f"{title} {st.session_state.product_category}",
+        f"{title} {product_category}",
         0,
         align="C",
     )
@@ -151,34 +146,10 @@ def create_email_pdf(
     pdf.multi_cell(180, 5, subject, 0, align="C")
 
     # Add image to pdf object.
-    pdf.image(f"{image_name}", x=60, y=40, w=90, h=70)
-
-    # Check if new page needs to be added, and
-    # add required pages.
-    # List pages stores the text content for each page.
-    pages = check_add_page(pdf, text)
-
-    # Set font style for email body.
-    pdf.set_font("Arial", "", 11)
-
-    # Add text content to each page of pdf.
-    for i, page in enumerate(pages):
-        # Check if an empty page is encountered.
-        if page.strip() == "":
-            continue
-
-        # First page
-        if i == 0:
-            pdf.set_xy(17, 120)
-            pdf.multi_cell(170, 5, page)
-
-        # Remaining pages after the first page
-        else:
-            # Add new page.
-            add_formatted_page(pdf)
-            pdf.set_font("Arial", "", 11)
+    if image is not None:
+        pdf.image(io.BytesIO(image), x=60, y=40, w=90, h=70)
 
-            pdf.set_xy(17, 15)
-            pdf.multi_cell(170, 5, page)
+    # Add the email body, adding the required pages.
+    add_text_pages(pdf, text)
 
-    pdf.output(f"{filename}.pdf", "F")
+    return bytes(pdf.output())
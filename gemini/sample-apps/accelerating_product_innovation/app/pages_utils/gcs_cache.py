@@ -0,0 +1,65 @@
+"""
+This module provides the GCS client and bucket shared by all sessions of the
+app, and caches the list of projects stored in the bucket.
+
+Streamlit reruns a page on every interaction, so this module:
+    * Creates the storage client and bucket once, when first needed.
+    * Caches the project list across reruns and sessions.
+    * Invalidates the cached project list whenever the app changes it;
+      changes made by other instances of the app are picked up after
+      METADATA_TTL_SECONDS.
+"""
+
+import json
+import os
+
+from app.pages_utils.pages_config import GLOBAL_CFG
+from dotenv import load_dotenv
+from google.cloud import storage
+import streamlit as st
+
+load_dotenv()
+
+PROJECT_ID = os.getenv("PROJECT_ID")
+LOCATION = os.getenv("LOCATION")
+
+# Blob holding the JSON list of projects.
+PROJECT_LIST_BLOB = "project_list.txt"
+# Seconds after which cached metadata is reloaded from the bucket.
+METADATA_TTL_SECONDS = 5 * 60
+
+
+@st.cache_resource
+def get_storage_client() -> storage.Client:
+    """
+    Creates the GCS client (to be cached).
+    """
+    return storage.Client(project=PROJECT_ID)
+
+
+@st.cache_resource
+def get_bucket() -> storage.Bucket:
+    """
+    Gets the bucket of the app (to be cached).
+    """
+    return get_storage_client().bucket(GLOBAL_CFG["bucket_name"])
+
+
+@st.cache_data(ttl=METADATA_TTL_SECONDS, show_spinner=False)
+def load_project_list() -> list[str]:
+    """Loads the list of projects.
+
+    Returns:
+        list[str]: The names of the projects.
+    """
+    return json.loads(get_bucket().blob(PROJECT_LIST_BLOB).download_as_string())
+
+
+def save_project_list(projects: list[str]) -> None:
+    """Saves the list of projects and invalidates its cached copy.
+
+    Args:
+        projects (list[str]): The names of the projects.
+    """
+    get_bucket().blob(PROJECT_LIST_BLOB).upload_from_string(json.dumps(projects))
+    load_project_list.clear()
@@ -6,17 +6,37 @@ model (Gemini-Pro).
     * Utilizes the Gemini-Pro model for flexible text generation.
     * Supports customization of generation parameters.
     * Incorporates safety settings.
+    * Serves repeated prompts from a response cache shared by all sessions.
 
-* parallel_generate_search_results():
-    * Employs asynchronous requests to Gemini for search result generation.
-    * Handles potential errors during communication with the model.
+* stream_gemini():
+    * Yields the text of generate_gemini() as it is generated.
+
+* stream_search_results() and parallel_generate_search_results():
+    * Employ asynchronous streaming requests to Gemini for search result
+      generation.
+    * Handle potential errors during communication with the model,
+      restarting streams interrupted midway and raising
+      IncompleteGenerationError with the partial text if they keep failing.
 """
 
 import json
+import logging
 import os
+import time
+from typing import AsyncIterator, Callable, Iterator, Optional
 
-import aiohttp as cloud_function_call
+from app.pages_utils.cloud_function_client import (
+    IncompleteStreamError,
+    get_cloud_function_client,
+)
+from app.pages_utils.embedding_model import embedding_model_with_backoff
+from app.pages_utils.response_cache import (
+    ResponseCache,
+    get_response_cache,
+    similarity_scope_key,
+)
 from dotenv import load_dotenv
+import numpy as np
 import streamlit as st
 import vertexai
 from vertexai import generative_models
@@ -29,47 +49,213 @@ LOCATION = os.getenv("LOCATION")
 
 vertexai.init(project=PROJECT_ID, location=LOCATION)
 
+GEMINI_MODEL_NAME = "gemini-pro"
+# Restarts of a gemini-call stream interrupted after its first chunk.
+STREAM_RESTARTS = 1
+
+
+class IncompleteGenerationError(Exception):
+    """Raised when a generation stream keeps being interrupted midway.
+
+    Attributes:
+        text: The text generated by the last attempt before it failed.
+    """
+
+    def __init__(self, text: str) -> None:
+        super().__init__("Generation was interrupted before it completed")
+        self.text = text
+
+
+@st.cache_resource
+def get_gemini_model() -> generative_models.GenerativeModel:
+    """
+    Loads the text generation model (to be cached).
+    """
+    return generative_models.GenerativeModel(GEMINI_MODEL_NAME)
+
+
+def _similarity_scope(similarity_scope: str) -> str:
+    """Returns the scope of a prompt in the similarity tier of the cache,
+    so that near-duplicate prompts only match within the same project."""
+    return similarity_scope_key(
+        st.session_state.get("product_category"), similarity_scope
+    )
+
+
+def _lookup_cache(
+    text_prompt: str, match_similar_prompts: bool, similarity_scope: str
+) -> tuple[str, Optional[np.ndarray], Optional[str]]:
+    """Looks up the response to a prompt in the response cache.
 
-def generate_gemini(text_prompt: str) -> str:
+    The prompt is only embedded if it is not cached as is.
+
+    Returns:
+        The config key and the prompt embedding, to cache the response
+        with, and the cached response or None.
+    """
+    config_key = ResponseCache.config_key(
+        GEMINI_MODEL_NAME, st.session_state.generation_config
+    )
+    page = st.session_state.get("current_page", "")
+    cached_response = get_response_cache().get(
+        config_key, text_prompt, page=page, count_miss=not match_similar_prompts
+    )
+    embedding = None
+    if cached_response is None and match_similar_prompts:
+        embedding = embedding_model_with_backoff([text_prompt])
+        embedding = embedding / np.linalg.norm(embedding)
+        cached_response = get_response_cache().get(
+            config_key,
+            text_prompt,
+            embedding,
+            page=page,
+            scope=_similarity_scope(similarity_scope),
+        )
+    logging.info(
+        f"Response cache metrics of page '{page}': "
+        f"{get_response_cache().page_metrics(page)}"
+    )
+    return config_key, embedding, cached_response
+
+
+def generate_gemini(
+    text_prompt: str, match_similar_prompts: bool = False, similarity_scope: str = ""
+) -> str:
     """Generates text using the Gemini-Pro model.
 
+    Responses are cached by model, generation config and prompt.
+
     Args:
         text_prompt: The text prompt to generate from.
+        match_similar_prompts: Whether to reuse the response to a prompt
+            with a near-identical embedding.
+        similarity_scope: Near-identical prompts of the project are only
+            matched if they were generated with the same scope.
 
     Returns:
         The generated text.
     """
-    model = generative_models.GenerativeModel("gemini-pro")
-    response = model.generate_content(
+    config_key, embedding, cached_response = _lookup_cache(
+        text_prompt, match_similar_prompts, similarity_scope
+    )
+    if cached_response is not None:
+        return cached_response
+
+    response = get_gemini_model().generate_content(
         text_prompt,
         generation_config=st.session_state.generation_config,
     )
+    get_response_cache().put(
+        config_key,
+        text_prompt,
+        response.text,
+        embedding,
+        _similarity_scope(similarity_scope),
+    )
     return response.text
 
 
-async def parallel_generate_search_results(query: str) -> str:
+def stream_gemini(
+    text_prompt: str, match_similar_prompts: bool = False, similarity_scope: str = ""
+) -> Iterator[str]:
+    """Streams text generated by the Gemini-Pro model.
+
+    Responses are cached like those of generate_gemini, a cached response
+    is yielded at once.
+
+    Args:
+        text_prompt: The text prompt to generate from.
+        match_similar_prompts: Whether to reuse the response to a prompt
+            with a near-identical embedding.
+        similarity_scope: Near-identical prompts of the project are only
+            matched if they were generated with the same scope.
+
+    Yields:
+        The generated text, chunk by chunk.
+    """
+    config_key, embedding, cached_response = _lookup_cache(
+        text_prompt, match_similar_prompts, similarity_scope
+    )
+    if cached_response is not None:
+        yield cached_response
+        return
+
+    start = time.perf_counter()
+    chunks = []
+    for chunk in get_gemini_model().generate_content(
+        text_prompt,
+        generation_config=st.session_state.generation_config,
+        stream=True,
+    ):
+        if not chunks:
+            logging.info(
+                f"gemini-pro time to first token: {time.perf_counter() - start:.2f}s"
+            )
+        chunks.append(chunk.text)
+        yield chunk.text
+    get_response_cache().put(
+        config_key,
+        text_prompt,
+        "".join(chunks),
+        embedding,
+        _similarity_scope(similarity_scope),
+    )
+
+
+async def stream_search_results(query: str) -> AsyncIterator[str]:
+    """Streams search results generated by the gemini-call cloud function.
+
+    Args:
+        query: The query to generate search results for.
+
+    Yields:
+        The generated search results, chunk by chunk.
+    """
+    text_query = json.dumps({"text_prompt": query, "stream": True})
+    start = time.perf_counter()
+    first_token = True
+    # Create streaming post request to get text.
+    async for event in get_cloud_function_client().stream(
+        "gemini-call", text_query, st.session_state.headers
+    ):
+        if first_token:
+            logging.info(
+                f"gemini-call time to first token: {time.perf_counter() - start:.2f}s"
+            )
+            first_token = False
+        yield event["text"]
+
+
+async def parallel_generate_search_results(
+    query: str, on_text: Optional[Callable[[str], None]] = None
+) -> str:
     """Generates search results using the gemini model in a parallel
        fashion.
 
+    A stream interrupted after it started is restarted from scratch up to
+    STREAM_RESTARTS times.
+
     Args:
         query: The query to generate search results for.
+        on_text: Called with the text generated so far every time a chunk
+            arrives. It starts over when the stream is restarted.
 
     Returns:
-        The generated search results.
+        The generated search results, empty if the request failed.
+
+    Raises:
+        IncompleteGenerationError: If the stream is still interrupted after
+            the restarts.
     """
-    text_query = json.dumps({"text_prompt": query})
-    async with cloud_function_call.ClientSession() as session:
-        url = f"https://us-central1-{PROJECT_ID}.cloudfunctions.net/gemini-call"
-        # Create post request to get text.
-        async with session.post(
-            url,
-            data=text_query,
-            headers=st.session_state.headers,
-            verify_ssl=False,
-        ) as text_response:
-            if text_response.status == 200:
-                # If response is valid, return generated text.
-                response = await text_response.json()
-                response_text = response["generated_text"]
-                return response_text
-            return ""
+    for attempt in range(STREAM_RESTARTS + 1):
+        chunks: list[str] = []
+        try:
+            async for chunk in stream_search_results(query):
+                chunks.append(chunk)
+                if on_text is not None:
+                    on_text("".join(chunks))
+            return "".join(chunks)
+        except IncompleteStreamError as e:
+            logging.warning(f"Search results interrupted (attempt {attempt + 1}): {e}")
+            error = e
+    raise IncompleteGenerationError("".join(chunks)) from error
@@ -0,0 +1,77 @@
+"""
+This module keeps the images of a session in memory, so that generated,
+uploaded and edited images are never written to the shared working
+directory, where concurrent sessions would overwrite each other's files.
+
+Images are stored as PNG bytes under the names previously used for their
+files, without the extension (e.g. "gen_image1", "uploaded_image0").
+"""
+
+import io
+from typing import Union
+
+from PIL import Image
+import streamlit as st
+
+
+def _images() -> dict[str, bytes]:
+    """Returns the image store of the current session."""
+    if "image_store" not in st.session_state:
+        st.session_state.image_store = {}
+    return st.session_state.image_store
+
+
+def put_image(name: str, image: Union[Image.Image, bytes]) -> None:
+    """Stores an image for the current session.
+
+    Args:
+        name (str): The name of the image.
+        image: A PIL image, stored as PNG, or encoded image bytes.
+    """
+    if isinstance(image, Image.Image):
+        with io.BytesIO() as buffer:
+            image.save(buffer, format="PNG")
+            image = buffer.getvalue()
+    _images()[name] = image
+
+
+def has_image(name: str) -> bool:
+    """Checks whether an image is stored for the current session.
+
+    Args:
+        name (str): The name of the image.
+
+    Returns:
+        bool: Whether the image exists.
+    """
+    return name in _images()
+
+
+def get_image_bytes(name: str) -> bytes:
+    """Gets the encoded bytes of a stored image.
+
+    Args:
+        name (str): The name of the image.
+
+    Returns:
+        bytes: The encoded image.
+
+    Raises:
+        KeyError: If no image with that name is stored.
+    """
+    return _images()[name]
+
+
+def get_image(name: str) -> Image.Image:
+    """Opens a stored image.
+
+    Args:
+        name (str): The name of the image.
+
+    Returns:
+        Image.Image: The decoded image.
+
+    Raises:
+        KeyError: If no image with that name is stored.
+    """
+    return Image.open(io.BytesIO(get_image_bytes(name)))
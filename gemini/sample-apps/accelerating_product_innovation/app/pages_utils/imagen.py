@@ -13,7 +13,8 @@ import os
 from typing import Optional
 
 from PIL import Image
-import aiohttp as cloud_function_call
+from app.pages_utils.cloud_function_client import get_cloud_function_client
+from app.pages_utils.image_store import put_image
 import streamlit as st
 import vertexai
 from vertexai.preview.vision_models import ImageGenerationModel
@@ -72,7 +73,7 @@ def image_generation(
         aspect_ratio:
             The aspect ratio of the generated images.
         filename:
-            The filename to store the image.
+            The name to store the image under in the session image store.
 
     Returns:
         None.
@@ -84,7 +85,25 @@ def image_generation(
         language="en",
         aspect_ratio=aspect_ratio,
     )
-    images[0].save(location=f"{filename}.png", include_generation_parameters=False)
+    put_image(filename, images[0].__dict__["_loaded_bytes"])
+
+
+async def fetch_generated_image(prompt: str) -> Optional[bytes]:
+    """
+    Generates an image through the imagen-call cloud function.
+
+    Args:
+        prompt (String): Prompt for image Generation.
+
+    Returns:
+        The encoded image, or None if the request failed.
+    """
+    image_prompt = json.dumps({"img_prompt": prompt})
+    # Create a post request to get images.
+    status, response = await get_cloud_function_client().post(
+        "imagen-call", image_prompt, st.session_state.headers, response_type="bytes"
+    )
+    return response if status == 200 else None
 
 
 async def parallel_image_generation(prompt: str, col: int) -> Optional[Image.Image]:
@@ -95,26 +114,13 @@ async def parallel_image_generation(prompt: str, col: int) -> Optional[Image.Ima
         prompt (String): Prompt for image Generation.
         col (int): A pointer to the draft number of the image.
     """
-    image_prompt = json.dumps({"img_prompt": prompt})
-    async with cloud_function_call.ClientSession() as session:
-        url = f"https://us-central1-{PROJECT_ID}.cloudfunctions.net/imagen-call"
-        # Create a post request to get images.
-        async with session.post(
-            url,
-            data=image_prompt,
-            headers=st.session_state.headers,
-            verify_ssl=False,
-        ) as img_response:
-            # Check if response is valid.
-            if img_response.status == 200:
-                response = await img_response.read()
-
-                # Load response image.
-                response_image = Image.open(io.BytesIO(response))
-                # Save image for further use.
-                response_image.save(
-                    f"gen_image{st.session_state.num_drafts+col}.png", format="PNG"
-                )
-                return response_image
+    response = await fetch_generated_image(prompt)
+    # Check if response is valid.
+    if response is not None:
+        # Load response image.
+        response_image = Image.open(io.BytesIO(response))
+        # Store image for further use.
+        put_image(f"gen_image{st.session_state.num_drafts+col}", response)
+        return response_image
 
     return None
@@ -8,16 +8,14 @@ relevant information from uploaded data.
     * Presents the answer along with top-matched context sources.
 """
 
-import json
 import os
 import re
-from typing import Optional
+from typing import Callable, Optional
 
+from app.pages_utils import embedding_store
 from app.pages_utils.embedding_model import embedding_model_with_backoff
-from app.pages_utils.get_llm_response import generate_gemini
-from app.pages_utils.pages_config import GLOBAL_CFG
+from app.pages_utils.get_llm_response import generate_gemini, stream_gemini
 from dotenv import load_dotenv
-from google.cloud import storage
 import numpy as np
 import pandas as pd
 import streamlit as st
@@ -28,10 +26,6 @@ load_dotenv()
 PROJECT_ID = os.getenv("PROJECT_ID")
 LOCATION = os.getenv("LOCATION")
 
-# Define storage bucket
-storage_client = storage.Client(project=PROJECT_ID)
-bucket = storage_client.bucket(GLOBAL_CFG["bucket_name"])
-
 
 def extract_bullet_points(text: str) -> list[str]:
     """
@@ -73,7 +67,13 @@ def get_suggestions(state_key: str) -> None:
             should strictly be questions for further analysis of
             {st.session_state.rag_search_term}
         """
-    gen_suggestions = generate_gemini(prompt)
+    # Suggestions for near-identical contexts of the same search term can be
+    # reused, prompts for other search terms only differ in a few words.
+    gen_suggestions = generate_gemini(
+        prompt,
+        match_similar_prompts=True,
+        similarity_scope=str(st.session_state.rag_search_term),
+    )
     st.session_state[state_key] = extract_bullet_points(gen_suggestions)
 
 
@@ -83,15 +83,48 @@ def get_stored_embeddings_as_df() -> Optional[pd.DataFrame]:
     Returns:
         A Pandas DataFrame containing the embeddings, or None if not found.
     """
-    embedding = bucket.blob(st.session_state.product_category + "/embeddings.json")
-
-    if embedding.exists():
-        stored_embedding_data = embedding.download_as_string()
-        embedding_dataframe = pd.DataFrame.from_dict(json.loads(stored_embedding_data))
+    embedding_dataframe = embedding_store.load_embeddings(
+        st.session_state.product_category
+    )
+    if embedding_dataframe is not None:
         st.session_state["processed_data_list"] = embedding_dataframe
-        return embedding_dataframe
+    return embedding_dataframe
 
-    return None
+
+def get_embedding_index() -> list[np.ndarray]:
+    """Gets the embeddings of the project as float32 matrices.
+
+    The matrices are row-aligned, in order, with
+    st.session_state["processed_data_list"]. Data loaded from the embedding
+    store keeps its memory-mapped segment matrices; otherwise a single
+    matrix is built and cached in the session state until the project data
+    is reloaded. Chunks without an embedding are stored as zero rows.
+
+    Returns:
+        list[np.ndarray]: (rows, embedding dimensions) matrices.
+    """
+    processed_data_list = st.session_state["processed_data_list"]
+    segments = processed_data_list.attrs.get("embedding_segments")
+    if segments is not None and sum(map(len, segments)) == len(processed_data_list):
+        return segments
+
+    embedding_index = st.session_state.get("embedding_index")
+    if embedding_index is not None and embedding_index[0] is processed_data_list:
+        return embedding_index[1]
+
+    embeddings = processed_data_list["embedding"].tolist()
+    # Missing embeddings are None, or NaN once loaded from JSON.
+    present = [np.ndim(embedding) == 1 for embedding in embeddings]
+    dimensions = next(
+        (len(embedding) for embedding, ok in zip(embeddings, present) if ok), 0
+    )
+    matrix = np.zeros((len(embeddings), dimensions), dtype=np.float32)
+    for row, embedding in enumerate(embeddings):
+        if present[row]:
+            matrix[row] = embedding
+
+    st.session_state["embedding_index"] = (processed_data_list, [matrix])
+    return [matrix]
 
 
 def get_filter_context_from_vector_database(
@@ -112,36 +145,41 @@ def get_filter_context_from_vector_database(
     st.session_state["query_vectors"] = np.array(
         embedding_model_with_backoff([question])
     )
-    top_matched_score = (
-        st.session_state["processed_data_list"]["embedding"]
-        .apply(
-            lambda row: (
-                np.dot(row, st.session_state["query_vectors"]) if row is not None else 0
-            )
-        )
-        .sort_values(ascending=False)[:sort_index_value]
+    processed_data_list = st.session_state["processed_data_list"]
+    query_vector = st.session_state["query_vectors"].astype(np.float32)
+    scores = np.concatenate(
+        [
+            matrix @ query_vector if matrix.shape[1] else np.zeros(len(matrix))
+            for matrix in get_embedding_index()
+        ]
     )
-
-    top_matched_df = st.session_state["processed_data_list"][
-        st.session_state["processed_data_list"].index.isin(top_matched_score.index)
-    ]
-    top_matched_df = top_matched_df[["file_name", "chunk_number", "content"]]
-    top_matched_df["confidence_score"] = top_matched_score
+    top_k = min(sort_index_value, len(scores))
+    if top_k == 0:
+        top_positions = np.array([], dtype=int)
+    else:
+        top_positions = np.argpartition(-scores, top_k - 1)[:top_k]
+    # Context follows the order of the chunks in the project.
+    top_positions.sort()
+
+    top_matched_df = processed_data_list.iloc[top_positions][
+        ["file_name", "chunk_number", "content"]
+    ].copy()
+    top_matched_df["confidence_score"] = scores[top_positions]
+    context = "\n".join(top_matched_df["content"].values)
     top_matched_df.sort_values(by=["confidence_score"], ascending=False, inplace=True)
 
-    context = "\n".join(
-        st.session_state["processed_data_list"][
-            st.session_state["processed_data_list"].index.isin(top_matched_score.index)
-        ]["content"].values
-    )
     return (context, top_matched_df)
 
 
-def generate_insights_search_result(query: str) -> tuple[str, pd.DataFrame]:
+def generate_insights_search_result(
+    query: str, on_text: Optional[Callable[[str], None]] = None
+) -> tuple[str, pd.DataFrame]:
     """Generates insights search results for the given query.
 
     Args:
         query (str): The query to generate insights search results for.
+        on_text (Callable, optional): Called with the answer generated so
+            far every time a chunk of it is generated.
 
     Returns:
         tuple: A tuple containing the insights answer and the top matched
@@ -162,5 +200,9 @@ def generate_insights_search_result(query: str) -> tuple[str, pd.DataFrame]:
     Question: \n {question} \n
     Answer:"""
 
-    insights_answer = generate_gemini(question_prompt_template)
+    insights_answer = ""
+    for chunk in stream_gemini(question_prompt_template):
+        insights_answer += chunk
+        if on_text is not None:
+            on_text(insights_answer)
     return insights_answer, top_matched_df.head(5)
@@ -6,19 +6,49 @@ documents.
     * Adds a standard-format page with a light gray background and a centered
       white rectangle.
 
-* check_add_page(pdf, text):
-    * Handles potential text overflow onto subsequent pages.
+* layout_text(pdf, text):
+    * Wraps text into lines and splits the lines into pages.
+
+* add_text_pages(pdf, text):
+    * Writes text below the image of the current page, adding formatted pages
+      as needed.
 
 * Provides class for generating a pdf template for exporting content and
  emails.
+
+Words are measured once per font, keeping the most recently used widths,
+and the page frame is built once per page size, so the time to generate a
+PDF grows linearly with its text.
 """
 
 # pylint: disable=R0913
 
+from collections import OrderedDict
+from functools import lru_cache
 from math import sqrt
 
 import fpdf as pdf_generator
 
+# Position and size of the text of the exported PDFs, in mm.
+TEXT_X = 17
+TEXT_WIDTH = 170
+LINE_HEIGHT = 5
+# The first page of text starts below the header and the image.
+FIRST_PAGE_TEXT_Y = 120
+TEXT_Y = 15
+
+# Fonts and words per font whose widths are kept, least recently used first
+# evicted, as the rendering processes outlive the documents.
+MAX_CACHED_FONTS = 8
+MAX_CACHED_WORDS = 20_000
+# Page sizes whose frame is kept.
+MAX_CACHED_PAGE_SIZES = 4
+
+# Widths of the measured words, by font family, style and size.
+_word_widths: OrderedDict[
+    tuple[str, str, float], OrderedDict[str, float]
+] = OrderedDict()
+
 
 class PDFRounded(pdf_generator.FPDF):
     """
@@ -153,6 +183,29 @@ class PDFRounded(pdf_generator.FPDF):
         )
 
 
+@lru_cache(maxsize=MAX_CACHED_PAGE_SIZES)
+def _page_frame(w: float, h: float, k: float) -> str:
+    """Builds the content stream of the page frame, once per page size.
+
+    The frame is a light gray page with a white rectangle in the center,
+    drawn in a saved graphics state so that the colors of the page are kept.
+    """
+
+    def filled_rect(x: float, y: float, rect_w: float, rect_h: float) -> str:
+        return f"{x * k:.2f} {(h - y) * k:.2f} {rect_w * k:.2f} {-rect_h * k:.2f} re f"
+
+    return "\n".join(
+        [
+            "q",
+            f"{225 / 255:.3f} {230 / 255:.3f} {237 / 255:.3f} rg",
+            filled_rect(0, 0, w, h),
+            "1 g",
+            filled_rect(10, 10, w - 20, h - 20),
+            "Q",
+        ]
+    )
+
+
 def add_formatted_page(pdf: pdf_generator) -> None:
     """Adds a formatted page to the PDF document.
 
@@ -164,64 +217,121 @@ def add_formatted_page(pdf: pdf_generator) -> None:
     Args:
         pdf: The PDF document to which the page is added.
     """
-    pdf.set_fill_color(225, 230, 237)
     pdf.add_page()
-    pdf.rect(0, 0, 210, 297, "F")
+    pdf._out(_page_frame(pdf.w, pdf.h, pdf.k))  # pylint: disable=W0212
     pdf.set_font("Arial", "B", 18)
     pdf.set_fill_color(255, 255, 255)
-    pdf.rect(10, 10, 190, 277, "F")
 
 
-def check_add_page(pdf: pdf_generator, text: str) -> list[str]:
-    """Checks if the text overflows onto a new page and adds a new page if
-      necessary.
+def _word_width(pdf: pdf_generator, word: str) -> float:
+    """Measures a word in the current font, once per font while cached."""
+    font = (pdf.font_family, pdf.font_style, pdf.font_size_pt)
+    widths = _word_widths.get(font)
+    if widths is None:
+        widths = _word_widths[font] = OrderedDict()
+        if len(_word_widths) > MAX_CACHED_FONTS:
+            _word_widths.popitem(last=False)
+    else:
+        _word_widths.move_to_end(font)
+
+    width = widths.get(word)
+    if width is None:
+        width = widths[word] = pdf.get_string_width(word)
+        if len(widths) > MAX_CACHED_WORDS:
+            widths.popitem(last=False)
+    else:
+        widths.move_to_end(word)
+    return width
+
 
-    The text is split into lines based on the available page width.
-    If the text overflows onto a new page, a new page is added and the text
-    is continued on the new page.
+def _wrap_paragraph(pdf: pdf_generator, paragraph: str, width: float) -> list[str]:
+    """Wraps a paragraph into lines that fit the given width.
+
+    Words wider than a line are split over several lines.
+    """
+    space_width = _word_width(pdf, " ")
+    lines = []
+    line: list[str] = []
+    line_width = 0.0
+
+    for word in paragraph.split(" "):
+        word_width = _word_width(pdf, word)
+        if line and line_width + space_width + word_width > width:
+            lines.append(" ".join(line))
+            line, line_width = [], 0.0
+        while word_width > width and len(word) > 1:
+            # Split off the longest part of the word that fits on a line.
+            end = len(word) - 1
+            while end > 1 and pdf.get_string_width(word[:end]) > width:
+                end -= 1
+            lines.append(word[:end])
+            word = word[end:]
+            word_width = _word_width(pdf, word)
+        line_width += (space_width if line else 0) + word_width
+        line.append(word)
+
+    lines.append(" ".join(line))
+    return lines
+
+
+def layout_text(pdf: pdf_generator, text: str) -> list[list[str]]:
+    """Wraps the text into lines and splits the lines into pages.
+
+    The text is laid out in Arial, size 11, TEXT_WIDTH wide, from
+    FIRST_PAGE_TEXT_Y on the first page and from TEXT_Y on the following
+    pages.
 
     Args:
         pdf: The PDF document to which the text is added.
         text: The text to be added to the PDF document.
 
     Returns:
-        A list of strings, where each page is a string containing the text
-        that fits on that page.
+        A list of pages, where each page is the list of lines that fit on
+        that page.
     """
+    pdf.set_font("Arial", "", 11)
+    lines_per_first_page = int(
+        (pdf.page_break_trigger - FIRST_PAGE_TEXT_Y) // LINE_HEIGHT
+    )
+    lines_per_page = int((pdf.page_break_trigger - TEXT_Y) // LINE_HEIGHT)
+
+    lines = [
+        line
+        for paragraph in text.split("\n")
+        for line in _wrap_paragraph(pdf, paragraph, TEXT_WIDTH)
+    ]
+
+    pages = [lines[:lines_per_first_page]]
+    for start in range(lines_per_first_page, len(lines), lines_per_page):
+        end = start + lines_per_page
+        pages.append(lines[start:end])
+    return pages
 
-    pages: list[str] = []  # Store the text content for each page
-    page_content = ""  # Text for the current page being built
 
-    pdf.set_font("Arial", "", 11)
+def add_text_pages(pdf: pdf_generator, text: str) -> None:
+    """Writes the text below the image of the current page.
 
-    # Split the text into lines based on the available page width
-    lines = []
-    y = pdf.y
-
-    for line in text.split("\n"):
-        words = line.split(" ")
-        current_line = ""  # Represents a single line within the page
-
-        for word in words:
-            # Check if adding the word would exceed the line limit
-            if len(current_line + word) > pdf.w - pdf.l_margin - pdf.r_margin:
-                lines.append(current_line)
-                page_content += current_line + "\n"
-                current_line = ""  # Reset for the next line
-            current_line += word + " "
-
-        if current_line:
-            lines.append(current_line)
-            # Check if adding the line would overflow the page
-            if y + 10 > pdf.h - (80 if len(pages) == 0 else 0):
-                pages.append(page_content)  # Add the new page to the PDF
-                page_content = current_line + "\n"  # Start a new page
-                y = 10
-            else:
-                # Add the completed line to the current page
-                page_content += current_line + "\n"
-            y += 10
-
-    # Add any remaining text to the final page
-    pages.append(page_content)
-    return pages
+    Formatted pages are added for the text that does not fit on the current
+    page, pages without text are skipped.
+
+    Args:
+        pdf: The PDF document to which the text is added.
+        text: The text to be added to the PDF document.
+    """
+    for i, page in enumerate(layout_text(pdf, text)):
+        if not any(line.strip() for line in page):
+            continue
+
+        if i == 0:  # First page of text
+            y = FIRST_PAGE_TEXT_Y
+        else:  # Subsequent pages
+            add_formatted_page(pdf)
+            y = TEXT_Y
+        pdf.set_font("Arial", "", 11)
+
+        # The lines already fit, they are written without measuring them
+        # again.
+        for line in page:
+            pdf.set_xy(TEXT_X, y)
+            pdf.cell(TEXT_WIDTH, LINE_HEIGHT, line)
+            y += LINE_HEIGHT
@@ -0,0 +1,72 @@
+"""
+This module extracts the text of uploaded PDF files.
+
+This module:
+    * Splits the pages of large PDFs into ranges extracted in parallel by a
+      process pool.
+    * Yields the text of every range in page order, so it can be chunked
+      while the following ranges are still being extracted.
+
+It only depends on PyPDF2 so that pool workers start without importing the
+Streamlit app.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import io
+import os
+from typing import Iterator, Optional
+
+from PyPDF2 import PdfReader
+
+# Pages extracted by a pool worker per task.
+PAGES_PER_TASK = 25
+# PDFs with fewer pages are extracted in the calling process.
+MIN_PARALLEL_PAGES = 2 * PAGES_PER_TASK
+# Maximum number of extraction processes.
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+# PDF parsed once by every pool worker.
+_worker_reader: Optional[PdfReader] = None
+
+
+def _init_worker(pdf_bytes: bytes) -> None:
+    """Parses the PDF once per pool worker."""
+    global _worker_reader
+    _worker_reader = PdfReader(io.BytesIO(pdf_bytes))
+
+
+def _extract_range(reader: PdfReader, start: int, stop: int) -> str:
+    """Extracts and joins the text of the pages in [start, stop)."""
+    return "".join(reader.pages[page].extract_text() for page in range(start, stop))
+
+
+def _extract_worker_range(page_range: tuple[int, int]) -> str:
+    """Extracts a page range of the PDF parsed by _init_worker."""
+    return _extract_range(_worker_reader, *page_range)
+
+
+def extract_pdf_text(pdf_bytes: bytes) -> Iterator[str]:
+    """Extracts the text of a PDF, range of pages by range of pages.
+
+    Args:
+        pdf_bytes (bytes): The content of the PDF file.
+
+    Yields:
+        str: The text of consecutive page ranges, in page order.
+    """
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    num_pages = len(reader.pages)
+    if num_pages < MIN_PARALLEL_PAGES or MAX_WORKERS == 1:
+        yield _extract_range(reader, 0, num_pages)
+        return
+
+    page_ranges = [
+        (start, min(start + PAGES_PER_TASK, num_pages))
+        for start in range(0, num_pages, PAGES_PER_TASK)
+    ]
+    # The PDF is sent once per worker instead of once per task.
+    with ProcessPoolExecutor(
+        max_workers=MAX_WORKERS, initializer=_init_worker, initargs=(pdf_bytes,)
+    ) as executor:
+        # map preserves the order of the page ranges.
+        yield from executor.map(_extract_worker_range, page_ranges)
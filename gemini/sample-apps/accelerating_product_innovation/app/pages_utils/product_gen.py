@@ -5,7 +5,8 @@ Functions include:
 
     * Initiate text and image generation with user-provided features.
     * Store the generated content for display.
-    * Support content generation with asynchronous calls.
+    * Support content generation with a single concurrent fan-out of
+      drafts, each rendered as soon as it is ready.
     * Render a form for selecting pre-defined prompts or entering custom
       queries.
     * Facilitate the generation of product feature suggestions.
@@ -13,12 +14,15 @@ Functions include:
 
 import asyncio
 import logging
-from typing import Any
+from typing import Any, Awaitable, Callable, Optional
 
+from app.pages_utils.draft_generation import ProductDrafts
 from app.pages_utils.get_llm_response import (
+    IncompleteGenerationError,
     generate_gemini,
     parallel_generate_search_results,
 )
+from app.pages_utils.image_store import get_image_bytes
 from app.pages_utils.imagen import parallel_image_generation
 from dotenv import load_dotenv
 import streamlit as st
@@ -29,6 +33,13 @@ logging.basicConfig(
 )
 load_dotenv()
 
+# Seconds after which the text or image of a draft is given up on.
+DRAFT_TIMEOUT_SECONDS = 120
+# Appended to the text of a draft whose generation was interrupted.
+INCOMPLETE_DRAFT_NOTE = (
+    "\n\n_Text generation was interrupted, regenerate the draft to complete it._"
+)
+
 
 def update_generation_state() -> None:
     """Updates the generation state post generate button click."""
@@ -117,20 +128,90 @@ def create_suggestion_list(gen_suggestions: str) -> list[str]:
     return suggestions
 
 
-async def parallel_call(titles: list[str]) -> list[Any]:
+async def with_draft_timeout(awaitable: Awaitable[Any], default: Any) -> Any:
+    """Awaits a draft component, giving up after DRAFT_TIMEOUT_SECONDS.
+
+    Args:
+        awaitable: The text or image generation call.
+        default: The value returned if the call times out.
+
+    Returns:
+        The result of the call, or the default value.
+    """
+    try:
+        return await asyncio.wait_for(awaitable, DRAFT_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logging.warning(f"Draft generation timed out after {DRAFT_TIMEOUT_SECONDS}s")
+        return default
+
+
+async def generate_draft(
+    index: int,
+    text_prompt: str,
+    img_prompt: str,
+    on_text: Optional[Callable[[int, str], None]] = None,
+) -> tuple[int, str, Any]:
+    """Generates the text and image of a draft concurrently.
+
+    Args:
+        index (int): The index of the draft title.
+        text_prompt (str): The prompt for the draft text.
+        img_prompt (str): The prompt for the draft image.
+        on_text (Callable, optional): Called with the index and the text
+            generated so far every time a chunk of text arrives.
+
+    Returns:
+        tuple: The index, the text (as far as it was generated on timeout,
+        and marked with INCOMPLETE_DRAFT_NOTE if its stream was interrupted)
+        and the image (None on timeout) of the draft.
+    """
+    partial_text = ""
+
+    def update_text(text: str) -> None:
+        nonlocal partial_text
+        partial_text = text
+        if on_text is not None:
+            on_text(index, text)
+
+    async def generate_text() -> str:
+        try:
+            return await parallel_generate_search_results(text_prompt, update_text)
+        except IncompleteGenerationError as e:
+            logging.warning(f"Text of draft {index} is incomplete: {e}")
+            text = e.text + INCOMPLETE_DRAFT_NOTE
+            update_text(text)
+            return text
+
+    text, image = await asyncio.gather(
+        with_draft_timeout(generate_text(), None),
+        with_draft_timeout(parallel_image_generation(img_prompt, index), None),
+    )
+    return index, partial_text if text is None else text, image
+
+
+async def parallel_call(
+    titles: list[str],
+    on_draft_ready: Optional[Callable[[int, str, Any], None]] = None,
+    on_draft_text: Optional[Callable[[int, str], None]] = None,
+) -> list[Any]:
     """
     Performs parallel calls to the text and image generation APIs.
 
+    The text and image of every draft are requested in a single fan-out.
+
     Args:
         titles (list): A list of product titles.
+        on_draft_ready (Callable, optional): Called with the index, text and
+            image of every draft as soon as it is ready.
+        on_draft_text (Callable, optional): Called with the index and the
+            text generated so far of a draft as its text streams in.
 
     Returns:
         list: A list of tuples containing the text and image generation
           results.
     """
     logging.debug("entered parallel call")
-    text_processes = []
-    img_processes = []
+    drafts = []
     for index, title in enumerate(titles):
         # Handle edge case (No assorted products to be created in case only
         # one feature is selected)
@@ -151,16 +232,17 @@ async def parallel_call(titles: list[str]) -> list[Any]:
 
         # Parallel calls to generate new content.
         if st.session_state.content_generated is False:
-            text_processes.append(
-                asyncio.create_task(parallel_generate_search_results(text_prompt))
-            )
-            img_processes.append(
-                asyncio.create_task(parallel_image_generation(img_prompt, index))
-            )
-
-    # Append the generated content to final result arrays.
-    text_result_arr = await asyncio.gather(*text_processes)
-    image_result_arr = await asyncio.gather(*img_processes)
+            drafts.append(generate_draft(index, text_prompt, img_prompt, on_draft_text))
+
+    # Collect the drafts in the order they complete.
+    text_result_arr: list[str] = [""] * len(drafts)
+    image_result_arr: list[Any] = [None] * len(drafts)
+    for draft in asyncio.as_completed(drafts):
+        index, text, image = await draft
+        text_result_arr[index] = text
+        image_result_arr[index] = image
+        if on_draft_ready is not None:
+            on_draft_ready(index, text, image)
 
     return [text_result_arr, image_result_arr]
 
@@ -202,10 +284,25 @@ async def generate_product_content() -> None:
         # Fetch appropriate titles for processing
         titles = await prepare_titles()
 
+        # Preview every draft as its text streams in and its image arrives.
+        previews = st.empty()
+        with previews.container():
+            preview_slots = [st.empty() for _ in titles]
+
+        def preview_text(index: int, text: str) -> None:
+            with preview_slots[index].container():
+                ProductDrafts.display_draft_preview(
+                    titles[index], text, None, image_pending=True
+                )
+
+        def preview_draft(index: int, text: str, image: Any) -> None:
+            with preview_slots[index].container():
+                ProductDrafts.display_draft_preview(titles[index], text, image)
+
         # Call image and text generation function in parallel for efficiency
-        task1 = asyncio.create_task(parallel_call(titles))
-        result_array = await task1
+        result_array = await parallel_call(titles, preview_draft, preview_text)
         text_result_arr = result_array[0]
+        image_result_arr = result_array[1]
 
         # Iterate over selected titles to generate content
         i = 0
@@ -241,11 +338,20 @@ async def generate_product_content() -> None:
                             else st.session_state.assorted_prod_content[0]
                         ),
                         "interval": None,
-                        "img": f"gen_image{st.session_state.num_drafts*i+1}.png",
+                        "img": (
+                            get_image_bytes(
+                                f"gen_image{st.session_state.num_drafts*i+1}"
+                            )
+                            if image_result_arr[i] is not None
+                            else None
+                        ),
                     }
                 )
                 i += 1
 
+    # The previews are replaced by the full drafts display.
+    previews.empty()
+
     # Store elements for display purposes
     st.session_state.draft_elements = elements
 
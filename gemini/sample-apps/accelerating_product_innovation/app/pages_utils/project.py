@@ -2,23 +2,28 @@
 This module provides functions for interacting with the Google Cloud Storage
 bucket, specifically for managing projects and their associated files.
 This module:
-    * Retrieves a list of existing projects from the GCS bucket.
-    * Updates the project list stored in the GCS bucket.
     * Lists PDF, text, and other supported file types in the current
-      project's GCS bucket.
+      project's GCS bucket, and downloads them. Both are cached across
+      reruns and invalidated when files are uploaded or deleted.
     * Deletes an entire project and its contents from the GCS bucket.
     * Deletes a specific file from the GCS project.
 """
 
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 import os
 from typing import Any
 
-from app.pages_utils.pages_config import GLOBAL_CFG
+from app.pages_utils import embedding_store
+from app.pages_utils.gcs_cache import (
+    METADATA_TTL_SECONDS,
+    get_bucket,
+    save_project_list,
+)
 from dotenv import load_dotenv
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
-import pandas as pd
+from google.cloud.storage.retry import DEFAULT_RETRY
 import streamlit as st
 
 load_dotenv()
@@ -28,55 +33,116 @@ logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.DEBUG)
 PROJECT_ID = os.getenv("PROJECT_ID")
 LOCATION = os.getenv("LOCATION")
 
-# Define storage bucket
-storage_client = storage.Client(project=PROJECT_ID)
-bucket = storage_client.bucket(GLOBAL_CFG["bucket_name"])
+# Maximum number of blobs deleted concurrently.
+MAX_CONCURRENT_DELETES = 32
+# Extensions of the files that can be uploaded to a project.
+PROJECT_FILE_EXTENSIONS = (".pdf", ".txt", ".csv", ".docx")
+# Maximum number of cached project files.
+MAX_CACHED_FILES = 64
+
+
+@st.cache_data(ttl=METADATA_TTL_SECONDS, show_spinner=False)
+def list_project_files(category: str) -> list[list[Any]]:
+    """Lists the uploaded files of a project (to be cached).
+
+    Args:
+        category (str): The project to list the files of.
+
+    Returns:
+        list[list[Any]]: The blob name and the file extension of every
+        file, empty if the project has no stored embeddings.
+    """
+    files = []
+    if embedding_store.has_embeddings(category):
+        for file in get_bucket().list_blobs(prefix=f"{category}/"):
+            _, file_extension = os.path.splitext(file.name)
+            if file_extension in PROJECT_FILE_EXTENSIONS:
+                files.append([file.name, file_extension])
+    return files
+
+
+@st.cache_data(
+    ttl=METADATA_TTL_SECONDS, max_entries=MAX_CACHED_FILES, show_spinner=False
+)
+def download_project_file(blob_name: str) -> bytes:
+    """Downloads an uploaded file of a project (to be cached).
+
+    Args:
+        blob_name (str): The name of the blob of the file.
+
+    Returns:
+        bytes: The contents of the file.
+    """
+    return get_bucket().blob(blob_name).download_as_bytes()
+
+
+def invalidate_project_files() -> None:
+    """Invalidates the cached files of the projects.
+
+    Called whenever files are uploaded to or deleted from a project.
+    """
+    list_project_files.clear()
+    download_project_file.clear()
 
 
 def list_pdf_files_gcs() -> list[list[Any]]:
     """Lists the PDF files in the current project's GCS bucket.
 
     This function lists the PDF files in the current project's GCS bucket.
-    It uses the 'storage_client' to get the list of blobs in the bucket and
-    then filters the list to only include PDF files.
+    The list is cached until files are uploaded or deleted.
     It then returns a list of tuples of the blob name and the file extension.
 
     Returns:
         list[list[Any]]: A list of tuples of the blob name and the file
         extension.
     """
-    project_embedding = bucket.blob(
-        f"{st.session_state.product_category}/embeddings.json"
-    )
-    files = []
-    if project_embedding.exists():
-        file_list = bucket.list_blobs(prefix=f"{st.session_state.product_category}/")
-        for file in file_list:
-            _, file_extension = os.path.splitext(file.name)
-            if file_extension in (".pdf", ".txt", ".csv", ".docx"):
-                files.append([file.name, file_extension])
-    else:
+    files = list_project_files(st.session_state.product_category)
+    if not files:
         st.write("No file uploaded")
     return files
 
 
+def delete_blob(blob: storage.Blob) -> None:
+    """Deletes a blob, retrying transient errors.
+
+    A blob that no longer exists counts as deleted, so deleting a project
+    can safely be retried after a partial failure.
+
+    Args:
+        blob (storage.Blob): The blob to delete.
+    """
+    try:
+        blob.delete(retry=DEFAULT_RETRY)
+    except NotFound:
+        pass
+
+
 def delete_project_from_gcs() -> None:
     """Deletes the current project from the GCS bucket.
 
     This function deletes the current project from the GCS bucket.
     It uses the 'storage_client' to get the list of blobs in the bucket
-    and then deletes all of the blobs in the bucket.
+    and then deletes all of the blobs concurrently, reporting progress.
     It then removes the current project from the list of projects and
     updates the 'project_list.txt' file in the GCS bucket.
     """
     # Load list of files for current project.
-    project_file_list = bucket.list_blobs(
-        prefix=f"{st.session_state.product_category}/"
+    project_file_list = list(
+        get_bucket().list_blobs(prefix=f"{st.session_state.product_category}/")
     )
 
     # Delete the files in the project.
-    for file in project_file_list:
-        file.delete()
+    progress_bar = st.progress(0.0, text="Deleting project files...")
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DELETES) as executor:
+        futures = [executor.submit(delete_blob, file) for file in project_file_list]
+        for deleted, future in enumerate(as_completed(futures), start=1):
+            future.result()
+            progress_bar.progress(
+                deleted / len(futures),
+                text=f"Deleted {deleted} of {len(futures)} project files",
+            )
+    progress_bar.empty()
+    invalidate_project_files()
 
     # Remove the project name corresponding to the deleted project.
     st.session_state.product_categories.remove(st.session_state.product_category)
@@ -86,10 +152,7 @@ def delete_project_from_gcs() -> None:
         st.session_state.product_category = st.session_state.product_categories[0]
 
     # Update list of projects.
-    project_list_blob = bucket.blob("project_list.txt")
-    project_list_blob.upload_from_string(
-        json.dumps(st.session_state.product_categories)
-    )
+    save_project_list(st.session_state.product_categories)
     st.rerun()
 
 
@@ -104,23 +167,11 @@ def delete_file_from_gcs(file_name: str) -> None:
         file_name (str): The name of the file to delete.
     """
     # Load and delete embeddings of deleted file.
-    deleted_file_blob = bucket.blob(f"{st.session_state.product_category}/{file_name}")
-    deleted_file_blob.delete()
-
-    # Load embeddings of the project
-    project_embeddings = bucket.blob(
-        st.session_state.product_category + "/embeddings.json"
-    )
-    stored_embedding_data = project_embeddings.download_as_string()
-    embeddings_df = pd.DataFrame.from_dict(json.loads(stored_embedding_data))
-
-    # Remove deleted file from project embeddings.
-    embeddings_df = embeddings_df.drop(
-        embeddings_df[embeddings_df["file_name"] == file_name].index
+    deleted_file_blob = get_bucket().blob(
+        f"{st.session_state.product_category}/{file_name}"
     )
-    embeddings_df.reset_index(inplace=True, drop=True)
+    deleted_file_blob.delete()
+    invalidate_project_files()
 
-    # Update embeddings in GCS.
-    bucket.blob(
-        f"{st.session_state.product_category}/embeddings.json"
-    ).upload_from_string(embeddings_df.to_json(), "application/json")
+    # Drop or tombstone the embeddings of the deleted file.
+    embedding_store.delete_file_embeddings(st.session_state.product_category, file_name)
@@ -6,22 +6,24 @@ and managing data within the Google Cloud Storage (GCS) bucket.
 This module:
     * Parses different file formats (CSV, text, Word, PDF), extracts
       text, splits it into chunks, and creates data packets.
-    * Leverages `embedding_model_with_backoff` to embed text chunks.
+    * Leverages `embed_texts` to embed text chunks in batches.
     * Uploads processed data packets to a GCS bucket.
-    * Stores embeddings alongside their associated metadata.
+    * Appends embeddings alongside their associated metadata to the
+      project's embedding store.
 """
 
 import asyncio
+import base64
 import json
 import logging
 import os
-from typing import Any
+from typing import Iterable, Iterator, Optional, Union
 
-from PyPDF2 import PdfReader
-import aiohttp as cloud_function_call
-from app.pages_utils import insights
-from app.pages_utils.embedding_model import embedding_model_with_backoff
-from app.pages_utils.pages_config import GLOBAL_CFG
+from app.pages_utils import embedding_store, insights
+from app.pages_utils.cloud_function_client import get_cloud_function_client
+from app.pages_utils.embedding_model import CHARS_PER_TOKEN, embed_texts
+from app.pages_utils.gcs_cache import get_bucket
+from app.pages_utils.pdf_text import extract_pdf_text
 import docx
 from dotenv import load_dotenv
 from google.cloud import storage
@@ -37,39 +39,88 @@ LOCATION = os.getenv("LOCATION")
 
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.DEBUG)
 
-# Define storage bucket
-storage_client = storage.Client(project=PROJECT_ID)
-bucket = storage_client.bucket(GLOBAL_CFG["bucket_name"])
+# CSV rows sent to the text-embedding cloud function per request.
+ROWS_PER_EMBEDDING_REQUEST = 1_000
+# Estimated tokens per chunk of text files, 40 chunks fill an embedding
+# request of MAX_BATCH_TOKENS.
+CHUNK_TOKENS = 500
+# Estimated tokens shared by consecutive chunks.
+CHUNK_OVERLAP_TOKENS = 50
 
 
-def get_chunks_iter(text: str, maxlength: int) -> list[str]:
+def get_chunks_iter(
+    text: str,
+    max_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> Iterator[str]:
     """Gets the chunks of text from a string.
 
-    This function gets the chunks of text from a string.
-    It splits the string into chunks of the specified maximum length and
-    returns a list of the chunks.
+    This function splits the string into chunks of at most max_tokens
+    tokens, as estimated by estimate_tokens, at the last space that fits.
+    Every chunk starts with the words of the last overlap_tokens tokens of
+    the previous chunk. Words longer than a chunk are split.
 
     Args:
         text (str): The string to get the chunks of.
-        maxlength (int): The maximum length of the chunks.
+        max_tokens (int): The maximum number of tokens of the chunks.
+        overlap_tokens (int): The number of tokens shared by consecutive
+            chunks.
 
-    Returns:
-        list[str]: A list of the chunks of text.
+    Yields:
+        str: The chunks of text.
     """
+    # The token estimate is proportional to the number of characters.
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_chars = overlap_tokens * CHARS_PER_TOKEN
     start = 0
-    end = 0
-    final_chunk = []
-    while start + maxlength < len(text) and end != -1:
-        end = text.rfind(" ", start, start + maxlength + 1)
-        final_chunk.append(text[start:end])
-        start = end + 1
-    final_chunk.append(text[start:])
-    return final_chunk
+    while len(text) - start > max_chars:
+        end = text.rfind(" ", start + 1, start + max_chars + 1)
+        if end == -1:
+            end = start + max_chars
+        yield text[start:end]
+
+        # Start the next chunk at the first word within the overlap.
+        overlap_start = text.find(" ", max(end - overlap_chars, start + 1), end)
+        if overlap_tokens > 0 and overlap_start != -1:
+            start = overlap_start + 1
+        else:
+            start = end + 1 if text[end] == " " else end
+    yield text[start:]
+
+
+def stream_chunks(
+    parts: Iterable[str],
+    max_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+) -> Iterator[str]:
+    """Gets the chunks of text from consecutive parts of a string.
+
+    The chunks are the same as those of get_chunks_iter on the joined
+    string, but are yielded as soon as the parts they span are available.
+
+    Args:
+        parts (Iterable[str]): Consecutive parts of the string.
+        max_tokens (int): The maximum number of tokens of the chunks.
+        overlap_tokens (int): The number of tokens shared by consecutive
+            chunks.
+
+    Yields:
+        str: The chunks of text.
+    """
+    remainder = ""
+    for part in parts:
+        chunks = get_chunks_iter(remainder + part, max_tokens, overlap_tokens)
+        # The last chunk may still grow with the following parts.
+        remainder = next(chunks)
+        for chunk in chunks:
+            yield remainder
+            remainder = chunk
+    yield remainder
 
 
 def chunk_and_store_data(
     uploaded_file: UploadedFile,
-    file_content: str,
+    file_content: Union[str, Iterable[str]],
 ) -> list:
     """Creates a data packet.
 
@@ -77,22 +128,20 @@ def chunk_and_store_data(
 
     Args:
         uploaded_file: File like object from streamlit uploader.
-        file_content (str): The contents of the file.
+        file_content: The contents of the file, or consecutive parts of it.
 
     Returns:
         final_data (list[Any]): A list of data packets.
     """
     # Creating a simple dictionary to store all information
     # (content and metadata) extracted from the document
-
-    # Return if empty or invalid file is found.
-    if file_content == "":
-        return []
+    if isinstance(file_content, str):
+        file_content = [file_content]
 
     final_data = []
 
-    # Split file into chunks and process each chunk in parallel.
-    text_chunks = get_chunks_iter(file_content, 2000)
+    # Split file into chunks as its parts are extracted.
+    text_chunks = stream_chunks(file_content)
     for chunk_number, chunk_content in enumerate(text_chunks):
         data_packet = {}
         data_packet["file_name"] = uploaded_file.name
@@ -102,10 +151,14 @@ def chunk_and_store_data(
         # Append all chunks to final_data.
         final_data.append(data_packet)
 
+    # Return if empty or invalid file is found.
+    if len(final_data) == 1 and final_data[0]["content"] == "":
+        return []
+
     return final_data
 
 
-async def add_embedding_col(pdf_data: pd.DataFrame) -> pd.DataFrame:
+async def add_embedding_col(pdf_data: pd.DataFrame) -> Optional[pd.DataFrame]:
     """Adds an 'embedding' column to the PDF data.
 
     This function adds an 'embedding' column to the PDF data.
@@ -117,40 +170,58 @@ async def add_embedding_col(pdf_data: pd.DataFrame) -> pd.DataFrame:
         ti (int): The task index.
 
     Returns:
-        pd.DataFrame: The PDF data with the 'embedding' column.
+        pd.DataFrame: The PDF data with the 'embedding' column, or None if
+        the embeddings could not be generated.
     """
     # Make request data payload
-    pdf_content = json.dumps({"pdf_data": pdf_data["content"].to_json()})
-
-    async with cloud_function_call.ClientSession() as session:
-        # URL for cloud function.
-        url = f"""https://us-central1-{PROJECT_ID}.cloudfunctions.net/text-embedding"""
-
-        # Call cloud function to generate embeddings with data and headers.
-        async with session.post(
-            url,
-            data=pdf_content,
-            headers=st.session_state.headers,
-            verify_ssl=False,
-        ) as embedding_response:
-            # Process cloud function Response
-            if embedding_response.status == 200:
-                response = await embedding_response.text()  # Read response
-                # Extract text embeddings and convert to pd.Series.
-                text_embeddings = pd.Series(json.loads(response)["embedding_column"][0])
-                # Add embedding column
-                pdf_data["embedding"] = text_embeddings
+    pdf_content = json.dumps(
+        {"pdf_data": pdf_data["content"].to_json(), "encoding": "base64"}
+    )
+
+    # Call cloud function to generate embeddings with data and headers.
+    status, response = await get_cloud_function_client().post(
+        "text-embedding", pdf_content, st.session_state.headers
+    )
+    # Process cloud function Response
+    if status != 200:
+        logging.error(f"text-embedding call failed with status {status}")
+        return None
+
+    # Decode the float32 embedding matrix without copying it.
+    text_embeddings = np.frombuffer(
+        base64.b64decode(response["embedding_b64"]), dtype="<f4"
+    ).reshape(response["shape"])
+    # Add embedding column, one row view per chunk.
+    pdf_data["embedding"] = list(text_embeddings)
 
     return pdf_data
 
 
-async def process_rows(df: pd.DataFrame, filename: str, header: list) -> pd.DataFrame:
+def drop_stored_duplicates(
+    pdf_data: pd.DataFrame, embeddings_df: Optional[pd.DataFrame]
+) -> pd.DataFrame:
+    """Drops chunks whose content is duplicated or already stored.
+
+    Args:
+        pdf_data (pd.DataFrame): The newly embedded chunks.
+        embeddings_df (pd.DataFrame): The stored embeddings of the project,
+            if any.
+
+    Returns:
+        pd.DataFrame: The chunks to append to the project.
+    """
+    pdf_data = pdf_data.drop_duplicates(subset="content", keep="first")
+    if embeddings_df is not None and not embeddings_df.empty:
+        pdf_data = pdf_data[~pdf_data["content"].isin(embeddings_df["content"])]
+    return pdf_data.reset_index(drop=True)
+
+
+def process_rows(df: pd.DataFrame, filename: str, header: list) -> pd.DataFrame:
     """Processes the rows.
 
-    This function processes the rows.
-    It iterates over the rows of the DataFrame and creates a data packet for
-    each row.
-    It then returns a DataFrame with the data packets.
+    This function builds a data packet for every row of the DataFrame,
+    serializing each row as "<column> is <value>. " for every column. The
+    text is built column by column instead of cell by cell.
 
     Args:
         df (pd.DataFrame): The DataFrame to process.
@@ -160,19 +231,17 @@ async def process_rows(df: pd.DataFrame, filename: str, header: list) -> pd.Data
     Returns:
         pd.DataFrame: A DataFrame with the data packets.
     """
-    final_data = []
-    last_index = len(df)
-    for i in range(last_index):
-        chunk_content = ""
-        for j, head in enumerate(header):
-            chunk_content += f"{head} is {df.iloc[[i], [j]].squeeze()}. "
-        data_packet = {}
-        data_packet["file_name"] = filename
-        data_packet["chunk_number"] = str(i + 1)
-        data_packet["content"] = chunk_content
-
-        final_data.append(data_packet)
-    pdf_data = pd.DataFrame.from_dict(final_data)
+    column_texts = [
+        [f"{head} is {value}. " for value in df.iloc[:, j].tolist()]
+        for j, head in enumerate(header)
+    ]
+    pdf_data = pd.DataFrame(
+        {
+            "file_name": filename,
+            "chunk_number": [str(i + 1) for i in range(len(df))],
+            "content": ["".join(row_texts) for row_texts in zip(*column_texts)],
+        }
+    )
     return pdf_data
 
 
@@ -181,64 +250,47 @@ async def csv_processing(
     header: list,
     embeddings_df: pd.DataFrame,
     file: str,
-) -> None:
+) -> bool:
     """Processes the CSV file.
 
     This function processes the CSV file.
-    It splits the DataFrame into chunks and processes each chunk in parallel.
-    It then concatenates the results and uploads the resulting DataFrame to
-    the GCS bucket.
+    It serializes every row, splits the rows into requests for the
+    text-embedding cloud function and embeds them concurrently, bounded by
+    the shared cloud function client.
+    It then appends the results to the project embeddings.
 
     Args:
         df (pd.DataFrame): The DataFrame to process.
         header (list): The header of the file.
         embeddings_df (pd.DataFrame): The DataFrame with the stored embeddings.
         file (str): The name of the file.
+
+    Returns:
+        bool: Whether the embeddings of the file were stored.
     """
-    pdf_data = pd.DataFrame()
-    df_size = len(df)
-    chunk_size = 100  # Default chunk size if df_size is below all thresholds
-    chunk_sizes = {
-        1_000_000: 100_000,
-        100_000: 10_000,
-        10_000: 1_000,
-    }
-    for threshold, size in chunk_sizes.items():
-        if df_size > threshold:
-            chunk_size = size
-
-    chunks = np.array_split(df, chunk_size)
-
-    # Parallel processing in stages
-    processed_chunks = await asyncio.gather(
-        *(process_rows(chunk, file, header) for _, chunk in enumerate(chunks))
-    )
-    typed_chunks = await asyncio.gather(
-        *(
-            asyncio.to_thread(
-                chunk.assign(types=[type(x) for x in chunk["content"]]), chunk
-            )
-            for chunk in processed_chunks
-        )
-    )
+    pdf_data = process_rows(df, file, header)
+    pdf_data["types"] = [type(x) for x in pdf_data["content"]]
+
+    request_numbers = np.arange(len(pdf_data)) // ROWS_PER_EMBEDDING_REQUEST
     embedded_chunks = await asyncio.gather(
-        *(add_embedding_col(chunk) for chunk in typed_chunks)
+        *(add_embedding_col(chunk) for _, chunk in pdf_data.groupby(request_numbers))
     )
 
-    # Combine, merge, deduplicate, and upload
-    pdf_data = pd.concat(embedded_chunks + [embeddings_df])
-    pdf_data = pdf_data.drop_duplicates(subset="content", keep="first").reset_index(
-        drop=True
-    )
-    bucket.blob(
-        f"{st.session_state.product_category}/embeddings.json"
-    ).upload_from_string(pdf_data.to_json(), "application/json")
+    # Store nothing rather than rows without embeddings.
+    if any(chunk is None for chunk in embedded_chunks):
+        st.error(f"Could not generate embeddings for {file}, it was not stored.")
+        return False
+
+    # Combine, deduplicate, and append to the project embeddings
+    pdf_data = drop_stored_duplicates(pd.concat(embedded_chunks), embeddings_df)
+    embedding_store.append_embeddings(st.session_state.product_category, pdf_data)
+    return True
 
 
 def load_file_content(
     uploaded_file: UploadedFile,
     uploaded_file_blob: storage.Blob,
-) -> Any:
+) -> Iterable[str]:
     """Loads and processes the content of various file types (text, docx, pdf).
 
     Args:
@@ -247,7 +299,9 @@ def load_file_content(
         provided, the function will upload the file content to the blob.
 
     Returns:
-        The extracted text content of the file(s) as a single string.
+        The extracted text content of the file, as consecutive parts. The
+        pages of PDF files are extracted in parallel while the parts are
+        consumed.
     """
     # Handle case if a text file has been uploaded.
     if uploaded_file.type == "text/plain":
@@ -257,33 +311,21 @@ def load_file_content(
         uploaded_file_blob.upload_from_string(
             file_content, content_type=uploaded_file.type
         )
+        return [file_content]
     # Handle case when uploaded file is a document.
-    elif uploaded_file.name.lower().endswith(".docx"):
+    if uploaded_file.name.lower().endswith(".docx"):
         # Read and clean up contents of the document.
         doc = docx.Document(uploaded_file)
-        file_content = ""
-        for para in doc.paragraphs:
-            file_content += para.text
-        "\n".join(file_content)
+        file_content = "\n".join(para.text for para in doc.paragraphs)
         uploaded_file_blob.upload_from_string(
             file_content, content_type=uploaded_file.type
         )
-    else:
-        # Read and process contents of the pdf file.
-        pdf_content = uploaded_file.read()
-        uploaded_file_blob.upload_from_string(
-            pdf_content, content_type=uploaded_file.type
-        )
-        # Extract pages from the pdf.
-        reader = PdfReader(uploaded_file)
-        num_pages = len(reader.pages)
-        file_content = ""
-        # Separately load text from each page of the pdf.
-        for page_num in range(num_pages):
-            page = reader.pages[page_num]
-            pg = page.extract_text()
-            file_content += pg
-    return file_content
+        return [file_content]
+    # Read and process contents of the pdf file.
+    pdf_content = uploaded_file.read()
+    uploaded_file_blob.upload_from_string(pdf_content, content_type=uploaded_file.type)
+    # Extract ranges of pages from the pdf in parallel.
+    return extract_pdf_text(pdf_content)
 
 
 def create_and_store_embeddings(uploaded_file: UploadedFile) -> None:
@@ -297,7 +339,7 @@ def create_and_store_embeddings(uploaded_file: UploadedFile) -> None:
         uploaded_file: The file to convert to data packets.
     """
     with st.spinner("Uploading files..."):
-        uploaded_file_blob = bucket.blob(
+        uploaded_file_blob = get_bucket().blob(
             f"{st.session_state.product_category}/{uploaded_file.name}"
         )
 
@@ -308,10 +350,10 @@ def create_and_store_embeddings(uploaded_file: UploadedFile) -> None:
         if uploaded_file.type == "text/csv":
             # Read the csv file contents.
             df = pd.read_csv(uploaded_file)
-            uploaded_file_blob.upload_from_string(df.to_csv(), "text/csv")
 
             # Return if file is empty or contents cannot be read.
             if df.empty:
+                uploaded_file_blob.upload_from_string(df.to_csv(), "text/csv")
                 return
 
             # Create a list of csv file columns.
@@ -322,41 +364,44 @@ def create_and_store_embeddings(uploaded_file: UploadedFile) -> None:
             # Create embeddings and store contents of the csv file
             # to the GCS bucket.
             with st.spinner("Processing csv...this might take some time..."):
-                asyncio.run(
+                stored = asyncio.run(
                     csv_processing(df, header, embeddings_df, uploaded_file.name)
                 )
+            # The file is only listed in the project once it is searchable.
+            if stored:
+                uploaded_file_blob.upload_from_string(df.to_csv(), "text/csv")
             return
 
         file_content = load_file_content(uploaded_file, uploaded_file_blob)
-        # Append processed content from the page to final data.
-        final_data = chunk_and_store_data(
-            uploaded_file=uploaded_file,
-            file_content=file_content,
-        )
-        if len(final_data) == 0:
-            return
-        # Stores the embeddings in the GCS bucket.
-        with st.spinner("Storing Embeddings"):
-            # Create a dataframe from final chunked data.
-            pdf_data = pd.DataFrame.from_dict(final_data)
-            pdf_data.reset_index(inplace=True, drop=True)
-
-            # Add datatype column to df.
-            pdf_data["types"] = [type(x) for x in pdf_data["content"]]
-
-            # Add embedding column to df for text embeddings.
-            pdf_data["embedding"] = pdf_data["content"].apply(
-                lambda x: embedding_model_with_backoff([x])
+        # Do not list a file whose embeddings could not be stored.
+        try:
+            # Append processed content from the page to final data.
+            final_data = chunk_and_store_data(
+                uploaded_file=uploaded_file,
+                file_content=file_content,
             )
-            pdf_data["embedding"] = pdf_data.embedding.apply(np.array)
-
-            # Concatenate the data of newly uploaded files with that of
-            # existing file embeddings
-            pdf_data = pd.concat([embeddings_df, pdf_data])
-            pdf_data = pdf_data.drop_duplicates(subset=["content"], keep="first")
-            pdf_data.reset_index(inplace=True, drop=True)
-
-            # Upload newly created embeddings to gcs
-            bucket.blob(
-                f"{st.session_state.product_category}/embeddings.json"
-            ).upload_from_string(pdf_data.to_json(), "application/json")
+            if len(final_data) == 0:
+                return
+            # Stores the embeddings in the GCS bucket.
+            with st.spinner("Storing Embeddings"):
+                # Create a dataframe from final chunked data.
+                pdf_data = pd.DataFrame.from_dict(final_data)
+                pdf_data.reset_index(inplace=True, drop=True)
+
+                # Add datatype column to df.
+                pdf_data["types"] = [type(x) for x in pdf_data["content"]]
+
+                # Add embedding column to df for text embeddings, embedding
+                # the chunks in concurrent token-sized batches.
+                pdf_data["embedding"] = list(embed_texts(pdf_data["content"].tolist()))
+
+                # Keep only chunks that are not stored for the project yet
+                pdf_data = drop_stored_duplicates(pdf_data, embeddings_df)
+
+                # Upload newly created embeddings to gcs as a new segment
+                embedding_store.append_embeddings(
+                    st.session_state.product_category, pdf_data
+                )
+        except Exception:
+            uploaded_file_blob.delete()
+            raise
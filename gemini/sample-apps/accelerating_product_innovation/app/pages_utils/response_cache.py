@@ -0,0 +1,192 @@
+"""
+This module provides a response cache for the text generation model, shared
+by all sessions of the app.
+
+This module:
+    * Caches responses by model, generation config and prompt hash.
+    * Optionally serves near-duplicate prompts from an embedding similarity
+      tier, only within the scope (e.g. the project) the response was
+      cached for.
+    * Expires entries after a TTL and evicts the least recently used entries
+      beyond a size bound.
+    * Counts hits and misses per page, logged by the callers after every
+      lookup.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Optional
+
+import numpy as np
+import streamlit as st
+
+# Maximum number of cached responses.
+MAX_ENTRIES = 1024
+# Seconds after which a cached response expires.
+TTL_SECONDS = 24 * 60 * 60
+# Minimum cosine similarity for a prompt to reuse a near-duplicate response.
+SIMILARITY_THRESHOLD = 0.98
+
+
+def similarity_scope_key(project: Optional[str], scope: str) -> str:
+    """Returns the scope of a prompt in the similarity tier, so that
+    near-duplicate prompts only match within the same project and scope."""
+    return json.dumps([project, scope])
+
+
+@dataclass
+class CacheEntry:
+    """A cached response."""
+
+    config_key: str
+    response: str
+    created: float
+    embedding: Optional[np.ndarray] = None
+    scope: str = ""
+
+
+class ResponseCache:
+    """LRU cache of model responses with a TTL and a similarity tier."""
+
+    def __init__(
+        self,
+        max_entries: int = MAX_ENTRIES,
+        ttl_seconds: float = TTL_SECONDS,
+        similarity_threshold: float = SIMILARITY_THRESHOLD,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics: dict[str, dict[str, int]] = {}
+
+    @staticmethod
+    def config_key(model_name: str, generation_config: Any) -> str:
+        """Returns the key of a model and generation config."""
+        config = generation_config.to_dict() if generation_config else {}
+        return json.dumps({"model": model_name, "config": config}, sort_keys=True)
+
+    @staticmethod
+    def key(config_key: str, prompt: str) -> str:
+        """Returns the cache key of a prompt."""
+        return hashlib.sha256(f"{config_key}\n{prompt}".encode()).hexdigest()
+
+    def get(
+        self,
+        config_key: str,
+        prompt: str,
+        embedding: Optional[np.ndarray] = None,
+        page: str = "",
+        scope: str = "",
+        count_miss: bool = True,
+    ) -> Optional[str]:
+        """Gets the cached response to a prompt.
+
+        Args:
+            config_key (str): The key returned by config_key.
+            prompt (str): The prompt.
+            embedding (np.ndarray, optional): The normalized embedding of
+                the prompt, to look up near-duplicate prompts.
+            page (str): The page the prompt comes from, for the metrics.
+            scope (str): Near-duplicate prompts are only looked up among
+                the prompts cached with the same scope.
+            count_miss (bool): Whether to count a miss in the metrics, False
+                when the lookup is retried with an embedding.
+
+        Returns:
+            The cached response, or None.
+        """
+        now = time.monotonic()
+        with self._lock:
+            page_metrics = self.metrics.setdefault(
+                page, {"hits": 0, "similar_hits": 0, "misses": 0}
+            )
+            key = self.key(config_key, prompt)
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.created <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                page_metrics["hits"] += 1
+                return entry.response
+
+            if embedding is not None:
+                best_key, best_similarity = None, self.similarity_threshold
+                for entry_key, entry in self._entries.items():
+                    if (
+                        entry.embedding is None
+                        or entry.config_key != config_key
+                        or entry.scope != scope
+                        or now - entry.created > self.ttl_seconds
+                    ):
+                        continue
+                    similarity = float(entry.embedding @ embedding)
+                    if similarity >= best_similarity:
+                        best_key, best_similarity = entry_key, similarity
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    page_metrics["similar_hits"] += 1
+                    return self._entries[best_key].response
+
+            if count_miss:
+                page_metrics["misses"] += 1
+            return None
+
+    def page_metrics(self, page: str) -> dict[str, int]:
+        """Gets the hits, similar hits and misses counted for a page.
+
+        Args:
+            page (str): The page the prompts come from.
+
+        Returns:
+            dict: A copy of the counters of the page.
+        """
+        with self._lock:
+            return dict(
+                self.metrics.get(page, {"hits": 0, "similar_hits": 0, "misses": 0})
+            )
+
+    def put(
+        self,
+        config_key: str,
+        prompt: str,
+        response: str,
+        embedding: Optional[np.ndarray] = None,
+        scope: str = "",
+    ) -> None:
+        """Caches the response to a prompt.
+
+        Args:
+            config_key (str): The key returned by config_key.
+            prompt (str): The prompt.
+            response (str): The response of the model.
+            embedding (np.ndarray, optional): The normalized embedding of
+                the prompt, for the similarity tier.
+            scope (str): The scope of the prompt in the similarity tier.
+        """
+        now = time.monotonic()
+        with self._lock:
+            key = self.key(config_key, prompt)
+            self._entries[key] = CacheEntry(config_key, response, now, embedding, scope)
+            self._entries.move_to_end(key)
+            # Entries are ordered by last use, expired ones are dropped first.
+            expired = [
+                entry_key
+                for entry_key, entry in self._entries.items()
+                if now - entry.created > self.ttl_seconds
+            ]
+            for entry_key in expired:
+                del self._entries[entry_key]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """
+    Creates the response cache shared by all sessions (to be cached).
+    """
+    return ResponseCache()
@@ -4,22 +4,16 @@ Common utilities for the project. This includes:
     * project selection.
 """
 
-import json
 import os
 from typing import Any
 
-from app.pages_utils.pages_config import GLOBAL_CFG
-from google.cloud import storage
+from app.pages_utils.gcs_cache import load_project_list
 import streamlit as st
 from vertexai import generative_models
 
 PROJECT_ID = os.getenv("PROJECT_ID")
 LOCATION = os.getenv("LOCATION")
 
-# Define storage bucket
-storage_client = storage.Client(project=PROJECT_ID)
-bucket = storage_client.bucket(GLOBAL_CFG["bucket_name"])
-
 
 def display_projects() -> None:
     """Displays the list of projects and allows the user to select one.
@@ -55,9 +49,8 @@ def initialize_all_session_state(reinitialize: bool = False) -> None:
     Returns:
         None
     """
-    # Get lists of projects in the application.
-    project_list_blob = bucket.blob("project_list.txt")
-    project_list = json.loads(project_list_blob.download_as_string())
+    # Get lists of projects in the application, cached across reruns.
+    project_list = load_project_list()
 
     # Initialize default values for the session state.
     session_state_defaults: dict[str, Any] = {
@@ -76,6 +69,7 @@ def initialize_all_session_state(reinitialize: bool = False) -> None:
         "insights_placeholder": "",
         "suggestion_first_time": 1,
         "processed_data_list": [],
+        "embedding_index": None,
         "query_vectors": [],
         "embeddings_df": None,
         "temp_suggestions": None,
@@ -104,6 +98,7 @@ def initialize_all_session_state(reinitialize: bool = False) -> None:
         "email_text": None,
         "generated_image": None,
         "mask_image": None,
+        "merged_mask_image": None,
         "edit_suggestion": False,
         "suggested_images": None,
         "uploaded_img": False,
@@ -164,6 +159,8 @@ def page_setup(page_cfg: dict) -> None:
     ):
         initialize_all_session_state()
         st.session_state.initialize_session_state = True
+    # Track the current page for the response cache metrics.
+    st.session_state.current_page = page_cfg["page_title"]
     # Apply the sidebar style
     load_css("app/css/sidebar_styles.css")
 
@@ -2,10 +2,14 @@
 Cloud Function for getting text response from Gemini API.
 """
 
+import json
+import logging
 import os
-from typing import Any, Dict, Tuple, Union
+import time
+from typing import Any, Dict, Iterator, Tuple, Union
 
 from dotenv import load_dotenv
+import flask
 import functions_framework
 from vertexai.preview import generative_models
 from vertexai.preview.generative_models import GenerativeModel
@@ -16,6 +20,15 @@ PROJECT_ID = os.getenv("PROJECT_ID")
 LOCATION = os.getenv("LOCATION")
 
 
+model = GenerativeModel("gemini-pro")
+
+generation_config = generative_models.GenerationConfig(
+    max_output_tokens=8192,
+    temperature=0.001,
+    top_p=1,
+)
+
+
 def generate_text(prompt: str) -> str:
     """Generates text using the Gemini-Pro model.
 
@@ -25,14 +38,6 @@ def generate_text(prompt: str) -> str:
     Returns:
         The generated text.
     """
-    model = GenerativeModel("gemini-pro")
-
-    generation_config = generative_models.GenerationConfig(
-        max_output_tokens=8192,
-        temperature=0.001,
-        top_p=1,
-    )
-
     response = model.generate_content(
         prompt,
         generation_config=generation_config,
@@ -40,6 +45,39 @@ def generate_text(prompt: str) -> str:
     return response.text
 
 
+def stream_text(prompt: str) -> Iterator[str]:
+    """Streams text generated by the Gemini-Pro model as server-sent events.
+
+    Args:
+        prompt: The text prompt to use for generation.
+
+    Yields:
+        One `data:` event per generated chunk, with the chunk text as JSON,
+        followed by a `data: [DONE]` event. If generation fails, e.g. when
+        the response is blocked, a `data:` event with the error as JSON is
+        sent instead of `data: [DONE]`.
+    """
+    start = time.perf_counter()
+    first_token = True
+    try:
+        for chunk in model.generate_content(
+            prompt,
+            generation_config=generation_config,
+            stream=True,
+        ):
+            if first_token:
+                logging.info(f"Time to first token: {time.perf_counter() - start:.2f}s")
+                first_token = False
+            yield f"data: {json.dumps({'text': chunk.text})}\n\n"
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        # The status is already sent, the error can only be reported in the
+        # stream.
+        logging.exception("Streaming generation failed")
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        return
+    yield "data: [DONE]\n\n"
+
+
 @functions_framework.http
 def get_llm_response(request: Any) -> Union[Dict, Tuple]:
     """HTTP Cloud Function that generates text using the Gemini-Pro model.
@@ -52,12 +90,19 @@ def get_llm_response(request: Any) -> Union[Dict, Tuple]:
         The response text, or any set of values that can be turned into a
         Response object using `make_response`
         <http://flask.palletsprojects.com/en/1.1.x/api/#flask.make_response>.
+        If the request sets "stream", the text is streamed as server-sent
+        events instead.
     """
     request_json: Dict = request.get_json(silent=True)
     if not request_json or "text_prompt" not in request_json:
         return {"error": "Request body must contain 'text_prompt' field."}, 400
 
     text_prompt = request_json["text_prompt"]
+    if request_json.get("stream"):
+        return flask.Response(
+            flask.stream_with_context(stream_text(text_prompt)),
+            mimetype="text/event-stream",
+        )
     generated_text = generate_text(text_prompt)
 
     return {"generated_text": generated_text}
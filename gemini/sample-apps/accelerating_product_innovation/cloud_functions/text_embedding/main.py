@@ -2,12 +2,15 @@
 Cloud function to generate embedding of given file.
 """
 
+import base64
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
-from typing import Any, List
+from typing import Any, Iterator, List
 
 from dotenv import load_dotenv
 import functions_framework
+import numpy as np
 from vertexai.preview.language_models import TextEmbeddingModel
 
 load_dotenv()
@@ -16,6 +19,18 @@ load_dotenv()
 PROJECT_ID = os.getenv("PROJECT_ID")
 LOCATION = os.getenv("LOCATION")
 
+# Request limits of the embedding model. gecko@003 accepts 250 instances per
+# request in us-central1, other regions and models accept as few as 5.
+MAX_BATCH_INSTANCES = int(os.getenv("EMBEDDING_MAX_BATCH_INSTANCES", "250"))
+MAX_BATCH_TOKENS = 20_000
+# Conservative estimate of characters per token, used to size batches.
+CHARS_PER_TOKEN = 3
+# Maximum number of batches embedded concurrently.
+MAX_CONCURRENT_BATCHES = 8
+# Embeddings per list of the "json" response, as returned before batching
+# was sized by tokens.
+JSON_GROUP_SIZE = 10
+
 
 embedding_model = TextEmbeddingModel.from_pretrained("textembedding-gecko@003")
 
@@ -37,32 +52,76 @@ def get_embeddings(instances: list[str]) -> List[List[float]]:
     return [embedding.values for embedding in embeddings]
 
 
-def generate_embeddings(pdf_data: dict) -> dict:
+def estimate_tokens(text: str) -> int:
     """
-    Extracts content from pdf_data for creating embeddings.
+    Estimates the number of tokens of a text.
 
     Args:
-        pdf_data (dict): file data to be processed.
+        text (str): Text to estimate the tokens of.
+
+    Returns:
+        int: Estimated number of tokens, rounded up.
     """
-    instances = []
-    values = []
+    return -(-len(text) // CHARS_PER_TOKEN)
 
-    batch_size = 10
-    iterate = 0
 
-    for content in pdf_data.values():
-        instances.append(content)
-        iterate += 1
+def token_batches(contents: list[str]) -> Iterator[list[str]]:
+    """
+    Packs contents into batches within the model request limits.
 
-        if iterate % batch_size == 0 or iterate == len(pdf_data):
-            embeddings = get_embeddings(instances)
-            values.append(embeddings)
+    Args:
+        contents (list[str]): Texts to embed, in order.
 
-            instances = []
+    Yields:
+        list[str]: Consecutive batches of texts.
+    """
+    batch: list[str] = []
+    batch_tokens = 0
+    for content in contents:
+        tokens = estimate_tokens(content)
+        if batch and (
+            len(batch) == MAX_BATCH_INSTANCES
+            or batch_tokens + tokens > MAX_BATCH_TOKENS
+        ):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(content)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def generate_embeddings(pdf_data: dict, encoding: str = "json") -> dict:
+    """
+    Extracts content from pdf_data for creating embeddings.
 
-    response_json = json.dumps({"embedding_column": values})
-    response = json.loads(response_json)
-    return response
+    Args:
+        pdf_data (dict): file data to be processed.
+        encoding (str): "json" to return the embeddings as lists of
+            JSON_GROUP_SIZE embeddings, or "base64" to return them as a
+            base64 encoded little-endian float32 matrix.
+    """
+    contents = list(pdf_data.values())
+
+    values: List[List[float]] = []
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_BATCHES) as executor:
+        # map preserves the order of the batches.
+        for embeddings in executor.map(get_embeddings, token_batches(contents)):
+            values.extend(embeddings)
+
+    if encoding == "base64":
+        matrix = np.asarray(values, dtype="<f4")
+        return {
+            "embedding_b64": base64.b64encode(matrix.tobytes()).decode("ascii"),
+            "shape": list(matrix.shape),
+            "dtype": "float32",
+        }
+    groups = []
+    for start in range(0, len(values), JSON_GROUP_SIZE):
+        end = start + JSON_GROUP_SIZE
+        groups.append(values[start:end])
+    return {"embedding_column": groups}
 
 
 @functions_framework.http
@@ -82,5 +141,11 @@ def get_text_embeddings(request: Any) -> tuple[dict[str, str], int]:
     if not request_json or "pdf_data" not in request_json:
         return {"error": "Request body must contain 'pdf_data' field."}, 400
     pdf_data = request_json["pdf_data"]
-    embeddings = generate_embeddings(pdf_data)
+    # pdf_data may be sent as a JSON encoded pandas Series.
+    if isinstance(pdf_data, str):
+        pdf_data = json.loads(pdf_data)
+    encoding = request_json.get("encoding", "json")
+    if encoding not in ("json", "base64"):
+        return {"error": "'encoding' must be either 'json' or 'base64'."}, 400
+    embeddings = generate_embeddings(pdf_data, encoding)
     return embeddings, 200
@@ -0,0 +1,148 @@
+"""Tests of the deletion of projects from the GCS bucket."""
+
+import threading
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+from app.pages_utils import project
+from google.api_core.exceptions import NotFound, ServiceUnavailable
+import pytest
+
+
+class FakeBlob:
+    """In-memory blob, optionally failing its first deletes transiently."""
+
+    def __init__(self, bucket: "FakeBucket", name: str, transient_failures: int = 0):
+        self.bucket = bucket
+        self.name = name
+        self.transient_failures = transient_failures
+        self.delete_attempts = 0
+
+    def delete(self, retry=None) -> None:
+        # Like the storage client, applies the retry policy to the request.
+        if retry is None:
+            self._delete()
+        else:
+            retry.with_delay(initial=0.001, maximum=0.001)(self._delete)()
+
+    def _delete(self) -> None:
+        with self.bucket.lock:
+            self.delete_attempts += 1
+            self.bucket.in_flight += 1
+            self.bucket.max_in_flight = max(
+                self.bucket.max_in_flight, self.bucket.in_flight
+            )
+        try:
+            time.sleep(0.01)
+            with self.bucket.lock:
+                if self.transient_failures:
+                    self.transient_failures -= 1
+                    raise ServiceUnavailable(f"{self.name} is busy")
+                if self.name not in self.bucket.blobs:
+                    raise NotFound(self.name)
+                del self.bucket.blobs[self.name]
+        finally:
+            with self.bucket.lock:
+                self.bucket.in_flight -= 1
+
+
+class FakeBucket:
+    """In-memory bucket recording the number of concurrent deletes."""
+
+    def __init__(self, names: list[str]):
+        self.lock = threading.Lock()
+        self.blobs = {name: FakeBlob(self, name) for name in names}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def list_blobs(self, prefix: str = "") -> list[FakeBlob]:
+        return [blob for name, blob in self.blobs.items() if name.startswith(prefix)]
+
+
+class FakeProgressBar:
+    """Records the progress reported while deleting."""
+
+    def __init__(self):
+        self.values: list[float] = []
+        self.emptied = False
+
+    def progress(self, value: float, text: Optional[str] = None) -> None:
+        self.values.append(value)
+
+    def empty(self) -> None:
+        self.emptied = True
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    names = [f"shampoo/file{i}.pdf" for i in range(64)] + ["soap/file.pdf"]
+    bucket = FakeBucket(names)
+    monkeypatch.setattr(project, "get_bucket", lambda: bucket)
+    monkeypatch.setattr(project, "invalidate_project_files", lambda: None)
+    return bucket
+
+
+@pytest.fixture
+def streamlit(monkeypatch):
+    progress_bar = FakeProgressBar()
+    saved: list[list[str]] = []
+    fake_st = SimpleNamespace(
+        session_state=SimpleNamespace(
+            product_category="shampoo", product_categories=["shampoo", "soap"]
+        ),
+        progress=lambda value, text=None: progress_bar,
+        rerun=lambda: None,
+    )
+    monkeypatch.setattr(project, "st", fake_st)
+    monkeypatch.setattr(project, "save_project_list", saved.append)
+    return SimpleNamespace(st=fake_st, progress_bar=progress_bar, saved=saved)
+
+
+def test_delete_project_deletes_its_blobs_concurrently(bucket, streamlit):
+    project.delete_project_from_gcs()
+
+    assert list(bucket.blobs) == ["soap/file.pdf"]
+    assert bucket.max_in_flight > 1
+    assert streamlit.saved == [["soap"]]
+    assert streamlit.st.session_state.product_category == "soap"
+
+
+def test_delete_project_reports_progress_of_every_blob(bucket, streamlit):
+    project.delete_project_from_gcs()
+
+    values = streamlit.progress_bar.values
+    assert len(values) == 64
+    assert values == sorted(values)
+    assert values[-1] == 1.0
+    assert streamlit.progress_bar.emptied
+
+
+def test_delete_project_skips_blobs_already_deleted(bucket, streamlit, monkeypatch):
+    # A previous, partially failed delete already removed some blobs.
+    listed = bucket.list_blobs("shampoo/")
+    for blob in listed[:10]:
+        del bucket.blobs[blob.name]
+    monkeypatch.setattr(bucket, "list_blobs", lambda prefix="": listed)
+
+    project.delete_project_from_gcs()
+
+    assert list(bucket.blobs) == ["soap/file.pdf"]
+    assert streamlit.saved == [["soap"]]
+
+
+def test_delete_blob_ignores_missing_blob():
+    bucket = FakeBucket([])
+
+    project.delete_blob(FakeBlob(bucket, "shampoo/missing.pdf"))
+
+
+def test_delete_blob_retries_transient_errors():
+    bucket = FakeBucket(["shampoo/file.pdf"])
+    blob = bucket.blobs["shampoo/file.pdf"]
+    blob.transient_failures = 2
+
+    project.delete_blob(blob)
+
+    assert blob.delete_attempts == 3
+    assert not bucket.blobs
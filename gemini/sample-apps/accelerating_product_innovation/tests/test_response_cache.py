@@ -0,0 +1,88 @@
+"""Tests of the response cache."""
+
+from app.pages_utils.response_cache import ResponseCache, similarity_scope_key
+import numpy as np
+
+CONFIG_KEY = ResponseCache.config_key("gemini-pro", None)
+
+SUGGESTIONS_PROMPT = """ Context: \n {term} \n
+    generate 5 questions based on the given context. The questions
+    should strictly be questions for further analysis of
+    {term}
+"""
+
+
+def normalized(vector: list[float]) -> np.ndarray:
+    """Returns a normalized float32 embedding."""
+    embedding = np.asarray(vector, dtype=np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+
+def test_exact_prompt_is_served_from_cache():
+    cache = ResponseCache()
+    cache.put(CONFIG_KEY, "prompt", "response")
+
+    assert cache.get(CONFIG_KEY, "prompt") == "response"
+    assert cache.get(CONFIG_KEY, "other prompt") is None
+
+
+def test_similar_prompt_is_served_within_its_scope():
+    cache = ResponseCache()
+    cache.put(CONFIG_KEY, "prompt", "response", normalized([1.0, 0.0]), "project")
+
+    similar = normalized([1.0, 0.01])
+    assert cache.get(CONFIG_KEY, "prompt.", similar, scope="project") == "response"
+
+
+def test_prompts_differing_in_search_term_do_not_collide():
+    cache = ResponseCache()
+    # Templated prompts embed almost identically, whatever the search term.
+    cache.put(
+        CONFIG_KEY,
+        SUGGESTIONS_PROMPT.format(term="sales"),
+        "questions about sales",
+        normalized([1.0, 0.0]),
+        similarity_scope_key("soap", "sales"),
+    )
+
+    assert (
+        cache.get(
+            CONFIG_KEY,
+            SUGGESTIONS_PROMPT.format(term="returns"),
+            normalized([1.0, 0.01]),
+            scope=similarity_scope_key("soap", "returns"),
+        )
+        is None
+    )
+    assert (
+        cache.get(
+            CONFIG_KEY,
+            SUGGESTIONS_PROMPT.format(term="sales") + ".",
+            normalized([1.0, 0.01]),
+            scope=similarity_scope_key("soap", "sales"),
+        )
+        == "questions about sales"
+    )
+
+
+def test_similar_prompt_of_another_project_is_not_served():
+    cache = ResponseCache()
+    cache.put(CONFIG_KEY, "context of soap", "response", normalized([1.0, 0.0]), "soap")
+
+    similar = normalized([1.0, 0.01])
+    assert cache.get(CONFIG_KEY, "context of shampoo", similar, scope="shampoo") is None
+
+
+def test_metrics_are_counted_per_page():
+    cache = ResponseCache()
+    cache.put(CONFIG_KEY, "prompt", "response")
+
+    cache.get(CONFIG_KEY, "prompt", page="insights")
+    cache.get(CONFIG_KEY, "other prompt", page="insights")
+
+    assert cache.page_metrics("insights") == {
+        "hits": 1,
+        "similar_hits": 0,
+        "misses": 1,
+    }
+    assert cache.page_metrics("drafts") == {"hits": 0, "similar_hits": 0, "misses": 0}
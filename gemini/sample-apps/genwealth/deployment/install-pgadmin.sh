@@ -219,6 +219,7 @@ echo "Loading the investments table"
 sql=$(
   cat <<EOF
 \copy investments FROM '/tmp/demo-data/investments' WITH (FORMAT csv, DELIMITER '|', QUOTE "'", ESCAPE "'")
+SELECT setval(pg_get_serial_sequence('investments', 'id'), (SELECT MAX(id) FROM investments));
 EOF
 )
 echo "$sql" | PGPASSWORD=${ALLOYDB_PASSWORD} psql -h "${ALLOYDB_IP}" -U postgres -d ragdemos
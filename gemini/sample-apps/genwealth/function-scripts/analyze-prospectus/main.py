@@ -1,7 +1,26 @@
-"""Cloud Function code to analyze a prospectus"""
+"""Cloud Function code to analyze a prospectus
+
+The company overview is built in one of two modes, set by SUMMARY_MODE:
+
+    * map_reduce (default): windows of the prospectus are summarised
+      concurrently, under a rate limit, and the partial summaries are then
+      merged hierarchically, so latency grows with the log of the length of
+      the prospectus.
+    * refine: windows are fed one after another, each refining the overview
+      built from the previous ones.
+
+The chunks are streamed from AlloyDB with a server-side cursor, so memory
+use does not grow with the length of the prospectus, and the connection
+pool is reused across warm invocations.
+"""
 
 import base64
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
 import os
+import threading
+import time
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, TypeVar
 
 import functions_framework
 from google.cloud.alloydb.connector import Connector
@@ -9,53 +28,47 @@ from langchain_core.prompts import PromptTemplate
 from langchain_google_vertexai import VertexAI
 import sqlalchemy
 
+# Characters of prospectus text sent per request.
+WINDOW_CHARS = 50000
+# Model requests sent concurrently in map_reduce mode.
+MAX_CONCURRENT_REQUESTS = 8
+# Model requests started per minute in map_reduce mode.
+REQUESTS_PER_MINUTE = 60
+# Partial summaries merged per request in map_reduce mode.
+MERGE_FAN_IN = 4
+# Rows fetched per round trip from the server-side cursor.
+STREAM_PAGE_ROWS = 500
 
-# Triggered from a message on a Cloud Pub/Sub topic.
-@functions_framework.cloud_event
-def analyze_prospectus(cloud_event):
-    """Function to analyze prospectus"""
-    # Print out the data from Pub/Sub, to prove that it worked
-    ticker = base64.b64decode(cloud_event.data["message"]["data"])
-    ticker = ticker.decode("utf-8")
-    print(ticker)
+# AlloyDB Vars
+CLUSTER = "alloydb-cluster"
+INSTANCE = "alloydb-instance"
+DATABASE = "ragdemos"
+TABLE_NAME = "langchain_vector_store"
+USER = "postgres"
 
-    # Environment Vars
-    region = os.environ["REGION"]
-    project_id = os.environ["PROJECT_ID"]
-
-    # AlloyDB Vars
-    cluster = "alloydb-cluster"
-    instance = "alloydb-instance"
-    database = "ragdemos"
-    table_name = "langchain_vector_store"
-    user = "postgres"
-    password = os.environ["ALLOYDB_PASSWORD"]
-
-    # Setup sync connector
-    connector = Connector()
-
-    def getconn():
-        conn = connector.connect(
-            f"projects/{project_id}/locations/{region}/clusters/{cluster}/instances/{instance}",
-            "pg8000",
-            user=user,
-            password=password,
-            db=database,
-        )
-        return conn
+COUNT_CHUNKS_SQL = sqlalchemy.text(
+    f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE ticker = :ticker"
+)
+SELECT_CHUNKS_SQL = sqlalchemy.text(
+    f"SELECT content FROM {TABLE_NAME} WHERE ticker = :ticker ORDER BY page, page_chunk"
+)
+INSERT_INVESTMENT_SQL = sqlalchemy.text(
+    "INSERT INTO investments (ticker, etf, market, rating, overview, analysis) VALUES (:ticker, :etf, :market, :rating, :overview, :analysis) RETURNING id"
+)
+# Moves the id sequence past the ids loaded explicitly with \copy, never
+# backwards, so that inserts can take their id from it.
+SYNC_INVESTMENT_ID_SQL = sqlalchemy.text(
+    "SELECT setval(pg_get_serial_sequence('investments', 'id'), GREATEST((SELECT COALESCE(MAX(id), 0) FROM investments), COALESCE(pg_sequence_last_value(pg_get_serial_sequence('investments', 'id')::regclass), 0), 1))"
+)
 
-    # create connection pool
-    pool = sqlalchemy.create_engine(
-        "postgresql+pg8000://",
-        creator=getconn,
-    )
+T = TypeVar("T")
+R = TypeVar("R")
 
-    # Prep SQL statement
-    sql = f"SELECT content FROM {table_name} WHERE ticker = '{ticker}' ORDER BY page, page_chunk"
+# Reused across warm invocations of the function.
+connector: Optional[Connector] = None
+pool: Optional[sqlalchemy.Engine] = None
 
-    # Prep model and template
-    model = VertexAI(model_name="gemini-pro", max_output_tokens=1024, temperature=0.0)
-    template = """
+REFINE_TEMPLATE = """
 <MISSION>
  You are an experienced financial analyst. Your mission is to create a detailed
  company financial overview for {ticker} using their latest prospectus. I will be
@@ -65,8 +78,8 @@ def analyze_prospectus(cloud_event):
 </MISSION>
 
 <TASK>
- Use the financial overview labeled <OVERVIEW> below, and use the additional details from 
- the section labeled <ADDITIONAL_CONTEXT> below to improve the financial overview in the <OVERVIEW>. 
+ Use the financial overview labeled <OVERVIEW> below, and use the additional details from
+ the section labeled <ADDITIONAL_CONTEXT> below to improve the financial overview in the <OVERVIEW>.
  Respond using less than 4000 characters, including whitespace.
 </TASK>
 
@@ -78,38 +91,141 @@ def analyze_prospectus(cloud_event):
 {chunk_text}
 </ADDITIONAL_CONTEXT>"""
 
-    prompt = PromptTemplate.from_template(template)
+MAP_TEMPLATE = """
+<MISSION>
+ You are an experienced financial analyst. Your mission is to create a detailed
+ company financial overview for {ticker} using their latest prospectus. There are
+ a total of {total_chunk_count} prospectus chunks, and I am sending you prospectus
+ chunk numbers {first_chunk}-{last_chunk} as part of this request.
+</MISSION>
 
-    # Create overview of full document by iterating through chunks
-    with pool.connect() as db_conn:
-        # query database
-        result = db_conn.execute(sqlalchemy.text(sql)).fetchall()
+<TASK>
+ Use the details from the section labeled <CONTEXT> below to write a financial
+ overview of {ticker} covering these prospectus chunks.
+ Respond using less than 4000 characters, including whitespace.
+</TASK>
 
-        # commit transaction (SQLAlchemy v2.X.X is commit as you go)
-        db_conn.commit()
+<CONTEXT>
+{chunk_text}
+</CONTEXT>"""
 
-        # Iterate through results
-        total_chunk_count = len(result)
-        overview = ""
-        chunk_text = ""
-        first_chunk = 1
-        last_chunk = 1
-
-        for i in range(len(result)):
-            current_chunk = i + 1
-            first_chunk = min(first_chunk, current_chunk)
-            last_chunk = max(last_chunk, current_chunk)
-
-            # Add text to chunk_text until token window is full
-            chunk_text = chunk_text + str(result[i].content) + " "
-            if len(chunk_text) < 50000:
-                continue
-
-            # Invoke the model
-            print(
-                f"Adding chunks {first_chunk} through {last_chunk} out of {total_chunk_count} to {ticker} overview..."
+REDUCE_TEMPLATE = """
+<MISSION>
+ You are an experienced financial analyst. Your mission is to create a detailed
+ company financial overview for {ticker} using their latest prospectus. The
+ overviews labeled <OVERVIEW> below each cover consecutive parts of the
+ prospectus.
+</MISSION>
+
+<TASK>
+ Merge the overviews below into a single financial overview of {ticker}, keeping
+ the most important details of each.
+ Respond using less than 4000 characters, including whitespace.
+</TASK>
+
+{overviews}"""
+
+
+class RateLimiter:
+    """Spaces out the start of requests shared by several threads."""
+
+    def __init__(self, requests_per_minute: int):
+        self.interval = 60.0 / requests_per_minute
+        self.next_start = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Blocks until the next request may start."""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        time.sleep(start - now)
+
+
+def get_pool() -> sqlalchemy.Engine:
+    """Returns the connection pool, creating it on the first invocation."""
+    global connector, pool
+    if pool is None:
+        region = os.environ["REGION"]
+        project_id = os.environ["PROJECT_ID"]
+        password = os.environ["ALLOYDB_PASSWORD"]
+
+        # Setup sync connector
+        connector = Connector()
+
+        def getconn():
+            conn = connector.connect(
+                f"projects/{project_id}/locations/{region}/clusters/{CLUSTER}/instances/{INSTANCE}",
+                "pg8000",
+                user=USER,
+                password=password,
+                db=DATABASE,
             )
-            fmt_prompt = prompt.format(
+            return conn
+
+        # create connection pool, checking connections left idle between
+        # invocations before use
+        engine = sqlalchemy.create_engine(
+            "postgresql+pg8000://",
+            creator=getconn,
+            pool_pre_ping=True,
+        )
+
+        # Deployments loaded before the install script synced the sequence
+        # still have it behind the existing ids.
+        with engine.begin() as db_conn:
+            db_conn.execute(SYNC_INVESTMENT_ID_SQL)
+        pool = engine
+    return pool
+
+
+def bounded_map(
+    executor: Executor, fn: Callable[[T], R], items: Iterable[T], max_pending: int
+) -> Iterator[R]:
+    """Like executor.map, but only takes the next item from items while
+    fewer than max_pending calls are pending, so items can be streamed."""
+    pending: deque = deque()
+    for item in items:
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def chunk_windows(contents: Iterable[str]) -> Iterator[Tuple[int, int, str]]:
+    """Groups chunks into windows of at least WINDOW_CHARS characters.
+
+    Yields the numbers of the first and last chunk of every window, with the
+    window text. The last window may be shorter.
+    """
+    chunk_text = ""
+    first_chunk = 1
+    current_chunk = 0
+    for current_chunk, content in enumerate(contents, start=1):
+        chunk_text = chunk_text + str(content) + " "
+        if len(chunk_text) < WINDOW_CHARS:
+            continue
+        yield first_chunk, current_chunk, chunk_text
+        first_chunk = current_chunk + 1
+        chunk_text = ""
+    if chunk_text:
+        yield first_chunk, current_chunk, chunk_text
+
+
+def refine_overview(
+    model: VertexAI, ticker: str, contents: Iterable[str], total_chunk_count: int
+) -> str:
+    """Builds the overview by refining it with one window after another."""
+    prompt = PromptTemplate.from_template(REFINE_TEMPLATE)
+    overview = ""
+    for first_chunk, last_chunk, chunk_text in chunk_windows(contents):
+        print(
+            f"Adding chunks {first_chunk} through {last_chunk} out of {total_chunk_count} to {ticker} overview..."
+        )
+        overview = model.invoke(
+            prompt.format(
                 total_chunk_count=total_chunk_count,
                 first_chunk=first_chunk,
                 last_chunk=last_chunk,
@@ -117,12 +233,105 @@ def analyze_prospectus(cloud_event):
                 chunk_text=chunk_text,
                 ticker=ticker,
             )
+        )
+    return overview
+
+
+def map_reduce_overview(
+    model: VertexAI, ticker: str, contents: Iterable[str], total_chunk_count: int
+) -> str:
+    """Builds the overview by summarising windows concurrently and merging
+    the partial summaries MERGE_FAN_IN at a time until one is left."""
+    map_prompt = PromptTemplate.from_template(MAP_TEMPLATE)
+    reduce_prompt = PromptTemplate.from_template(REDUCE_TEMPLATE)
+    limiter = RateLimiter(REQUESTS_PER_MINUTE)
+
+    def invoke(fmt_prompt: str) -> str:
+        limiter.wait()
+        return model.invoke(fmt_prompt)
+
+    def summarise(window: Tuple[int, int, str]) -> str:
+        first_chunk, last_chunk, chunk_text = window
+        print(
+            f"Summarising chunks {first_chunk} through {last_chunk} out of {total_chunk_count} of {ticker}..."
+        )
+        return invoke(
+            map_prompt.format(
+                total_chunk_count=total_chunk_count,
+                first_chunk=first_chunk,
+                last_chunk=last_chunk,
+                chunk_text=chunk_text,
+                ticker=ticker,
+            )
+        )
+
+    def merge(overviews: List[str]) -> str:
+        if len(overviews) == 1:
+            return overviews[0]
+        return invoke(
+            reduce_prompt.format(
+                overviews="\n\n".join(
+                    f"<OVERVIEW>\n{overview}\n</OVERVIEW>" for overview in overviews
+                ),
+                ticker=ticker,
+            )
+        )
 
-            overview = model.invoke(fmt_prompt)
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        # Windows are read as they are summarised, in order.
+        overviews = list(
+            bounded_map(
+                executor,
+                summarise,
+                chunk_windows(contents),
+                2 * MAX_CONCURRENT_REQUESTS,
+            )
+        )
+        while len(overviews) > 1:
+            print(f"Merging {len(overviews)} partial overviews of {ticker}...")
+            groups = []
+            for start in range(0, len(overviews), MERGE_FAN_IN):
+                end = start + MERGE_FAN_IN
+                groups.append(overviews[start:end])
+            overviews = list(executor.map(merge, groups))
+    return overviews[0] if overviews else ""
 
-            # Reset first_chunk and chunk_text values
-            first_chunk = current_chunk + 1
-            chunk_text = ""
+
+# Triggered from a message on a Cloud Pub/Sub topic.
+@functions_framework.cloud_event
+def analyze_prospectus(cloud_event):
+    """Function to analyze prospectus"""
+    # Print out the data from Pub/Sub, to prove that it worked
+    ticker = base64.b64decode(cloud_event.data["message"]["data"])
+    ticker = ticker.decode("utf-8")
+    print(ticker)
+
+    # Prep model
+    model = VertexAI(model_name="gemini-pro", max_output_tokens=1024, temperature=0.0)
+    summary_mode = os.environ.get("SUMMARY_MODE", "map_reduce")
+
+    # Create overview of full document while streaming its chunks
+    start = time.perf_counter()
+    with get_pool().connect() as db_conn:
+        total_chunk_count = db_conn.execute(
+            COUNT_CHUNKS_SQL, parameters={"ticker": ticker}
+        ).scalar_one()
+
+        # query database, fetching STREAM_PAGE_ROWS rows at a time
+        result = db_conn.execution_options(yield_per=STREAM_PAGE_ROWS).execute(
+            SELECT_CHUNKS_SQL, parameters={"ticker": ticker}
+        )
+        contents = (row.content for row in result)
+        if summary_mode == "refine":
+            overview = refine_overview(model, ticker, contents, total_chunk_count)
+        else:
+            overview = map_reduce_overview(model, ticker, contents, total_chunk_count)
+
+        # commit transaction (SQLAlchemy v2.X.X is commit as you go)
+        db_conn.commit()
+    print(
+        f"Created {ticker} overview in {summary_mode} mode in {time.perf_counter() - start:.1f}s"
+    )
 
     analysis = model.invoke(
         f"You are an experienced financial analyst. Write a financial analysis for ticker {ticker} that includes an Investment Rating (buy, sell, or hold), Investment Risk (high, medium, low), Target Investor (conservative, neutral, aggressive) and a two-paragraph analysis. Use the following company overview as context for the analysis: \n\n{overview}"
@@ -132,22 +341,11 @@ def analyze_prospectus(cloud_event):
     )
     rating = rating.strip()
 
-    insert_stmt = sqlalchemy.text(
-        "INSERT INTO investments (id, ticker, etf, market, rating, overview, analysis) VALUES (:id, :ticker, :etf, :market, :rating, :overview, :analysis)"
-    )
-
-    with pool.connect() as db_conn:
-        max_id = db_conn.execute(
-            sqlalchemy.text("SELECT MAX(id) FROM investments")
-        ).fetchall()
-        new_id = max_id[0][0] + 1
-        print(new_id)
-
-        # insert into database
-        db_conn.execute(
-            insert_stmt,
+    with get_pool().connect() as db_conn:
+        # insert into database, the id is taken from the sequence
+        new_id = db_conn.execute(
+            INSERT_INVESTMENT_SQL,
             parameters={
-                "id": new_id,
                 "ticker": ticker,
                 "etf": False,
                 "market": "US",
@@ -155,12 +353,11 @@ def analyze_prospectus(cloud_event):
                 "overview": overview,
                 "analysis": analysis,
             },
-        )
+        ).scalar_one()
+        print(new_id)
 
         # commit transaction (SQLAlchemy v2.X.X is commit as you go)
         db_conn.commit()
         print("Finished insert")
 
-    print("Closing database connection.")
-    connector.close()
     print(f"Finished analyzing ticker {ticker}.")
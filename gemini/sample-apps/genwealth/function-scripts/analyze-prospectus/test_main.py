@@ -0,0 +1,94 @@
+"""Checks of the overview modes against a fixed-latency stub model."""
+
+import re
+import threading
+import time
+from typing import List
+
+import main
+import pytest
+
+# Seconds the stub model takes to answer every prompt.
+LATENCY = 0.05
+
+
+class StubModel:
+    """Answers map prompts with the range of chunks they cover and reduce
+    prompts with their overviews joined in order, after a fixed latency."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.starts: List[float] = []
+
+    def invoke(self, prompt: str) -> str:
+        with self.lock:
+            self.starts.append(time.monotonic())
+        time.sleep(LATENCY)
+        overviews = re.findall(r"<OVERVIEW>\n(.*?)\n</OVERVIEW>", prompt, re.S)
+        if overviews:
+            return " ".join(overviews)
+        first_chunk, last_chunk = re.search(
+            r"chunk numbers (\d+)-(\d+)", prompt
+        ).groups()
+        return f"[{first_chunk}-{last_chunk}]"
+
+
+@pytest.fixture(autouse=True)
+def small_windows(monkeypatch):
+    # Every chunk below is 26 characters with its separator, so a window
+    # holds 4 chunks.
+    monkeypatch.setattr(main, "WINDOW_CHARS", 100)
+    monkeypatch.setattr(main, "REQUESTS_PER_MINUTE", 60_000)
+
+
+def chunks(count: int) -> List[str]:
+    return [f"chunk {number:<19}" for number in range(1, count + 1)]
+
+
+def test_chunk_windows_yields_the_final_short_window():
+    windows = [
+        (first_chunk, last_chunk)
+        for first_chunk, last_chunk, _ in main.chunk_windows(chunks(10))
+    ]
+
+    assert windows == [(1, 4), (5, 8), (9, 10)]
+
+
+def test_map_reduce_overview_merges_windows_in_order():
+    model = StubModel()
+
+    overview = main.map_reduce_overview(model, "ABC", chunks(22), 22)
+
+    assert overview == "[1-4] [5-8] [9-12] [13-16] [17-20] [21-22]"
+    # 6 windows, merged 4 at a time into 2 and then 1 overview.
+    assert len(model.starts) == 6 + 2 + 1
+
+
+def test_map_reduce_overview_summarises_windows_concurrently():
+    model = StubModel()
+
+    start = time.monotonic()
+    main.map_reduce_overview(model, "ABC", chunks(64), 64)
+    elapsed = time.monotonic() - start
+
+    # 16 windows and 5 merges, at most 8 calls at a time.
+    assert len(model.starts) == 16 + 4 + 1
+    assert elapsed < len(model.starts) * LATENCY / 2
+
+
+def test_map_reduce_overview_of_no_chunks_is_empty():
+    model = StubModel()
+
+    assert main.map_reduce_overview(model, "ABC", [], 0) == ""
+    assert not model.starts
+
+
+def test_map_reduce_overview_respects_the_rate_limit(monkeypatch):
+    monkeypatch.setattr(main, "REQUESTS_PER_MINUTE", 1200)
+    model = StubModel()
+
+    main.map_reduce_overview(model, "ABC", chunks(22), 22)
+
+    starts = sorted(model.starts)
+    gaps = [later - earlier for earlier, later in zip(starts, starts[1:])]
+    assert min(gaps) >= 60 / 1200 * 0.9
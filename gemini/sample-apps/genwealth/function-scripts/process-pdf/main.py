@@ -1,9 +1,18 @@
-"""Cloud Function code to process a pdf dropped in GCS"""
+"""Cloud Function code to process a pdf dropped in GCS
 
+The ingest is pipelined: Document AI shards are downloaded concurrently,
+chunks are embedded in token-sized batches with bounded parallelism, and
+the embedded chunks are written to AlloyDB with multi-row inserts in a
+single transaction while the following batches are still being embedded.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
 from pathlib import Path
 import re
-from typing import List, Optional
+import time
+from typing import Iterator, List, Optional, Tuple
 import uuid
 
 import functions_framework
@@ -11,10 +20,38 @@ from google.api_core.client_options import ClientOptions
 from google.api_core.exceptions import InternalServerError, RetryError
 from google.cloud import documentai  # type: ignore
 from google.cloud import pubsub_v1, storage
+from google.cloud.alloydb.connector import Connector
 from langchain.docstore.document import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_alloydb_pg import AlloyDBEngine, AlloyDBVectorStore, Column
+from langchain_google_alloydb_pg import AlloyDBEngine, Column
 from langchain_google_vertexai import VertexAIEmbeddings
+import sqlalchemy
+
+# Document AI output shards downloaded concurrently.
+MAX_DOWNLOAD_WORKERS = 16
+# Embedding requests sent concurrently.
+MAX_EMBEDDING_WORKERS = 8
+# Request limits of the embedding model.
+MAX_BATCH_INSTANCES = 250
+MAX_BATCH_TOKENS = 20_000
+# Conservative estimate of characters per token, used to size batches.
+CHARS_PER_TOKEN = 3
+# Rows written per INSERT statement.
+INSERT_BATCH_ROWS = 100
+
+# Metadata columns of the vector store table.
+METADATA_COLUMNS = [
+    "source",
+    "page",
+    "ticker",
+    "page_size",
+    "doc_ai_shard_count",
+    "doc_ai_shard_index",
+    "doc_ai_chunk_size",
+    "doc_ai_chunk_uri",
+    "page_chunk",
+    "chunk_size",
+]
 
 
 # Source: https://cloud.google.com/document-ai/docs/samples/documentai-batch-process-document#documentai_batch_process_document-python
@@ -143,6 +180,141 @@ def split_document(_doc):
     return new_docs
 
 
+def load_shard(blob: storage.Blob, source_file: str) -> Document:
+    """Downloads a Document AI JSON shard as a LangChain Document."""
+    print(f"Fetching {blob.name}")
+    document = documentai.Document.from_json(
+        blob.download_as_bytes(), ignore_unknown_fields=True
+    )
+
+    # Create LangChain doc
+    return Document(
+        page_content=document.text,
+        metadata={
+            "source": source_file,
+            "page": document.shard_info.shard_index + 1,
+            "ticker": Path(source_file).stem,
+            "page_size": len(document.text),
+            "doc_ai_shard_count": document.shard_info.shard_count,
+            "doc_ai_shard_index": document.shard_info.shard_index,
+            "doc_ai_chunk_size": blob._CHUNK_SIZE_MULTIPLE,
+            "doc_ai_chunk_uri": blob.public_url,
+        },
+    )
+
+
+def download_shards(blobs: List[storage.Blob], source_file: str) -> List[Document]:
+    """Downloads the Document AI JSON shards concurrently, in order."""
+    json_blobs = []
+    for blob in blobs:
+        # Document AI should only output JSON files to GCS
+        if blob.content_type != "application/json":
+            print(
+                f"Skipping non-supported file: {blob.name} - Mimetype: {blob.content_type}"
+            )
+            continue
+        json_blobs.append(blob)
+
+    with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+        # map preserves the order of the shards.
+        return list(
+            executor.map(lambda blob: load_shard(blob, source_file), json_blobs)
+        )
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of tokens of a text, rounded up."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def token_batches(docs: List[Document]) -> Iterator[List[Document]]:
+    """Packs chunks into batches within the embedding request limits."""
+    batch: List[Document] = []
+    batch_tokens = 0
+    for doc in docs:
+        tokens = estimate_tokens(doc.page_content)
+        if batch and (
+            len(batch) == MAX_BATCH_INSTANCES
+            or batch_tokens + tokens > MAX_BATCH_TOKENS
+        ):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(doc)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def embed_batches(
+    embedding: VertexAIEmbeddings, docs: List[Document]
+) -> Iterator[Tuple[List[Document], List[List[float]]]]:
+    """Embeds chunks in token-sized batches with bounded parallelism.
+
+    Yields every batch with its embeddings, in order, as soon as it and the
+    batches before it are embedded, while the following batches are still
+    being embedded.
+    """
+    batches = list(token_batches(docs))
+
+    def embed(batch: List[Document]) -> List[List[float]]:
+        texts = [doc.page_content for doc in batch]
+        # A single request per batch, the batch is already within limits.
+        return embedding.embed_documents(texts, batch_size=len(texts))
+
+    with ThreadPoolExecutor(max_workers=MAX_EMBEDDING_WORKERS) as executor:
+        # map preserves the order of the batches.
+        yield from zip(batches, executor.map(embed, batches))
+
+
+def insert_chunks(
+    db_conn: sqlalchemy.Connection,
+    table_name: str,
+    docs: List[Document],
+    embeddings: List[List[float]],
+) -> None:
+    """Writes embedded chunks to the vector store table with multi-row
+    inserts.
+
+    The rows have the layout of the LangChain AlloyDB vector store, metadata
+    without a column of its own is kept in the langchain_metadata column.
+    """
+    columns = ["langchain_id", "content", "embedding", *METADATA_COLUMNS]
+    columns.append("langchain_metadata")
+    for start in range(0, len(docs), INSERT_BATCH_ROWS):
+        end = start + INSERT_BATCH_ROWS
+        rows = []
+        parameters = {}
+        for i, (doc, values) in enumerate(zip(docs[start:end], embeddings[start:end])):
+            placeholders = [
+                f":id_{i}",
+                f":content_{i}",
+                f"CAST(:embedding_{i} AS vector)",
+            ]
+            parameters[f"id_{i}"] = str(uuid.uuid4())
+            parameters[f"content_{i}"] = doc.page_content
+            parameters[f"embedding_{i}"] = str(values)
+            for column in METADATA_COLUMNS:
+                placeholders.append(f":{column}_{i}")
+                parameters[f"{column}_{i}"] = doc.metadata.get(column)
+            placeholders.append(f":metadata_{i}")
+            parameters[f"metadata_{i}"] = json.dumps(
+                {
+                    key: value
+                    for key, value in doc.metadata.items()
+                    if key not in METADATA_COLUMNS
+                }
+            )
+            rows.append(f"({', '.join(placeholders)})")
+
+        db_conn.execute(
+            sqlalchemy.text(
+                f'INSERT INTO "{table_name}" ({", ".join(columns)}) VALUES {", ".join(rows)}'
+            ),
+            parameters,
+        )
+
+
 # Triggered by a change in a storage bucket
 @functions_framework.cloud_event
 def process_pdf(cloud_event):
@@ -191,39 +363,19 @@ def process_pdf(cloud_event):
     )
 
     # Document AI may output multiple JSON files per source file
-    lc_doc = []
-    for blob in blobs:
-        # Document AI should only output JSON files to GCS
-        if blob.content_type != "application/json":
-            print(
-                f"Skipping non-supported file: {blob.name} - Mimetype: {blob.content_type}"
-            )
-            continue
-
-        # Download JSON File as bytes object and convert to Document Object
-        print(f"Fetching {blob.name}")
-        document = documentai.Document.from_json(
-            blob.download_as_bytes(), ignore_unknown_fields=True
-        )
-
-        # Create LangChain doc
-        page = Document(
-            page_content=document.text,
-            metadata={
-                "source": source_file,
-                "page": document.shard_info.shard_index + 1,
-                "ticker": Path(source_file).stem,
-                "page_size": len(document.text),
-                "doc_ai_shard_count": document.shard_info.shard_count,
-                "doc_ai_shard_index": document.shard_info.shard_index,
-                "doc_ai_chunk_size": blob._CHUNK_SIZE_MULTIPLE,
-                "doc_ai_chunk_uri": blob.public_url,
-            },
-        )
-        lc_doc.append(page)
+    start = time.perf_counter()
+    lc_doc = download_shards(blobs, source_file)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Downloaded {len(lc_doc)} shards in {elapsed:.1f}s "
+        f"({len(lc_doc) / max(elapsed, 1e-9):.1f} shards/s)"
+    )
 
     # Split docs into smaller chunks (max 3072 tokens, 9216 characters)
+    start = time.perf_counter()
     lc_doc_chunks = split_document(lc_doc)
+    elapsed = time.perf_counter() - start
+    print(f"Split into {len(lc_doc_chunks)} chunks in {elapsed:.1f}s")
 
     # Setup embeddings
     embedding = VertexAIEmbeddings(
@@ -240,19 +392,17 @@ def process_pdf(cloud_event):
     initialize_vector_store = False
     ip_type = os.environ["IP_TYPE"]
 
-    # Create vector store
-    engine = AlloyDBEngine.from_instance(
-        project_id=project_id,
-        region=region,
-        cluster=cluster,
-        instance=instance,
-        database=database,
-        user=user,
-        password=password,
-        ip_type=ip_type,
-    )
-
     if initialize_vector_store:
+        engine = AlloyDBEngine.from_instance(
+            project_id=project_id,
+            region=region,
+            cluster=cluster,
+            instance=instance,
+            database=database,
+            user=user,
+            password=password,
+            ip_type=ip_type,
+        )
         engine.init_vectorstore_table(
             table_name=table_name,
             vector_size=768,  # Vector size for VertexAI model(textembedding-gecko@latest)
@@ -271,26 +421,53 @@ def process_pdf(cloud_event):
             overwrite_existing=True,
         )
 
-    store = AlloyDBVectorStore.create_sync(
-        engine=engine,
-        table_name=table_name,
-        embedding_service=embedding,
-        metadata_columns=[
-            "source",
-            "page",
-            "ticker",
-            "page_size",
-            "doc_ai_shard_count",
-            "doc_ai_shard_index",
-            "doc_ai_chunk_size",
-            "doc_ai_chunk_uri",
-            "page_chunk",
-            "chunk_size",
-        ],
-    )
+    # Setup sync connector, closed even if embedding or inserting fails
+    with Connector() as connector:
+
+        def getconn():
+            conn = connector.connect(
+                f"projects/{project_id}/locations/{region}/clusters/{cluster}/instances/{instance}",
+                "pg8000",
+                user=user,
+                password=password,
+                db=database,
+                ip_type=ip_type,
+            )
+            return conn
+
+        # create connection pool
+        pool = sqlalchemy.create_engine(
+            "postgresql+pg8000://",
+            creator=getconn,
+        )
 
-    ids = [str(uuid.uuid4()) for i in range(len(lc_doc_chunks))]
-    store.add_documents(lc_doc_chunks, ids)
+        # Embed the chunks in parallel batches and write every batch as soon
+        # as it is embedded, all in one transaction.
+        start = time.perf_counter()
+        embed_wait = 0.0
+        insert_time = 0.0
+        with pool.begin() as db_conn:
+            batch_start = time.perf_counter()
+            for docs, embeddings in embed_batches(embedding, lc_doc_chunks):
+                insert_start = time.perf_counter()
+                embed_wait += insert_start - batch_start
+                insert_chunks(db_conn, table_name, docs, embeddings)
+                batch_start = time.perf_counter()
+                insert_time += batch_start - insert_start
+        elapsed = time.perf_counter() - start
+        pool.dispose()
+
+    tokens = sum(estimate_tokens(doc.page_content) for doc in lc_doc_chunks)
+    print(
+        f"Embedded {len(lc_doc_chunks)} chunks (~{tokens} tokens) while waiting "
+        f"{embed_wait:.1f}s for embeddings "
+        f"({len(lc_doc_chunks) / max(embed_wait, 1e-9):.1f} chunks/s)"
+    )
+    print(
+        f"Inserted {len(lc_doc_chunks)} rows in {insert_time:.1f}s "
+        f"({len(lc_doc_chunks) / max(insert_time, 1e-9):.1f} rows/s)"
+    )
+    print(f"Embedded and stored all chunks in {elapsed:.1f}s")
 
     print("Finished processing pdf")
 
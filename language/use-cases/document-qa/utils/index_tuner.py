@@ -0,0 +1,208 @@
+# Utility functions to tune the tree-AH configuration of an Index locally
+import logging
+import math
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger()
+
+# Relative cost of scoring a candidate against its quantized representation,
+# compared to an exact dot product over float32 embeddings.
+QUANTIZED_SCORE_COST = 0.25
+
+
+def kmeans(
+    embeddings: np.ndarray, n_clusters: int, n_iter: int = 10, seed: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Partitions embeddings with Lloyd's k-means.
+
+    Args:
+        embeddings: The (n, dimensions) matrix to partition.
+        n_clusters: The amount of partitions.
+        n_iter: The amount of refinement iterations.
+        seed: Seed for the initial centroids.
+
+    Returns:
+        The (n_clusters, dimensions) centroids and the partition of every
+        embedding.
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(embeddings))
+    centroids = embeddings[rng.choice(len(embeddings), n_clusters, replace=False)]
+    squared_norms = np.einsum("ij,ij->i", embeddings, embeddings)
+
+    for _ in range(n_iter):
+        distances = (
+            squared_norms[:, None]
+            - 2 * embeddings @ centroids.T
+            + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+        )
+        assignments = distances.argmin(axis=1)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, embeddings)
+        # Empty partitions keep their previous centroid.
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+
+    return centroids, assignments
+
+
+def _quantize_residuals(
+    embeddings: np.ndarray, centroids: np.ndarray, assignments: np.ndarray
+) -> np.ndarray:
+    """Approximates embeddings by their centroid plus 4-bit residuals."""
+    residuals = embeddings - centroids[assignments]
+    low = residuals.min(axis=0)
+    step = (residuals.max(axis=0) - low) / 15
+    step[step == 0] = 1
+    codes = np.round((residuals - low) / step)
+    return centroids[assignments] + codes * step + low
+
+
+def tune_tree_ah_config(
+    embeddings: Sequence[Sequence[float]],
+    queries: Sequence[Sequence[float]],
+    k: int = 10,
+    leaf_node_embedding_counts: Sequence[int] = (250, 500, 1000),
+    leaf_nodes_to_search_percents: Sequence[int] = (3, 5, 7, 10, 15),
+    approximate_neighbors_counts: Sequence[int] = (50, 150, 300),
+    target_recall: float = 0.95,
+    distance_measure_type: str = "DOT_PRODUCT_DISTANCE",
+    seed: int = 0,
+) -> Tuple[Dict[str, int], List[Dict[str, Any]]]:
+    """Sweeps the tree-AH parameters of `MatchingEngineUtils.create_index`.
+
+    The index is simulated locally: the sample is partitioned with k-means
+    into leaves of about `leafNodeEmbeddingCount` embeddings, every query
+    scores the candidates of its closest `leafNodesToSearchPercent` leaves
+    against 4-bit quantized embeddings, and the best
+    `approximateNeighborsCount` candidates are re-scored exactly. The
+    sample should be representative of the corpus and hold at least a few
+    leaves worth of embeddings for the largest leaf size.
+
+    Args:
+        embeddings: A sample of the embeddings to index.
+        queries: Held-out query embeddings.
+        k: The amount of neighbors recall is measured on.
+        leaf_node_embedding_counts: Values of `leafNodeEmbeddingCount`.
+        leaf_nodes_to_search_percents: Values of `leafNodesToSearchPercent`.
+        approximate_neighbors_counts: Values of `approximateNeighborsCount`.
+        target_recall: The recall@k the recommendation must reach.
+        distance_measure_type: `DOT_PRODUCT_DISTANCE` or `COSINE_DISTANCE`.
+        seed: Seed for the k-means initialization.
+
+    Returns:
+        The recommended configuration, as keyword arguments for
+        `create_index`, and the results of every configuration with its
+        recall@k and estimated query cost. The cost is the amount of exact
+        dot products per query, relative to brute force.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    if distance_measure_type == "COSINE_DISTANCE":
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    elif distance_measure_type != "DOT_PRODUCT_DISTANCE":
+        raise ValueError(
+            f"Unsupported distance measure type {distance_measure_type}. "
+            "Use DOT_PRODUCT_DISTANCE or COSINE_DISTANCE."
+        )
+
+    n = len(embeddings)
+    k = min(k, n)
+    exact_scores = queries @ embeddings.T
+    ground_truth = np.argpartition(-exact_scores, k - 1, axis=1)[:, :k]
+
+    results = []
+    for leaf_node_embedding_count in leaf_node_embedding_counts:
+        n_leaves = max(1, round(n / leaf_node_embedding_count))
+        logger.info(f"Partitioning {n} embeddings into {n_leaves} leaves ...")
+        centroids, assignments = kmeans(embeddings, n_leaves, seed=seed)
+        # An index has no empty leaves, k-means may leave some clusters empty.
+        non_empty = np.bincount(assignments, minlength=len(centroids)) > 0
+        centroids = centroids[non_empty]
+        assignments = (np.cumsum(non_empty) - 1)[assignments]
+        n_leaves = len(centroids)
+        leaves = [np.flatnonzero(assignments == leaf) for leaf in range(n_leaves)]
+        approximate_scores = (
+            queries @ _quantize_residuals(embeddings, centroids, assignments).T
+        )
+        leaf_order = np.argsort(-(queries @ centroids.T), axis=1)
+
+        for leaf_nodes_to_search_percent in leaf_nodes_to_search_percents:
+            n_search = max(1, math.ceil(n_leaves * leaf_nodes_to_search_percent / 100))
+            candidates = [
+                np.concatenate([leaves[leaf] for leaf in leaf_order[q, :n_search]])
+                for q in range(len(queries))
+            ]
+
+            for approximate_neighbors_count in approximate_neighbors_counts:
+                recall = 0.0
+                cost = 0.0
+                for q, query_candidates in enumerate(candidates):
+                    n_approximate = min(
+                        approximate_neighbors_count, len(query_candidates)
+                    )
+                    cost += (
+                        n_leaves
+                        + QUANTIZED_SCORE_COST * len(query_candidates)
+                        + n_approximate
+                    )
+                    if n_approximate == 0:
+                        # Nothing found, the query counts with a zero recall.
+                        continue
+                    shortlist = query_candidates[
+                        np.argpartition(
+                            -approximate_scores[q, query_candidates], n_approximate - 1
+                        )[:n_approximate]
+                    ]
+                    n_found = min(k, len(shortlist))
+                    found = shortlist[
+                        np.argpartition(-exact_scores[q, shortlist], n_found - 1)[
+                            :n_found
+                        ]
+                    ]
+                    recall += len(np.intersect1d(found, ground_truth[q])) / k
+
+                results.append(
+                    {
+                        "leaf_node_embedding_count": leaf_node_embedding_count,
+                        "leaf_nodes_to_search_percent": leaf_nodes_to_search_percent,
+                        "approximate_neighbors_count": approximate_neighbors_count,
+                        "recall": recall / len(queries),
+                        "cost": cost / len(queries) / n,
+                    }
+                )
+
+    recommended = recommend_tree_ah_config(results, target_recall)
+    logger.info(f"Recommended tree-AH configuration {recommended}")
+    return recommended, results
+
+
+def recommend_tree_ah_config(
+    results: List[Dict[str, Any]], target_recall: float = 0.95
+) -> Dict[str, int]:
+    """Picks the cheapest configuration reaching the target recall.
+
+    Args:
+        results: The results returned by `tune_tree_ah_config`.
+        target_recall: The recall@k the configuration must reach. If none
+        does, the configuration with the best recall is picked.
+
+    Returns:
+        Keyword arguments for `MatchingEngineUtils.create_index`.
+    """
+    eligible = [result for result in results if result["recall"] >= target_recall]
+    if eligible:
+        best = min(eligible, key=lambda result: result["cost"])
+    else:
+        logger.warning(f"No configuration reaches a recall of {target_recall}")
+        best = max(results, key=lambda result: (result["recall"], -result["cost"]))
+
+    return {
+        "leaf_node_embedding_count": best["leaf_node_embedding_count"],
+        "leaf_nodes_to_search_percent": best["leaf_nodes_to_search_percent"],
+        "approximate_neighbors_count": best["approximate_neighbors_count"],
+    }
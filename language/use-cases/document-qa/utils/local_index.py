@@ -0,0 +1,361 @@
+"""In-process mirror of a Vertex Matching Engine index."""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger()
+
+
+def _normalize_restricts(
+    restricts: Optional[Union[Dict[str, Any], Iterable[Any]]],
+) -> Dict[str, Tuple[set, set]]:
+    """Normalizes restricts into {namespace: (allow_tokens, deny_tokens)}.
+
+    Accepts the shapes used across this package:
+    `aiplatform_v1.IndexDatapoint.Restriction` messages, snake_case dicts
+    (`allow_list`) as passed to `add_texts`, and camelCase dicts
+    (`allowList`) as sent to the findNeighbors REST API. A single restrict
+    dict is treated as a list of one; an empty dict means no restricts.
+
+    Raises:
+        ValueError: If a restrict has an unrecognized shape or no namespace.
+    """
+    if isinstance(restricts, dict):
+        restricts = [restricts] if restricts else []
+    normalized: Dict[str, Tuple[set, set]] = {}
+    for restrict in restricts or []:
+        if isinstance(restrict, dict):
+            namespace = restrict.get("namespace")
+            allow = restrict.get("allow_list", restrict.get("allowList", []))
+            deny = restrict.get("deny_list", restrict.get("denyList", []))
+        elif hasattr(restrict, "namespace"):
+            namespace = restrict.namespace
+            allow = getattr(restrict, "allow_list", [])
+            deny = getattr(restrict, "deny_list", [])
+        else:
+            raise ValueError(f"Unrecognized restrict: {restrict!r}")
+        if not namespace:
+            raise ValueError(f"Restrict has no namespace: {restrict!r}")
+        if isinstance(allow, str) or isinstance(deny, str):
+            raise ValueError(f"Restrict token lists must be lists: {restrict!r}")
+        allow_tokens, deny_tokens = normalized.setdefault(namespace, (set(), set()))
+        allow_tokens.update(allow or [])
+        deny_tokens.update(deny or [])
+    return normalized
+
+
+class LocalIndex:
+    """NumPy implementation of a Matching Engine index used as a local mirror.
+
+    The mirror holds the same datapoints that are upserted to the remote
+    index (id, feature vector and restricts) together with the embedded
+    text, and answers nearest neighbor queries with an exact dot product
+    search. Restricts follow the Matching Engine filtering semantics: for
+    every namespace in the query, a datapoint matches only if it has at
+    least one token of that namespace in the query allow list (when one is
+    given), no token in the query deny list, and no token of the query
+    allow list in its own deny list.
+
+    For every namespace and token, a boolean row mask of the datapoints
+    allowing or denying it is maintained on upsert, so filters are applied
+    with a few vectorized operations per query.
+
+    The mirror is considered stale once `max_staleness` seconds have passed
+    since it was last synced with the remote index, or after
+    :func:`LocalIndex.invalidate` is called.
+    """
+
+    def __init__(
+        self,
+        dimensions: Optional[int] = None,
+        max_staleness: Optional[float] = None,
+        initial_capacity: int = 1024,
+    ):
+        """Creates an empty mirror.
+
+        Args:
+            dimensions: The embedding dimensions. Inferred from the first
+            upsert if not provided.
+            max_staleness (Optional): Seconds after which the mirror is
+            considered stale. `None` means it never goes stale on its own.
+            initial_capacity: Number of rows allocated up front.
+        """
+        self.dimensions = dimensions
+        self.max_staleness = max_staleness
+        self._capacity = initial_capacity
+        self._vectors: Optional[np.ndarray] = None
+        self._size = 0
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._restricts: List[Dict[str, Tuple[set, set]]] = []
+        # {namespace: {token: row mask}} of the datapoint allow and deny lists.
+        self._allow_masks: Dict[str, Dict[str, np.ndarray]] = {}
+        self._deny_masks: Dict[str, Dict[str, np.ndarray]] = {}
+        self._documents: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.synced_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _ensure_capacity(self, required: int) -> None:
+        if self._vectors is None:
+            self._capacity = max(self._capacity, required)
+            self._vectors = np.zeros((self._capacity, self.dimensions), np.float32)
+        elif required > self._vectors.shape[0] or not self._vectors.flags.writeable:
+            # Memory-mapped mirrors are read-only and copied on first write.
+            capacity = max(required, 2 * self._vectors.shape[0])
+            vectors = np.zeros((capacity, self.dimensions), np.float32)
+            vectors[: self._size] = self._vectors[: self._size]
+            self._vectors = vectors
+            self._capacity = capacity
+            for token_masks in (self._allow_masks, self._deny_masks):
+                for masks in token_masks.values():
+                    for token, mask in masks.items():
+                        masks[token] = np.zeros(capacity, dtype=bool)
+                        masks[token][: len(mask)] = mask
+
+    def _index_restricts(
+        self, position: int, restricts: Dict[str, Tuple[set, set]], value: bool
+    ) -> None:
+        """Sets or clears the row masks of the restricts of a datapoint."""
+        for namespace, (allow, deny) in restricts.items():
+            for token_masks, tokens in (
+                (self._allow_masks, allow),
+                (self._deny_masks, deny),
+            ):
+                masks = token_masks.setdefault(namespace, {})
+                for token in tokens:
+                    if token not in masks:
+                        masks[token] = np.zeros(self._capacity, dtype=bool)
+                    masks[token][position] = value
+
+    def _any_token(
+        self,
+        token_masks: Dict[str, Dict[str, np.ndarray]],
+        namespace: str,
+        tokens: set,
+    ) -> np.ndarray:
+        """Returns the row mask of the datapoints having any of the tokens."""
+        mask = np.zeros(self._size, dtype=bool)
+        masks = token_masks.get(namespace, {})
+        for token in tokens:
+            if token in masks:
+                mask |= masks[token][: self._size]
+        return mask
+
+    def upsert(
+        self,
+        ids: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+        restricts: Optional[Sequence[Optional[Iterable[Any]]]] = None,
+        documents: Optional[Sequence[str]] = None,
+    ) -> None:
+        """Inserts or updates datapoints in the mirror.
+
+        Args:
+            ids: The datapoint ids.
+            embeddings: The feature vectors, one per id.
+            restricts (Optional): The restricts of every datapoint.
+            documents (Optional): The embedded texts, served instead of
+            downloading them from GCS.
+        """
+        if len(ids) == 0:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if self.dimensions is None:
+            self.dimensions = vectors.shape[1]
+        elif vectors.shape[1] != self.dimensions:
+            raise ValueError(
+                f"Expected embeddings with {self.dimensions} dimensions. "
+                f"Received {vectors.shape[1]}"
+            )
+        restricts = restricts or [None] * len(ids)
+
+        with self._lock:
+            self._ensure_capacity(self._size + len(ids))
+            for i, datapoint_id in enumerate(ids):
+                position = self._positions.get(datapoint_id)
+                if position is None:
+                    position = self._size
+                    self._positions[datapoint_id] = position
+                    self._ids.append(datapoint_id)
+                    self._restricts.append({})
+                    self._size += 1
+                self._vectors[position] = vectors[i]
+                self._index_restricts(position, self._restricts[position], False)
+                self._restricts[position] = _normalize_restricts(restricts[i])
+                self._index_restricts(position, self._restricts[position], True)
+                if documents is not None:
+                    self._documents[datapoint_id] = documents[i]
+            self.synced_at = time.time()
+
+    def get_document(self, datapoint_id: str) -> Optional[str]:
+        """Returns the mirrored text for a datapoint, if it is known."""
+        return self._documents.get(datapoint_id)
+
+    def is_stale(self) -> bool:
+        """Whether queries should go to the remote index instead."""
+        if self.synced_at is None or self._size == 0:
+            return True
+        if self.max_staleness is None:
+            return False
+        return time.time() - self.synced_at > self.max_staleness
+
+    def invalidate(self) -> None:
+        """Marks the mirror as stale until the next upsert."""
+        self.synced_at = None
+
+    def _filter_mask(self, filters: Optional[Iterable[Any]]) -> Optional[np.ndarray]:
+        query_restricts = _normalize_restricts(filters)
+        if not query_restricts:
+            return None
+        mask = np.ones(self._size, dtype=bool)
+        for namespace, (allow, deny) in query_restricts.items():
+            if allow:
+                mask &= self._any_token(self._allow_masks, namespace, allow)
+                mask &= ~self._any_token(self._deny_masks, namespace, allow)
+            if deny:
+                mask &= ~self._any_token(self._allow_masks, namespace, deny)
+        return mask
+
+    def find_neighbors(
+        self,
+        embeddings: Sequence[Sequence[float]],
+        n_matches: int,
+        filters: Optional[Iterable[Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """Finds the nearest neighbors of every query embedding.
+
+        Args:
+            embeddings: The query vectors.
+            n_matches: The amount of neighbors to return per query.
+            filters (Optional): Query restricts.
+
+        Returns:
+            For every query, a list of neighbors in the same shape as the
+            `neighbors` field of the findNeighbors REST response.
+        """
+        if self._size == 0 or n_matches <= 0:
+            return [[] for _ in embeddings]
+
+        queries = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            vectors = self._vectors[: self._size]
+            ids = list(self._ids)
+            restricts = list(self._restricts)
+            mask = self._filter_mask(filters)
+
+        scores = queries @ vectors.T
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+        candidates = self._size if mask is None else int(mask.sum())
+        k = min(n_matches, candidates)
+        if k == 0:
+            return [[] for _ in embeddings]
+
+        results = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top])]
+            neighbors = []
+            for position in top:
+                datapoint = {"datapointId": ids[position]}
+                if restricts[position]:
+                    datapoint["restricts"] = [
+                        {
+                            "namespace": namespace,
+                            "allowList": sorted(allow),
+                            "denyList": sorted(deny),
+                        }
+                        for namespace, (allow, deny) in restricts[position].items()
+                    ]
+                neighbors.append(
+                    {"datapoint": datapoint, "distance": float(row[position])}
+                )
+            results.append(neighbors)
+        return results
+
+    def save(self, path: str) -> None:
+        """Persists the mirror to a directory.
+
+        Args:
+            path: The directory where the vectors and metadata will be stored.
+        """
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            vectors = (
+                self._vectors[: self._size]
+                if self._vectors is not None
+                else np.zeros((0, self.dimensions or 0), np.float32)
+            )
+            np.save(os.path.join(path, "vectors.npy"), vectors)
+            metadata = {
+                "dimensions": self.dimensions,
+                "synced_at": self.synced_at,
+                "ids": self._ids,
+                "restricts": [
+                    [
+                        {
+                            "namespace": namespace,
+                            "allow_list": sorted(allow),
+                            "deny_list": sorted(deny),
+                        }
+                        for namespace, (allow, deny) in restricts.items()
+                    ]
+                    for restricts in self._restricts
+                ],
+                "documents": self._documents,
+            }
+        with open(os.path.join(path, "metadata.json"), "w") as f:
+            json.dump(metadata, f)
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        mmap: bool = True,
+        max_staleness: Optional[float] = None,
+    ) -> "LocalIndex":
+        """Loads a mirror persisted with :func:`LocalIndex.save`.
+
+        Args:
+            path: The directory the mirror was saved to.
+            mmap: Memory-map the vectors instead of reading them into memory.
+            The matrix is copied on the first upsert.
+            max_staleness (Optional): See :class:`LocalIndex`.
+
+        Returns:
+            The loaded LocalIndex.
+        """
+        with open(os.path.join(path, "metadata.json")) as f:
+            metadata = json.load(f)
+        vectors = np.load(
+            os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None
+        )
+
+        local_index = cls(
+            dimensions=metadata["dimensions"], max_staleness=max_staleness
+        )
+        local_index._vectors = vectors
+        local_index._capacity = vectors.shape[0]
+        local_index._size = vectors.shape[0]
+        local_index._ids = metadata["ids"]
+        local_index._positions = {id: i for i, id in enumerate(local_index._ids)}
+        local_index._restricts = [
+            _normalize_restricts(restricts) for restricts in metadata["restricts"]
+        ]
+        for position, restricts in enumerate(local_index._restricts):
+            local_index._index_restricts(position, restricts, True)
+        local_index._documents = metadata["documents"]
+        local_index.synced_at = metadata["synced_at"]
+        logger.info(f"Loaded local index mirror with {len(local_index)} datapoints.")
+        return local_index
@@ -2,9 +2,11 @@
 
 from __future__ import annotations
 
+from itertools import islice, repeat
 import json
 import logging
-from typing import Any, Iterable, List, Optional, Type
+import os
+from typing import Any, Callable, Iterable, List, Optional, Type
 import uuid
 
 import google.auth
@@ -18,6 +20,8 @@ from langchain.embeddings.base import Embeddings
 from langchain.vectorstores.base import VectorStore
 import requests
 
+from .local_index import LocalIndex
+
 logger = logging.getLogger()
 
 
@@ -48,6 +52,7 @@ class MatchingEngine(VectorStore):
         index_endpoint_client: aiplatform_v1.IndexEndpointServiceClient,
         gcs_bucket_name: str,
         credentials: Credentials = None,
+        local_index: Optional[LocalIndex] = None,
     ):
         """Vertex Matching Engine implementation of the vector store.
 
@@ -75,6 +80,9 @@ class MatchingEngine(VectorStore):
             multilingual Tensorflow Universal Sentence Encoder will be used.
             gcs_client: The Google Cloud Storage client.
             credentials (Optional): Created GCP credentials.
+            local_index (Optional): A :class:`LocalIndex` mirror of the
+            index. It receives every datapoint upserted by `add_texts` and
+            serves `similarity_search` while it is not stale.
         """
         super().__init__()
         self._validate_google_libraries_installation()
@@ -90,6 +98,7 @@ class MatchingEngine(VectorStore):
         self.gcs_client = gcs_client
         self.credentials = credentials
         self.gcs_bucket_name = gcs_bucket_name
+        self.local_index = local_index
 
     def _validate_google_libraries_installation(self) -> None:
         """Validates that Google libraries that are needed are installed."""
@@ -107,55 +116,151 @@ class MatchingEngine(VectorStore):
         self,
         texts: Iterable[str],
         metadatas: Optional[Iterable[dict]],
+        batch_size: int = 100,
+        checkpoint_path: Optional[str] = None,
+        progress_callback: Optional[Callable[[int], None]] = None,
         **kwargs: Any,
     ) -> List[str]:
         """Run more texts through the embeddings and add to the vectorstore.
 
+        The texts are consumed lazily in windows of `batch_size`: every
+        window is embedded, uploaded to GCS and upserted before the next one
+        is read, so memory stays bounded and generators are supported.
+
         Args:
             texts: Iterable of strings to add to the vectorstore.
             metadatas: Optional list of metadatas associated with the texts.
+            batch_size: The amount of texts embedded and upserted at once.
+            checkpoint_path: (Optional) Local file recording the progress.
+            If the file exists, the texts it already covers are skipped, so
+            re-running with the same inputs resumes after a crash. Datapoint
+            ids are derived from the checkpoint, which makes re-processing
+            the interrupted window idempotent. The file is deleted once all
+            texts are indexed.
+            progress_callback: (Optional) Called with the total amount of
+            texts indexed after every window.
             kwargs: vectorstore specific parameters.
 
         Returns:
             List of ids from adding the texts into the vectorstore.
         """
-        logger.debug("Embedding documents.")
-        embeddings = self.embedding.embed_documents(list(texts))
-        insert_datapoints_payload = []
-        ids = []
+        checkpoint = self._load_checkpoint(checkpoint_path)
+        run_id = uuid.UUID(checkpoint["run_id"]) if checkpoint else uuid.uuid4()
+        # Ids of a checkpointed run are derived from the run id and position.
+        ids = (
+            [str(uuid.uuid5(run_id, str(i))) for i in range(checkpoint["count"])]
+            if checkpoint
+            else []
+        )
+
+        items = zip(texts, metadatas if metadatas is not None else repeat(None))
+        if ids:
+            logger.info(f"Resuming from checkpoint after {len(ids)} documents.")
+            items = islice(items, len(ids), None)
 
         # Streaming index update
-        for idx, (embedding, text, metadata) in enumerate(
-            zip(embeddings, texts, metadatas or [])
-        ):
-            id = uuid.uuid4()
-            ids.append(str(id))
-            self._upload_to_gcs(text, f"documents/{id}")
-
-            insert_datapoints_payload.append(
-                aiplatform_v1.IndexDatapoint(
-                    datapoint_id=str(id),
-                    feature_vector=embedding,
-                    restricts=metadata if metadata else [],
-                )
-            )
-            if idx % 100 == 0:
-                upsert_request = aiplatform_v1.UpsertDatapointsRequest(
-                    index=self.index.name, datapoints=insert_datapoints_payload
+        while True:
+            window = list(islice(items, batch_size))
+            if not window:
+                break
+            window_texts = [text for text, _ in window]
+
+            logger.debug(f"Embedding {len(window_texts)} documents.")
+            embeddings = self.embedding.embed_documents(window_texts)
+
+            insert_datapoints_payload = []
+            for offset, (embedding, (text, metadata)) in enumerate(
+                zip(embeddings, window)
+            ):
+                if checkpoint_path:
+                    id = uuid.uuid5(run_id, str(len(ids) + offset))
+                else:
+                    id = uuid.uuid4()
+                self._upload_to_gcs(text, f"documents/{id}")
+
+                insert_datapoints_payload.append(
+                    aiplatform_v1.IndexDatapoint(
+                        datapoint_id=str(id),
+                        feature_vector=embedding,
+                        restricts=metadata if metadata else [],
+                    )
                 )
-                self.index_client.upsert_datapoints(request=upsert_request)
-                insert_datapoints_payload = []
-        if len(insert_datapoints_payload) > 0:
+
             upsert_request = aiplatform_v1.UpsertDatapointsRequest(
                 index=self.index.name, datapoints=insert_datapoints_payload
             )
-            _ = self.index_client.upsert_datapoints(request=upsert_request)
+            self.index_client.upsert_datapoints(request=upsert_request)
+            self._upsert_to_local_index(insert_datapoints_payload, window_texts)
+
+            ids.extend(
+                datapoint.datapoint_id for datapoint in insert_datapoints_payload
+            )
+            self._save_checkpoint(checkpoint_path, run_id, len(ids))
+            logger.info(f"Indexed {len(ids)} documents so far.")
+            if progress_callback:
+                progress_callback(len(ids))
+
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            # The run is complete, a later run must not resume from it.
+            os.remove(checkpoint_path)
 
         logger.debug("Updated index with new configuration.")
         logger.info(f"Indexed {len(ids)} documents to Matching Engine.")
 
         return ids
 
+    @staticmethod
+    def _load_checkpoint(checkpoint_path: Optional[str]) -> Optional[dict]:
+        """Loads the add_texts checkpoint, if there is one.
+
+        Args:
+            checkpoint_path: The location of the checkpoint file.
+
+        Returns:
+            The checkpoint with the run id and the amount of texts indexed
+            so far, or None if there is nothing to resume.
+        """
+        if not checkpoint_path or not os.path.exists(checkpoint_path):
+            return None
+        with open(checkpoint_path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _save_checkpoint(
+        checkpoint_path: Optional[str], run_id: uuid.UUID, count: int
+    ) -> None:
+        """Atomically records the add_texts progress.
+
+        Args:
+            checkpoint_path: The location of the checkpoint file.
+            run_id: The namespace the datapoint ids are derived from.
+            count: The amount of texts indexed so far.
+        """
+        if not checkpoint_path:
+            return
+        tmp_path = f"{checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"run_id": str(run_id), "count": count}, f)
+        os.replace(tmp_path, checkpoint_path)
+
+    def _upsert_to_local_index(
+        self, datapoints: List[aiplatform_v1.IndexDatapoint], texts: List[str]
+    ) -> None:
+        """Mirrors upserted datapoints to the local index, if there is one.
+
+        Args:
+            datapoints: The datapoints upserted to the remote index.
+            texts: The embedded texts, in the same order as the datapoints.
+        """
+        if self.local_index is None:
+            return
+        self.local_index.upsert(
+            ids=[datapoint.datapoint_id for datapoint in datapoints],
+            embeddings=[list(datapoint.feature_vector) for datapoint in datapoints],
+            restricts=[list(datapoint.restricts) for datapoint in datapoints],
+            documents=texts,
+        )
+
     def _upload_to_gcs(self, data: str, gcs_location: str) -> None:
         """Uploads data to gcs_location.
 
@@ -179,6 +284,10 @@ class MatchingEngine(VectorStore):
         Uses public endpoint
 
         """
+        # A single restrict dict is sent as a list of one.
+        restricts = (
+            [filters] if isinstance(filters, dict) and filters else filters or []
+        )
         request_data = {
             "deployed_index_id": index_endpoint.deployed_indexes[0].id,
             "return_full_datapoint": True,
@@ -187,7 +296,7 @@ class MatchingEngine(VectorStore):
                     "datapoint": {
                         "datapoint_id": f"{i}",
                         "feature_vector": emb,
-                        "restricts": filters,
+                        "restricts": restricts,
                     },
                     "neighbor_count": n_matches,
                 }
@@ -228,22 +337,28 @@ class MatchingEngine(VectorStore):
 
         logger.debug(f"Embedding query {query}.")
         embedding_query = self.embedding.embed_documents([query])
-        deployed_index_id = self._get_index_id()
-        logger.debug(f"Deployed Index ID = {deployed_index_id}")
 
-        # TO-DO: Pending query sdk integration
-        # response = self.endpoint.match(
-        #     deployed_index_id=self._get_index_id(),
-        #     queries=embedding_query,
-        #     num_neighbors=k,
-        # )
+        if self.local_index is not None and not self.local_index.is_stale():
+            logger.debug("Querying local index mirror.")
+            neighbors = self.local_index.find_neighbors(embedding_query, k, filters)
+            response = [{"neighbors": query_neighbors} for query_neighbors in neighbors]
+        else:
+            deployed_index_id = self._get_index_id()
+            logger.debug(f"Deployed Index ID = {deployed_index_id}")
+
+            # TO-DO: Pending query sdk integration
+            # response = self.endpoint.match(
+            #     deployed_index_id=self._get_index_id(),
+            #     queries=embedding_query,
+            #     num_neighbors=k,
+            # )
 
-        response = self.get_matches(embedding_query, k, self.endpoint, filters)
+            response = self.get_matches(embedding_query, k, self.endpoint, filters)
 
-        if response.status_code == 200:
-            response = response.json()["nearestNeighbors"]
-        else:
-            raise Exception(f"Failed to query index {str(response)}")
+            if response.status_code == 200:
+                response = response.json()["nearestNeighbors"]
+            else:
+                raise Exception(f"Failed to query index {str(response)}")
 
         if len(response) == 0:
             return []
@@ -256,15 +371,19 @@ class MatchingEngine(VectorStore):
         # and the similarity_search method only receives one query. This
         # means that the match method will always return an array with only
         # one element.
-        for doc in response[0]["neighbors"]:
-            page_content = self._download_from_gcs(
-                f"documents/{doc['datapoint']['datapointId']}"
-            )
+        for doc in response[0].get("neighbors", []):
+            datapoint_id = doc["datapoint"]["datapointId"]
+            page_content = None
+            if self.local_index is not None:
+                page_content = self.local_index.get_document(datapoint_id)
+            if page_content is None:
+                page_content = self._download_from_gcs(f"documents/{datapoint_id}")
             metadata = {}
             if "restricts" in doc["datapoint"]:
                 metadata = {
                     item["namespace"]: item["allowList"][0]
                     for item in doc["datapoint"]["restricts"]
+                    if item.get("allowList")
                 }
             if "distance" in doc:
                 metadata["score"] = doc["distance"]
@@ -352,6 +471,7 @@ class MatchingEngine(VectorStore):
         endpoint_id: str,
         credentials_path: Optional[str] = None,
         embedding: Optional[Embeddings] = None,
+        local_index: Optional[LocalIndex] = None,
     ) -> "MatchingEngine":
         """Takes the object creation out of the constructor.
 
@@ -367,6 +487,8 @@ class MatchingEngine(VectorStore):
             the local file system.
             embedding: The :class:`Embeddings` that will be used for
             embedding the texts.
+            local_index: (Optional) A :class:`LocalIndex` mirror of the index,
+            e.g. one restored with :func:`LocalIndex.load`.
 
         Returns:
             A configured MatchingEngine with the texts added to the index.
@@ -404,6 +526,7 @@ class MatchingEngine(VectorStore):
             index_endpoint_client=index_endpoint_client,
             credentials=credentials,
             gcs_bucket_name=gcs_bucket_name,
+            local_index=local_index,
         )
 
     @classmethod
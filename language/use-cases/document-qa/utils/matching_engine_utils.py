@@ -1,8 +1,9 @@
 # Utility functions to create Index and deploy the index to an Endpoint
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 import logging
 import time
-from typing import Optional
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
 
 from google.api_core.client_options import ClientOptions
 from google.cloud import aiplatform_v1 as aipv1
@@ -11,6 +12,23 @@ from google.protobuf import struct_pb2
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
 
+# Shared pool running the long running operations of all MatchingEngineUtils,
+# so that several indexes can be created and deployed concurrently.
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="matching-engine")
+
+
+class IndexProvisioningError(Exception):
+    """Raised when some indexes could not be provisioned.
+
+    Attributes:
+        errors: The exception raised for every failed index, keyed by index
+        name.
+    """
+
+    def __init__(self, errors: Dict[str, Exception]):
+        super().__init__(f"Failed to provision indexes {list(errors)}")
+        self.errors = errors
+
 
 class MatchingEngineUtils:
     def __init__(
@@ -36,6 +54,45 @@ class MatchingEngineUtils:
             client_options=ClientOptions(api_endpoint=ENDPOINT)
         )
 
+    def _wait_for_operation(
+        self,
+        operation: Any,
+        description: str,
+        progress_callback: Optional[Callable[[str, float], None]] = None,
+        initial_interval: float = 5,
+        max_interval: float = 60,
+        timeout: Optional[float] = None,
+    ):
+        """Polls a long running operation with exponential backoff.
+
+        Args:
+            operation: The long running operation returned by the client.
+            description: What the operation does, used for logging.
+            progress_callback: (Optional) Called after every poll with the
+            description and the seconds elapsed since polling started.
+            initial_interval: Seconds before the first poll.
+            max_interval: Upper bound of the seconds between polls.
+            timeout: (Optional) Seconds after which a TimeoutError is raised.
+
+        Returns:
+            The result of the operation.
+        """
+        logger.info(f"Poll the operation to {description} ...")
+        started = time.monotonic()
+        interval = initial_interval
+        while not operation.done():
+            elapsed = time.monotonic() - started
+            if timeout is not None and elapsed > timeout:
+                raise TimeoutError(
+                    f"Operation to {description} not done after {elapsed:.0f}s"
+                )
+            if progress_callback:
+                progress_callback(description, elapsed)
+            time.sleep(interval)
+            interval = min(interval * 2, max_interval)
+
+        return operation.result()
+
     def get_index(self):
         # Check if index exists
         page_result = self.index_client.list_indexes(
@@ -81,6 +138,11 @@ class MatchingEngineUtils:
         shard_size: str = "SHARD_SIZE_SMALL",
         distance_measure_type: str = "DOT_PRODUCT_DISTANCE",
         description: str = "Index for LangChain demo",
+        progress_callback: Optional[Callable[[str, float], None]] = None,
+        leaf_node_embedding_count: int = 500,
+        leaf_nodes_to_search_percent: int = 7,
+        approximate_neighbors_count: int = 150,
+        timeout: Optional[float] = None,
     ):
         # Get index
         index = self.get_index()
@@ -99,8 +161,12 @@ class MatchingEngineUtils:
             if index_algorithm == "tree-ah":
                 treeAhConfig = struct_pb2.Struct(
                     fields={
-                        "leafNodeEmbeddingCount": struct_pb2.Value(number_value=500),
-                        "leafNodesToSearchPercent": struct_pb2.Value(number_value=7),
+                        "leafNodeEmbeddingCount": struct_pb2.Value(
+                            number_value=leaf_node_embedding_count
+                        ),
+                        "leafNodesToSearchPercent": struct_pb2.Value(
+                            number_value=leaf_nodes_to_search_percent
+                        ),
                     }
                 )
                 algorithmConfig = struct_pb2.Struct(
@@ -117,7 +183,9 @@ class MatchingEngineUtils:
             config = struct_pb2.Struct(
                 fields={
                     "dimensions": struct_pb2.Value(number_value=dimensions),
-                    "approximateNeighborsCount": struct_pb2.Value(number_value=150),
+                    "approximateNeighborsCount": struct_pb2.Value(
+                        number_value=approximate_neighbors_count
+                    ),
                     "distanceMeasureType": struct_pb2.Value(
                         string_value=distance_measure_type
                     ),
@@ -147,14 +215,12 @@ class MatchingEngineUtils:
             )
 
             # Poll the operation until it's done successfully.
-            logging.info("Poll the operation to create index ...")
-            while True:
-                if r.done():
-                    break
-                time.sleep(60)
-                print(".", end="")
-
-            index = r.result()
+            index = self._wait_for_operation(
+                r,
+                f"create index {self.index_name}",
+                progress_callback,
+                timeout=timeout,
+            )
             logger.info(
                 f"Index {self.index_name} created with resource name as {index.name}"
             )
@@ -168,6 +234,8 @@ class MatchingEngineUtils:
         max_replica_count: int = 10,
         public_endpoint_enabled: bool = True,
         network: Optional[str] = None,
+        progress_callback: Optional[Callable[[str, float], None]] = None,
+        timeout: Optional[float] = None,
     ):
         try:
             # Get index if exists
@@ -207,14 +275,12 @@ class MatchingEngineUtils:
                     f"Deploying index to endpoint with long running operation {r._operation.name}"
                 )
 
-                logger.info("Poll the operation to create index endpoint ...")
-                while True:
-                    if r.done():
-                        break
-                    time.sleep(60)
-                    print(".", end="")
-
-                index_endpoint = r.result()
+                index_endpoint = self._wait_for_operation(
+                    r,
+                    f"create index endpoint {self.index_endpoint_name}",
+                    progress_callback,
+                    timeout=timeout,
+                )
                 logger.info(
                     f"Index endpoint {self.index_endpoint_name} created with resource "
                     + f"name as {index_endpoint.name} and endpoint domain name as "
@@ -254,12 +320,12 @@ class MatchingEngineUtils:
             )
 
             # Poll the operation until it's done successfully.
-            logger.info("Poll the operation to deploy index ...")
-            while True:
-                if r.done():
-                    break
-                time.sleep(60)
-                print(".", end="")
+            self._wait_for_operation(
+                r,
+                f"deploy index {self.index_name}",
+                progress_callback,
+                timeout=timeout,
+            )
 
             logger.info(
                 f"Deployed index {self.index_name} to endpoint {self.index_endpoint_name}"
@@ -273,6 +339,44 @@ class MatchingEngineUtils:
 
         return index_endpoint
 
+    def create_index_async(self, *args, **kwargs) -> Future:
+        """Runs `create_index` in the background.
+
+        Takes the same arguments as `create_index`. The returned future
+        resolves to the index; wrap it with `asyncio.wrap_future` to await it.
+        """
+        return _executor.submit(self.create_index, *args, **kwargs)
+
+    def deploy_index_async(self, *args, **kwargs) -> Future:
+        """Runs `deploy_index` in the background.
+
+        Takes the same arguments as `deploy_index`. The returned future
+        resolves to the index endpoint; wrap it with `asyncio.wrap_future`
+        to await it.
+        """
+        return _executor.submit(self.deploy_index, *args, **kwargs)
+
+    def create_and_deploy_index_async(
+        self,
+        create_kwargs: Optional[Dict[str, Any]] = None,
+        deploy_kwargs: Optional[Dict[str, Any]] = None,
+    ) -> Future:
+        """Creates the index and deploys it once created, in the background.
+
+        Args:
+            create_kwargs: Keyword arguments for `create_index`.
+            deploy_kwargs: (Optional) Keyword arguments for `deploy_index`.
+
+        Returns:
+            A future resolving to the index endpoint.
+        """
+
+        def create_and_deploy():
+            self.create_index(**(create_kwargs or {}))
+            return self.deploy_index(**(deploy_kwargs or {}))
+
+        return _executor.submit(create_and_deploy)
+
     def get_index_and_endpoint(self):
         # Get index id if exists
         index = self.get_index()
@@ -334,3 +438,42 @@ class MatchingEngineUtils:
             raise Exception(
                 f"Index endpoint {self.index_endpoint_name} does not exists."
             )
+
+
+def provision_indexes(
+    indexes: Iterable[Tuple[MatchingEngineUtils, Dict[str, Any]]],
+    deploy_kwargs: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Creates and deploys several indexes concurrently.
+
+    Args:
+        indexes: Pairs of a MatchingEngineUtils and the keyword arguments for
+        its `create_index` call, one per index to provision.
+        deploy_kwargs: (Optional) Keyword arguments for `deploy_index`,
+        shared by all indexes.
+
+    Returns:
+        The index endpoint of every index, keyed by index name.
+
+    Raises:
+        IndexProvisioningError: Once every index has finished, if some
+        failed. It holds the exception of every failed index and is chained
+        from the first one.
+    """
+    futures = {
+        me.index_name: me.create_and_deploy_index_async(create_kwargs, deploy_kwargs)
+        for me, create_kwargs in indexes
+    }
+
+    index_endpoints = {}
+    errors: Dict[str, Exception] = {}
+    for index_name, future in futures.items():
+        try:
+            index_endpoints[index_name] = future.result()
+        except Exception as e:
+            logger.error(f"Failed to provision index {index_name}: {e}")
+            errors[index_name] = e
+    if errors:
+        raise IndexProvisioningError(errors) from next(iter(errors.values()))
+
+    return index_endpoints